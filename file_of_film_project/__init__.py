@@ -1,24 +1,24 @@
 # 从各个子模块导入所有公开 API
-from .config import ROOT_DIR
+from .config import ROOT_DIR, STORAGE_BACKEND
 
 from .project import (
     list_all_projects, create_project_folder, delete_project_folder,
-    read_project_info, edit_project_info, get_project_folder
+    read_project_info, edit_project_info, get_project_folder, recover_project_journal
 )
 
 from .text import (
-    read_raw_text, save_raw_text, read_chapter, save_chapter,
-    get_chapter_list, delete_chapter, get_chapter_summary, save_chapter_summary,delete_chapter_summary,get_summary_on_50_chapters,save_summary_on_50_chapters,delete_summary_on_50_chapters,get_overall_summary,save_overall_summary,delete_overall_summary,get_summary_on_50_chapters_list
+    read_raw_text, save_raw_text, open_raw_text, RawTextReader, read_chapter, save_chapter, save_chapters, save_chapter_spans,
+    is_chapter_segmentation_complete, get_chapter_list, delete_chapter, get_chapter_summary, save_chapter_summary,delete_chapter_summary,get_summary_on_50_chapters,save_summary_on_50_chapters,delete_summary_on_50_chapters,get_overall_summary,save_overall_summary,delete_overall_summary,get_summary_on_50_chapters_list
 )
 
 from .shot import (
-    delete_shot, delete_shot_audio, delete_shot_image, delete_shot_video, edit_shot_sequence, get_list_shots, read_shot_audio, read_shot_image, read_shot_info, read_shot_video, save_shot, save_shot_audio, save_shot_image, save_shot_video, update_shot_info, get_shot_path
+    delete_shot, delete_shot_audio, delete_shot_image, delete_shot_video, edit_shot_sequence, get_list_shots, read_shot_audio, read_shot_image, read_shot_info, read_shot_video, save_shot, save_shots, save_shot_audio, save_shot_image, save_shot_video, update_shot_info, update_shots_info, get_shot_path
 )
 
 from .object import (
-    save_object, read_object, delete_object, list_all_objects,
+    save_object, save_objects, object_session, flush_object_session, read_object, delete_object, list_all_objects,
     save_object_image, read_object_image, delete_object_image,
-    read_object_on_chapter
+    read_object_on_chapter, find_object_by_name
 )
 
 from .music import (
@@ -27,4 +27,18 @@ from .music import (
 
 from .asset import (
     delete_unused_image, get_unused_images_list, read_unused_image, save_unused_image
-)
\ No newline at end of file
+)
+
+from .sqlite_backend import migrate_project_to_sqlite
+
+# 使用 SQLite 元数据后端时，用同名函数覆盖上面的文件版本（章节正文、项目配置和二进制素材仍走文件）
+if STORAGE_BACKEND == "sqlite":
+    from .sqlite_backend import (
+        delete_project_folder,
+        get_chapter_summary, save_chapter_summary, delete_chapter_summary, get_summary_on_50_chapters, save_summary_on_50_chapters, delete_summary_on_50_chapters, get_overall_summary, save_overall_summary, delete_overall_summary, get_summary_on_50_chapters_list,
+        delete_shot, delete_shot_audio, delete_shot_image, delete_shot_video, edit_shot_sequence, get_list_shots, read_shot_audio, read_shot_image, read_shot_info, read_shot_video, save_shot, save_shots, save_shot_audio, save_shot_image, save_shot_video, update_shot_info, update_shots_info, get_shot_path,
+        save_object, save_objects, object_session, flush_object_session, read_object, delete_object, list_all_objects,
+        save_object_image, read_object_image, delete_object_image,
+        read_object_on_chapter, find_object_by_name,
+        delete_music_content, delete_music_prompt, get_all_music_ids, read_music_content, read_music_prompt, save_music_content, save_music_prompt
+    )
@@ -2,5 +2,12 @@ import os
 
 ROOT_DIR = "C:\web\project_files"
 
+# 元数据存储后端："file"（YAML/JSON 文件，默认）或 "sqlite"（项目数据.db，见 sqlite_backend.py）
+# 切换到 sqlite 前先用 migrate_project_to_sqlite 导入已有项目
+STORAGE_BACKEND = "file"
+
+# 多文件批量写入（如 save_shots）是否记录回滚日志，崩溃后可整体回滚到写入前的状态
+WRITE_JOURNAL = True
+
 def _get_project_dir(project_name):
     return os.path.join(ROOT_DIR, project_name)
\ No newline at end of file
@@ -1,6 +1,10 @@
 from .config import _get_project_dir
 import os
-from .utils import _load_yaml, _save_yaml, _read_binary, _save_binary
+import copy
+from contextlib import contextmanager
+from .utils import _load_yaml, _save_yaml, _read_binary, _save_binary, _stat_key
+
+OBJECT_TYPES = ["场景", "物品", "角色", "其他对象"]
 
 def _get_object_yaml_path(project_name):
     return os.path.join(_get_project_dir(project_name), "对象", "对象列表.yaml")
@@ -20,7 +24,7 @@ def _update_object_counts(data):
     counts = data.get("基本信息", {})
     categories = data.get("分类数据", {})
     total = 0
-    for key in ["场景", "物品", "角色", "其他对象"]:
+    for key in OBJECT_TYPES:
         # 确保键存在
         if key not in categories: categories[key] = {}
         c = len(categories[key])
@@ -30,84 +34,242 @@ def _update_object_counts(data):
     data["基本信息"] = counts
     return data
 
-def save_object(project_name, object_id, object_data):
+# ==============================================================================
+# 对象索引
+# ==============================================================================
+# 对象列表.yaml 解析后常驻内存，并维护三张索引：
+#   by_id      对象ID -> 类型
+#   by_name    名称 -> {对象ID}；by_alias 别名 -> {对象ID}
+#   by_chapter 章节ID(str) -> {对象ID}
+#   pos        对象ID -> 在所属类型中的先后顺序（与 对象列表.yaml 中的顺序一致，重新保存不变）
+# 按名称/章节查对象只需查表，结果按 (类型, pos) 排序，与 list_all_objects 的顺序一致。索引按文件 (mtime_ns, size) 失效，
+# 外部改动 YAML 后下次访问会整体重建；save_object/delete_object 只增量更新受影响的条目。
+# 集合用 dict 表示以保持插入顺序。
+
+_object_index_cache = {}
+
+# 对象会话：yaml_path -> {"index": 索引, "depth": 嵌套层数, "dirty": 是否有未落盘的修改}
+# 会话期间所有修改只作用于内存索引，退出最外层会话时统一写一次 对象列表.yaml
+_object_sessions = {}
+
+def _object_names(object_data):
+    name = object_data.get("名称")
+    aliases = object_data.get("别名", []) or []
+    if isinstance(aliases, str):
+        aliases = [aliases]
+    return ([str(name)] if name else []), [str(a) for a in aliases if a]
+
+def _object_chapters(object_data):
+    # 兼容不同可能的字段命名
+    chapters = object_data.get("所在章节列表", []) or object_data.get("对象所在章节列表", [])
+    return [str(c) for c in chapters]
+
+def _index_add(index, object_id, obj_type, object_data):
+    index["by_id"][object_id] = obj_type
+    names, aliases = _object_names(object_data)
+    for n in names:
+        index["by_name"].setdefault(n, {})[object_id] = None
+    for n in aliases:
+        index["by_alias"].setdefault(n, {})[object_id] = None
+    for c in _object_chapters(object_data):
+        index["by_chapter"].setdefault(c, {})[object_id] = None
+
+def _index_remove(index, object_id):
+    obj_type = index["by_id"].pop(object_id, None)
+    if obj_type is None:
+        return
+    object_data = index["data"]["分类数据"][obj_type][object_id]
+    names, aliases = _object_names(object_data)
+    for key, values in (("by_name", names), ("by_alias", aliases), ("by_chapter", _object_chapters(object_data))):
+        table = index[key]
+        for v in values:
+            ids = table.get(v)
+            if ids is not None:
+                ids.pop(object_id, None)
+                if not ids:
+                    del table[v]
+
+def _assign_pos(index, object_id):
+    """新加入某个类型的对象排在该类型末尾，与 dict 的插入顺序一致"""
+    index["pos"][object_id] = index["next_pos"]
+    index["next_pos"] += 1
+
+def _order_key(index, object_id):
+    return OBJECT_TYPES.index(index["by_id"][object_id]), index["pos"][object_id]
+
+def _get_object_index(project_name):
     yaml_path = _get_object_yaml_path(project_name)
+    session = _object_sessions.get(yaml_path)
+    if session is not None:
+        # 会话中内存数据比磁盘新，不能按文件状态重建
+        return session["index"]
+    key = _stat_key(yaml_path)
+    cached = _object_index_cache.get(yaml_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
     data = _load_yaml(yaml_path)
     if not data: data = _init_object_yaml_structure()
+    categories = data.setdefault("分类数据", {})
+    index = {"data": data, "by_id": {}, "by_name": {}, "by_alias": {}, "by_chapter": {}, "pos": {}, "next_pos": 0}
+    for obj_type in OBJECT_TYPES:
+        for object_id, object_data in categories.setdefault(obj_type, {}).items():
+            _index_add(index, object_id, obj_type, object_data)
+            _assign_pos(index, object_id)
+    _object_index_cache[yaml_path] = (key, index)
+    return index
+
+def _flush_object_index(project_name, index):
+    yaml_path = _get_object_yaml_path(project_name)
+    session = _object_sessions.get(yaml_path)
+    if session is not None:
+        session["dirty"] = True
+        return
+    index["data"] = _update_object_counts(index["data"])
+    _save_yaml(yaml_path, index["data"])
+    _object_index_cache[yaml_path] = (_stat_key(yaml_path), index)
 
+def _export_object(index, object_id):
+    obj_type = index["by_id"][object_id]
+    res = copy.deepcopy(index["data"]["分类数据"][obj_type][object_id])
+    res["id"] = object_id
+    res["类型"] = obj_type
+    return res
+
+def _put_object(index, object_id, object_data):
+    """在内存索引中写入一个对象，不落盘"""
     # 确定类型，默认为其他对象
     obj_type = object_data.get("类型", "其他对象")
-    valid_types = ["场景", "物品", "角色", "其他对象"]
-    if obj_type not in valid_types: obj_type = "其他对象"
+    if obj_type not in OBJECT_TYPES: obj_type = "其他对象"
 
     # 清理旧数据（防止修改类型后ID重复存在于两个分类下）
-    for t in valid_types:
-        if t != obj_type and object_id in data["分类数据"].get(t, {}):
-            del data["分类数据"][t][object_id]
+    old_type = index["by_id"].get(object_id)
+    _index_remove(index, object_id)
+    categories = index["data"]["分类数据"]
+    if old_type is not None and old_type != obj_type:
+        del categories[old_type][object_id]
+    if old_type != obj_type:
+        # 新对象或修改了类型：排到新类型末尾；同类型重新保存时保持原位置
+        _assign_pos(index, object_id)
 
-    # 保存新数据
-    if obj_type not in data["分类数据"]: 
-        data["分类数据"][obj_type] = {}
-    
-    data["分类数据"][obj_type][object_id] = object_data
-    
-    data = _update_object_counts(data)
-    _save_yaml(yaml_path, data)
+    # 保存新数据（拷贝一份，调用方之后修改传入的字典不会影响索引）
+    object_data = copy.deepcopy(object_data)
+    categories[obj_type][object_id] = object_data
+    _index_add(index, object_id, obj_type, object_data)
+
+def save_object(project_name, object_id, object_data):
+    index = _get_object_index(project_name)
+    _put_object(index, object_id, object_data)
+    _flush_object_index(project_name, index)
     return None
 
-def read_object(project_name, object_id):
-    yaml_path = _get_object_yaml_path(project_name)
-    data = _load_yaml(yaml_path)
-    categories = data.get("分类数据", {})
-    
-    for cat_type, items in categories.items():
-        if object_id in items:
-            res = items[object_id].copy()
-            res["类型"] = cat_type # 补充类型信息
-            return res
+def save_objects(project_name, objects):
+    """
+    批量创建或保存对象。
+    objects: [(object_id, object_data), ...]
+    只写一次 对象列表.yaml。
+    """
+    index = _get_object_index(project_name)
+    for object_id, object_data in objects:
+        _put_object(index, object_id, object_data)
+    _flush_object_index(project_name, index)
     return None
 
-def delete_object(project_name, object_id):
+@contextmanager
+def object_session(project_name):
+    """
+    对象会话：with 块内的 save_object / delete_object / save_object_image 等
+    只修改内存中的对象列表，退出时（包括异常退出）统一写一次 对象列表.yaml。
+    可以嵌套，最外层退出时落盘。
+    """
     yaml_path = _get_object_yaml_path(project_name)
-    data = _load_yaml(yaml_path)
-    categories = data.get("分类数据", {})
-    
-    deleted = False
-    for cat_type, items in categories.items():
-        if object_id in items:
-            del items[object_id]
-            deleted = True
-            break
-            
-    if deleted:
-        data = _update_object_counts(data)
-        _save_yaml(yaml_path, data)
-        # 级联删除图片
-        delete_object_image(project_name, object_id)
+    session = _object_sessions.get(yaml_path)
+    if session is not None:
+        session["depth"] += 1
+    else:
+        session = {"index": _get_object_index(project_name), "depth": 1, "dirty": False}
+        _object_sessions[yaml_path] = session
+    try:
+        yield
+    finally:
+        session["depth"] -= 1
+        if session["depth"] == 0:
+            del _object_sessions[yaml_path]
+            if session["dirty"]:
+                _flush_object_index(project_name, session["index"])
+
+def flush_object_session(project_name):
+    """会话内立即落盘一次已修改的对象，会话继续；不在会话中时为空操作"""
+    yaml_path = _get_object_yaml_path(project_name)
+    session = _object_sessions.get(yaml_path)
+    if session is None or not session["dirty"]:
+        return
+    del _object_sessions[yaml_path]
+    try:
+        _flush_object_index(project_name, session["index"])
+    finally:
+        _object_sessions[yaml_path] = session
+    session["dirty"] = False
+
+def read_object(project_name, object_id):
+    index = _get_object_index(project_name)
+    if object_id not in index["by_id"]:
+        return None
+    res = _export_object(index, object_id)
+    del res["id"]
+    return res
+
+def delete_object(project_name, object_id):
+    index = _get_object_index(project_name)
+    obj_type = index["by_id"].get(object_id)
+    if obj_type is None:
+        return None
+
+    _index_remove(index, object_id)
+    del index["data"]["分类数据"][obj_type][object_id]
+    del index["pos"][object_id]
+    _flush_object_index(project_name, index)
+    # 级联删除图片
+    delete_object_image(project_name, object_id)
     return None
 
 def list_all_objects(project_name, obj_type=None):
-    yaml_path = _get_object_yaml_path(project_name)
-    data = _load_yaml(yaml_path)
-    categories = data.get("分类数据", {})
-    
-    result = []
-    # 辅助函数：提取列表
-    def extract(t):
-        items = categories.get(t, {})
-        for oid, v in items.items():
-            temp = v.copy()
-            temp['id'] = oid
-            temp['类型'] = t
-            result.append(temp)
-
-    if obj_type:
-        extract(obj_type)
-    else:
-        for t in ["场景", "物品", "角色", "其他对象"]:
-            extract(t)
-            
-    return result
+    index = _get_object_index(project_name)
+    categories = index["data"]["分类数据"]
+    types = [obj_type] if obj_type else OBJECT_TYPES
+    return [
+        _export_object(index, oid)
+        for t in types
+        for oid in categories.get(t, {})
+    ]
+
+def find_object_by_name(project_name, name):
+    """
+    按名称或别名查找对象，名称匹配优先于别名匹配。
+    返回对象数据（含 id 和 类型），找不到返回 None。
+    """
+    if not name:
+        return None
+    index = _get_object_index(project_name)
+    s_name = str(name)
+    ids = index["by_name"].get(s_name) or index["by_alias"].get(s_name)
+    if not ids:
+        return None
+    # 同名时取 list_all_objects 顺序中的第一个
+    object_id = min(ids, key=lambda oid: _order_key(index, oid))
+    return _export_object(index, object_id)
+
+def _set_image_ref(project_name, object_id, filename, only_if_present=False):
+    """直接修改内存中对象的 对象图片名 字段（不影响索引），再落盘一次"""
+    index = _get_object_index(project_name)
+    obj_type = index["by_id"].get(object_id)
+    if obj_type is None:
+        return
+    obj = index["data"]["分类数据"][obj_type][object_id]
+    if only_if_present and "对象图片名" not in obj:
+        return
+    obj["对象图片名"] = filename
+    _flush_object_index(project_name, index)
 
 def save_object_image(project_name, object_id, image_data):
     # 假设统一存储为 jpg
@@ -116,10 +278,7 @@ def save_object_image(project_name, object_id, image_data):
     _save_binary(path, image_data)
     
     # 更新yaml中的图片引用
-    obj = read_object(project_name, object_id)
-    if obj:
-        obj["对象图片名"] = filename
-        save_object(project_name, object_id, obj)
+    _set_image_ref(project_name, object_id, filename)
     return None
 
 def read_object_image(project_name, object_id):
@@ -134,21 +293,12 @@ def delete_object_image(project_name, object_id):
         os.remove(path)
     
     # 清除引用
-    obj = read_object(project_name, object_id)
-    if obj and "对象图片名" in obj:
-        obj["对象图片名"] = ""
-        save_object(project_name, object_id, obj)
+    _set_image_ref(project_name, object_id, "", only_if_present=True)
     return None
 
 def read_object_on_chapter(project_name, chapter_id):
-    """读取该章节关联的所有对象"""
-    all_objs = list_all_objects(project_name)
-    res = []
-    s_cid = str(chapter_id)
-    for obj in all_objs:
-        # 兼容不同可能的字段命名
-        chapters = obj.get("所在章节列表", []) or obj.get("对象所在章节列表", [])
-        # 确保转字符串比较
-        if s_cid in [str(x) for x in chapters]:
-            res.append(obj)
-    return res
\ No newline at end of file
+    """读取该章节关联的所有对象（走章节索引）"""
+    index = _get_object_index(project_name)
+    ids = index["by_chapter"].get(str(chapter_id), {})
+    ordered = sorted(ids, key=lambda oid: _order_key(index, oid))
+    return [_export_object(index, oid) for oid in ordered]
@@ -1,7 +1,7 @@
 from .config import _get_project_dir , ROOT_DIR
 import os
 import shutil
-from .utils import _ensure_dir, _load_yaml, _save_yaml
+from .utils import _ensure_dir, _load_yaml, _save_yaml, _recover_journal
 
 def _init_object_yaml_structure():
     return {
@@ -27,6 +27,16 @@ def delete_project_folder(project_name):
         shutil.rmtree(path)
     return None
 
+def recover_project_journal(project_name):
+    """
+    检查项目目录下是否残留回滚日志（上次批量写入中途崩溃），有则把相关文件恢复到写入前的状态。
+    返回恢复的文件数，没有残留日志时返回 0。
+    """
+    path = _get_project_dir(project_name)
+    if not os.path.exists(path):
+        return 0
+    return _recover_journal(path)
+
 def list_all_projects():
     """
     列出ROOT_DIR下所有的项目名称
@@ -1,6 +1,6 @@
 import uuid
 from .config import _get_project_dir
-from .utils import _save_yaml, _load_yaml, _ensure_dir, _save_binary, _read_binary
+from .utils import _save_yaml, _load_yaml, _ensure_dir, _save_binary, _read_binary, _stat_key, _journal
 import os
 import shutil
 
@@ -37,7 +37,9 @@ def _resolve_shot_path(project_name, shot_id, create_if_new=False):
         #print('—'*20)
         #print(sequence)#debug
         #print('—'*20)
-        sequence[index]=folder_name
+        # 缓存中的列表是共享的，修改前先复制
+        sequence = list(sequence)
+        sequence.append(folder_name)
         _save_shot_sequence(project_name, sequence)
         
         full_path = os.path.join(_get_project_dir(project_name), "镜头", folder_name)
@@ -50,25 +52,33 @@ def _get_sequence_path(project_name):
     # 后缀改为 yaml
     return os.path.join(_get_project_dir(project_name), "镜头", "镜头顺序.yaml")
 
+# 进程内镜头顺序缓存：sequence_path -> (stat_key, sequence)
+# 本进程写入时直接更新缓存；文件被外部修改时 (mtime, size) 变化，重新解析。
+# 返回的列表是共享对象，调用方只读，需要修改时先复制。
+_sequence_cache = {}
+
 def _get_shot_sequence(project_name):
     path = _get_sequence_path(project_name)
+    key = _stat_key(path)
+    if key is None:
+        return []
+    cached = _sequence_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
     # 使用 yaml 读取
-    return _load_yaml(path) if os.path.exists(path) else []
+    sequence = _load_yaml(path) or []
+    _sequence_cache[path] = (key, sequence)
+    return sequence
 
 def _save_shot_sequence(project_name, sequence_list):
     path = _get_sequence_path(project_name)
     # 使用 yaml 保存
     _save_yaml(path, sequence_list)
+    _sequence_cache[path] = (_stat_key(path), list(sequence_list))
 
 # _resolve_shot_path 逻辑保持不变，它只负责找文件夹路径
 
-def save_shot(project_name, shot_id, shot_info):
-    shot_dir, _ = _resolve_shot_path(project_name, shot_id, create_if_new=True)
-    if not shot_dir: return None
-
-    # 修改：文件名改为 镜头内容.yaml
-    yaml_path = os.path.join(shot_dir, "镜头内容.yaml")
-    
+def _build_shot_content(shot_info):
     content_data = {
 
         "镜头图片提示词": shot_info.get("prompt", ""),
@@ -84,7 +94,50 @@ def save_shot(project_name, shot_id, shot_info):
         "主要对象状态": shot_info.get("object_state", "default"),
         "次要对象": shot_info.get("secondary_objects", []),
     }
-    _save_yaml(yaml_path, content_data)
+    # 分镜阶段的断点信息，供 _process_text_to_shots_blueprint 续跑
+    if "blueprint_meta" in shot_info:
+        content_data["blueprint_meta"] = shot_info["blueprint_meta"]
+    return content_data
+
+def save_shot(project_name, shot_id, shot_info):
+    save_shots(project_name, [(shot_id, shot_info)])
+    return None
+
+def save_shots(project_name, shots):
+    """
+    批量创建或保存镜头。
+    shots: [(shot_id, shot_info), ...]
+    先为新镜头分配文件夹并写入所有 镜头内容.yaml，最后只写一次 镜头顺序.yaml。
+    """
+    # 整批写入记录回滚日志：中途崩溃时已写的镜头文件会被恢复，不会出现半批数据
+    with _journal(_get_project_dir(project_name)):
+        sequence = list(_get_shot_sequence(project_name))
+        shots_root = os.path.join(_get_project_dir(project_name), "镜头")
+        sequence_changed = False
+
+        for shot_id, shot_info in shots:
+            try:
+                index = int(shot_id) - 1
+            except ValueError:
+                continue
+            if index < 0:
+                continue
+
+            if index < len(sequence):
+                folder_name = sequence[index]
+            else:
+                # 新镜头直接追加到末尾（与 _resolve_shot_path 一致）
+                folder_name = f"镜头_{uuid.uuid4().hex[:8]}"
+                sequence.append(folder_name)
+                sequence_changed = True
+
+            shot_dir = os.path.join(shots_root, folder_name)
+            # 修改：文件名改为 镜头内容.yaml
+            _save_yaml(os.path.join(shot_dir, "镜头内容.yaml"), _build_shot_content(shot_info))
+
+        # 所有镜头文件写完后再更新顺序表，中途失败不会留下指向空文件夹的ID
+        if sequence_changed:
+            _save_shot_sequence(project_name, sequence)
     return None
 
 def update_shot_info(project_name, shot_id, shot_info):
@@ -97,6 +150,28 @@ def update_shot_info(project_name, shot_id, shot_info):
     _save_yaml(yaml_path, current_data)
     return None
 
+def update_shots_info(project_name, updates):
+    """
+    批量更新已有镜头的部分字段。
+    updates: [(shot_id, shot_info), ...]，不存在的镜头ID直接跳过。
+    顺序表只读一次，整批写入记录回滚日志。
+    """
+    sequence = _get_shot_sequence(project_name)
+    shots_root = os.path.join(_get_project_dir(project_name), "镜头")
+    with _journal(_get_project_dir(project_name)):
+        for shot_id, shot_info in updates:
+            try:
+                index = int(shot_id) - 1
+            except ValueError:
+                continue
+            if not 0 <= index < len(sequence):
+                continue
+            yaml_path = os.path.join(shots_root, sequence[index], "镜头内容.yaml")
+            current_data = _load_yaml(yaml_path)
+            current_data.update(shot_info)
+            _save_yaml(yaml_path, current_data)
+    return None
+
 def read_shot_info(project_name, shot_id):
     shot_dir, _ = _resolve_shot_path(project_name, shot_id)
     if not shot_dir: return {}
@@ -109,7 +184,7 @@ def delete_shot(project_name, shot_id):
     1. 删除物理文件夹
     2. 从顺序列表中移除（后续镜头的ID会前移）
     """
-    sequence = _get_shot_sequence(project_name)
+    sequence = list(_get_shot_sequence(project_name))
     try:
         index = int(shot_id) - 1
         if 0 <= index < len(sequence):
@@ -0,0 +1,639 @@
+"""
+SQLite 元数据后端。
+
+镜头、对象、各级总结和音乐的元数据存放在 项目名/项目数据.db 中，
+图片、音频、视频等二进制素材仍按原目录结构存放在磁盘上。
+函数签名与文件后端完全一致，在 config.STORAGE_BACKEND = "sqlite" 时
+由 __init__.py 导出以替换对应的文件版本。
+
+旧项目可用 migrate_project_to_sqlite(project_name) 导入，或直接运行：
+    python -m file_of_film_project.sqlite_backend 项目名
+"""
+import os
+import json
+import uuid
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .config import _get_project_dir
+from .utils import _ensure_dir, _load_json, _load_yaml, _read_text_file, _save_binary, _read_binary
+from . import project as _file_project
+from .shot import _build_shot_content
+
+DB_NAME = "项目数据.db"
+
+OBJECT_TYPES = ["场景", "物品", "角色", "其他对象"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    kind TEXT NOT NULL,         -- chapter / summary_50 / overall
+    id NOT NULL,                -- 不声明类型，保留调用方传入的 int/str
+    pos INTEGER NOT NULL,
+    content TEXT,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_pos ON summaries(kind, pos);
+
+CREATE TABLE IF NOT EXISTS shots (
+    folder TEXT PRIMARY KEY,    -- 镜头/ 下的物理文件夹名
+    pos INTEGER NOT NULL,       -- 逻辑 shot_id，从 1 连续编号
+    info TEXT NOT NULL          -- 镜头内容 (JSON)
+);
+CREATE INDEX IF NOT EXISTS idx_shots_pos ON shots(pos);
+
+CREATE TABLE IF NOT EXISTS objects (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    data TEXT NOT NULL          -- 对象数据 (JSON)
+);
+CREATE INDEX IF NOT EXISTS idx_objects_type ON objects(type, pos);
+
+CREATE TABLE IF NOT EXISTS object_names (
+    name TEXT NOT NULL,
+    object_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_object_names_name ON object_names(name);
+CREATE INDEX IF NOT EXISTS idx_object_names_object ON object_names(object_id);
+
+CREATE TABLE IF NOT EXISTS object_chapters (
+    chapter TEXT NOT NULL,
+    object_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_object_chapters_chapter ON object_chapters(chapter);
+CREATE INDEX IF NOT EXISTS idx_object_chapters_object ON object_chapters(object_id);
+
+CREATE TABLE IF NOT EXISTS music (
+    id PRIMARY KEY,
+    pos INTEGER NOT NULL,
+    prompt TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_music_pos ON music(pos);
+"""
+
+# ==============================================================================
+# 连接管理
+# ==============================================================================
+
+# (线程ID, 数据库路径) -> 连接。sqlite3 连接不能跨线程使用，每个线程各自持有。
+_connections = {}
+_connections_lock = threading.Lock()
+
+def _get_db_path(project_name):
+    return os.path.join(_get_project_dir(project_name), DB_NAME)
+
+def _connect(project_name):
+    path = _get_db_path(project_name)
+    key = (threading.get_ident(), path)
+    conn = _connections.get(key)
+    if conn is not None:
+        return conn
+
+    _ensure_dir(os.path.dirname(path))
+    # isolation_level=None：由 _transaction 显式控制事务边界
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    with _connections_lock:
+        _connections[key] = conn
+    return conn
+
+def close_connections(project_name):
+    """关闭所有线程中打开的该项目数据库连接（删除项目文件夹前必须调用）"""
+    path = _get_db_path(project_name)
+    with _connections_lock:
+        for key in [k for k in _connections if k[1] == path]:
+            _connections.pop(key).close()
+
+@contextmanager
+def _transaction(project_name):
+    """一个事务内的批量更新，异常时整体回滚"""
+    conn = _connect(project_name)
+    if conn.in_transaction:
+        # 嵌套调用并入外层事务
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+def _next_pos(conn, table, where="", params=()):
+    row = conn.execute(f"SELECT COALESCE(MAX(pos), 0) + 1 FROM {table} {where}", params).fetchone()
+    return row[0]
+
+def delete_project_folder(project_name):
+    """删除整个项目（先关闭数据库连接）"""
+    close_connections(project_name)
+    return _file_project.delete_project_folder(project_name)
+
+# ==============================================================================
+# 总结
+# ==============================================================================
+
+def _get_summary(project_name, kind, summary_id):
+    row = _connect(project_name).execute(
+        "SELECT content FROM summaries WHERE kind=? AND id=?", (kind, summary_id)
+    ).fetchone()
+    return row[0] if row else None
+
+def _save_summary(project_name, kind, summary_id, content):
+    with _transaction(project_name) as conn:
+        updated = conn.execute(
+            "UPDATE summaries SET content=? WHERE kind=? AND id=?", (content, kind, summary_id)
+        ).rowcount
+        if not updated:
+            pos = _next_pos(conn, "summaries", "WHERE kind=?", (kind,))
+            conn.execute(
+                "INSERT INTO summaries (kind, id, pos, content) VALUES (?, ?, ?, ?)",
+                (kind, summary_id, pos, content)
+            )
+    return None
+
+def _delete_summary(project_name, kind, summary_id):
+    with _transaction(project_name) as conn:
+        conn.execute("DELETE FROM summaries WHERE kind=? AND id=?", (kind, summary_id))
+    return None
+
+def get_chapter_summary(project_name, chapter_id):
+    return _get_summary(project_name, "chapter", chapter_id)
+
+def save_chapter_summary(project_name, chapter_id, summary):
+    return _save_summary(project_name, "chapter", chapter_id, summary)
+
+def delete_chapter_summary(project_name, chapter_id):
+    return _delete_summary(project_name, "chapter", chapter_id)
+
+def get_summary_on_50_chapters(project_name, summary_on_50_ids):
+    return _get_summary(project_name, "summary_50", summary_on_50_ids)
+
+def get_summary_on_50_chapters_list(project_name):
+    rows = _connect(project_name).execute(
+        "SELECT id FROM summaries WHERE kind='summary_50' ORDER BY pos"
+    ).fetchall()
+    return [r[0] for r in rows]
+
+def save_summary_on_50_chapters(project_name, summary_on_50_ids, summaries):
+    return _save_summary(project_name, "summary_50", summary_on_50_ids, summaries)
+
+def delete_summary_on_50_chapters(project_name, summary_on_50_ids):
+    return _delete_summary(project_name, "summary_50", summary_on_50_ids)
+
+def get_overall_summary(project_name):
+    return _get_summary(project_name, "overall", "全文总结")
+
+def save_overall_summary(project_name, summary):
+    return _save_summary(project_name, "overall", "全文总结", summary)
+
+def delete_overall_summary(project_name):
+    return _delete_summary(project_name, "overall", "全文总结")
+
+# ==============================================================================
+# 镜头
+# ==============================================================================
+
+def _shots_root(project_name):
+    return os.path.join(_get_project_dir(project_name), "镜头")
+
+def _shot_pos(shot_id):
+    try:
+        pos = int(shot_id)
+    except ValueError:
+        return None
+    return pos if pos >= 1 else None
+
+def get_shot_path(project_name, shot_id):
+    pos = _shot_pos(shot_id)
+    if pos is None:
+        return None
+    row = _connect(project_name).execute("SELECT folder FROM shots WHERE pos=?", (pos,)).fetchone()
+    return os.path.join(_shots_root(project_name), row[0]) if row else None
+
+def save_shot(project_name, shot_id, shot_info):
+    save_shots(project_name, [(shot_id, shot_info)])
+    return None
+
+def save_shots(project_name, shots):
+    """批量创建或保存镜头，所有镜头在一个事务中写入"""
+    with _transaction(project_name) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM shots").fetchone()[0]
+        for shot_id, shot_info in shots:
+            pos = _shot_pos(shot_id)
+            if pos is None:
+                continue
+            info = _dumps(_build_shot_content(shot_info))
+            if pos <= count:
+                conn.execute("UPDATE shots SET info=? WHERE pos=?", (info, pos))
+            else:
+                # 新镜头直接追加到末尾
+                folder_name = f"镜头_{uuid.uuid4().hex[:8]}"
+                _ensure_dir(os.path.join(_shots_root(project_name), folder_name))
+                count += 1
+                conn.execute("INSERT INTO shots (folder, pos, info) VALUES (?, ?, ?)", (folder_name, count, info))
+    return None
+
+def update_shot_info(project_name, shot_id, shot_info):
+    return update_shots_info(project_name, [(shot_id, shot_info)])
+
+def update_shots_info(project_name, updates):
+    """批量更新已有镜头的部分字段，所有更新在一个事务中写入"""
+    with _transaction(project_name) as conn:
+        for shot_id, shot_info in updates:
+            pos = _shot_pos(shot_id)
+            if pos is None:
+                continue
+            row = conn.execute("SELECT info FROM shots WHERE pos=?", (pos,)).fetchone()
+            if not row:
+                continue
+            current_data = json.loads(row[0])
+            current_data.update(shot_info)
+            conn.execute("UPDATE shots SET info=? WHERE pos=?", (_dumps(current_data), pos))
+    return None
+
+def read_shot_info(project_name, shot_id):
+    pos = _shot_pos(shot_id)
+    if pos is None:
+        return {}
+    row = _connect(project_name).execute("SELECT info FROM shots WHERE pos=?", (pos,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
+def delete_shot(project_name, shot_id):
+    """删除镜头文件夹，后续镜头的ID前移"""
+    pos = _shot_pos(shot_id)
+    if pos is None:
+        return None
+    with _transaction(project_name) as conn:
+        row = conn.execute("SELECT folder FROM shots WHERE pos=?", (pos,)).fetchone()
+        if not row:
+            return None
+        conn.execute("DELETE FROM shots WHERE pos=?", (pos,))
+        conn.execute("UPDATE shots SET pos = pos - 1 WHERE pos > ?", (pos,))
+    shot_dir = os.path.join(_shots_root(project_name), row[0])
+    if os.path.exists(shot_dir):
+        shutil.rmtree(shot_dir)
+    return None
+
+def get_list_shots(project_name):
+    count = _connect(project_name).execute("SELECT COUNT(*) FROM shots").fetchone()[0]
+    return list(range(1, count + 1))
+
+def edit_shot_sequence(project_name, new_sequence_list):
+    """
+    修改镜头顺序，new_sequence_list 为旧逻辑ID的新排列，
+    数量与现有镜头数不一致时不做修改（与文件后端一致）。
+    """
+    with _transaction(project_name) as conn:
+        rows = conn.execute("SELECT folder FROM shots ORDER BY pos").fetchall()
+        current_sequence = [r[0] for r in rows]
+        if not current_sequence:
+            return None
+
+        new_physical_order = []
+        for old_logical_id in new_sequence_list:
+            try:
+                index = int(old_logical_id) - 1
+                if 0 <= index < len(current_sequence):
+                    new_physical_order.append(current_sequence[index])
+            except ValueError:
+                pass
+
+        if len(new_physical_order) != len(current_sequence):
+            print(f"Error: Sequence length mismatch. Expected {len(current_sequence)}, got {len(new_physical_order)}")
+            return None
+
+        conn.executemany(
+            "UPDATE shots SET pos=? WHERE folder=?",
+            [(i, folder) for i, folder in enumerate(new_physical_order, 1)]
+        )
+    return None
+
+def _shot_file(project_name, shot_id, filename):
+    shot_dir = get_shot_path(project_name, shot_id)
+    return os.path.join(shot_dir, filename) if shot_dir else None
+
+def _save_shot_file(project_name, shot_id, filename, data):
+    path = _shot_file(project_name, shot_id, filename)
+    if path:
+        _save_binary(path, data)
+    return None
+
+def _read_shot_file(project_name, shot_id, filename):
+    path = _shot_file(project_name, shot_id, filename)
+    return _read_binary(path) if path else None
+
+def _delete_shot_file(project_name, shot_id, filename):
+    path = _shot_file(project_name, shot_id, filename)
+    if path and os.path.exists(path):
+        os.remove(path)
+    return None
+
+def save_shot_image(project_name, shot_id, image_data):
+    return _save_shot_file(project_name, shot_id, "图片.jpg", image_data)
+
+def read_shot_image(project_name, shot_id):
+    return _read_shot_file(project_name, shot_id, "图片.jpg")
+
+def delete_shot_image(project_name, shot_id):
+    return _delete_shot_file(project_name, shot_id, "图片.jpg")
+
+def save_shot_audio(project_name, shot_id, audio_data):
+    return _save_shot_file(project_name, shot_id, "语音.mp3", audio_data)
+
+def read_shot_audio(project_name, shot_id):
+    return _read_shot_file(project_name, shot_id, "语音.mp3")
+
+def delete_shot_audio(project_name, shot_id):
+    return _delete_shot_file(project_name, shot_id, "语音.mp3")
+
+def save_shot_video(project_name, shot_id, video_data):
+    return _save_shot_file(project_name, shot_id, "视频.mp4", video_data)
+
+def read_shot_video(project_name, shot_id):
+    return _read_shot_file(project_name, shot_id, "视频.mp4")
+
+def delete_shot_video(project_name, shot_id):
+    return _delete_shot_file(project_name, shot_id, "视频.mp4")
+
+# ==============================================================================
+# 对象
+# ==============================================================================
+
+_TYPE_ORDER_SQL = "CASE type " + " ".join(
+    f"WHEN '{t}' THEN {i}" for i, t in enumerate(OBJECT_TYPES)
+) + " END"
+
+def _object_names(object_data):
+    names = [object_data.get("名称")] + list(object_data.get("别名", []) or [])
+    return {str(n) for n in names if n}
+
+def _object_chapters(object_data):
+    # 兼容不同可能的字段命名
+    chapters = object_data.get("所在章节列表", []) or object_data.get("对象所在章节列表", [])
+    return {str(c) for c in chapters}
+
+def _row_to_object(row):
+    object_id, obj_type, data = row
+    res = json.loads(data)
+    res["id"] = object_id
+    res["类型"] = obj_type
+    return res
+
+def save_object(project_name, object_id, object_data):
+    # 确定类型，默认为其他对象
+    obj_type = object_data.get("类型", "其他对象")
+    if obj_type not in OBJECT_TYPES: obj_type = "其他对象"
+
+    with _transaction(project_name) as conn:
+        row = conn.execute("SELECT type, pos FROM objects WHERE id=?", (object_id,)).fetchone()
+        if row and row[0] == obj_type:
+            pos = row[1]
+        else:
+            # 新对象或修改了类型：排到该类型末尾
+            pos = _next_pos(conn, "objects", "WHERE type=?", (obj_type,))
+        conn.execute(
+            "INSERT OR REPLACE INTO objects (id, type, pos, data) VALUES (?, ?, ?, ?)",
+            (object_id, obj_type, pos, _dumps(object_data))
+        )
+        conn.execute("DELETE FROM object_names WHERE object_id=?", (object_id,))
+        conn.execute("DELETE FROM object_chapters WHERE object_id=?", (object_id,))
+        conn.executemany(
+            "INSERT INTO object_names (name, object_id) VALUES (?, ?)",
+            [(n, object_id) for n in _object_names(object_data)]
+        )
+        conn.executemany(
+            "INSERT INTO object_chapters (chapter, object_id) VALUES (?, ?)",
+            [(c, object_id) for c in _object_chapters(object_data)]
+        )
+    return None
+
+def save_objects(project_name, objects):
+    """批量创建或保存对象，所有对象在一个事务中写入"""
+    with _transaction(project_name):
+        for object_id, object_data in objects:
+            save_object(project_name, object_id, object_data)
+    return None
+
+@contextmanager
+def object_session(project_name):
+    """
+    与文件后端接口一致。SQLite 下每次保存只写一行，不需要缓冲；
+    也不在会话期间持有写事务，避免长时间的 LLM 调用阻塞其他写入。
+    """
+    yield
+
+def flush_object_session(project_name):
+    """与文件后端接口一致；SQLite 下每次保存已落盘"""
+    return None
+
+def read_object(project_name, object_id):
+    row = _connect(project_name).execute(
+        "SELECT type, data FROM objects WHERE id=?", (object_id,)
+    ).fetchone()
+    if not row:
+        return None
+    res = json.loads(row[1])
+    res["类型"] = row[0] # 补充类型信息
+    return res
+
+def delete_object(project_name, object_id):
+    with _transaction(project_name) as conn:
+        deleted = conn.execute("DELETE FROM objects WHERE id=?", (object_id,)).rowcount
+        conn.execute("DELETE FROM object_names WHERE object_id=?", (object_id,))
+        conn.execute("DELETE FROM object_chapters WHERE object_id=?", (object_id,))
+    if deleted:
+        # 级联删除图片
+        delete_object_image(project_name, object_id)
+    return None
+
+def list_all_objects(project_name, obj_type=None):
+    conn = _connect(project_name)
+    if obj_type:
+        rows = conn.execute(
+            "SELECT id, type, data FROM objects WHERE type=? ORDER BY pos", (obj_type,)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f"SELECT id, type, data FROM objects ORDER BY {_TYPE_ORDER_SQL}, pos"
+        ).fetchall()
+    return [_row_to_object(r) for r in rows]
+
+def find_object_by_name(project_name, name):
+    """按名称或别名查找对象（走 object_names 索引），名称匹配优先于别名匹配"""
+    if not name:
+        return None
+    rows = _connect(project_name).execute(
+        f"SELECT id, type, data FROM objects WHERE id IN "
+        f"(SELECT object_id FROM object_names WHERE name=?) ORDER BY {_TYPE_ORDER_SQL}, pos",
+        (str(name),)
+    ).fetchall()
+    objects = [_row_to_object(r) for r in rows]
+    for obj in objects:
+        if obj.get("名称") == name:
+            return obj
+    return objects[0] if objects else None
+
+def read_object_on_chapter(project_name, chapter_id):
+    """读取该章节关联的所有对象（走 object_chapters 索引）"""
+    rows = _connect(project_name).execute(
+        f"SELECT id, type, data FROM objects WHERE id IN "
+        f"(SELECT object_id FROM object_chapters WHERE chapter=?) ORDER BY {_TYPE_ORDER_SQL}, pos",
+        (str(chapter_id),)
+    ).fetchall()
+    return [_row_to_object(r) for r in rows]
+
+def _object_image_path(project_name, object_id):
+    return os.path.join(_get_project_dir(project_name), "对象", "对象图片", f"{object_id}.jpg")
+
+def save_object_image(project_name, object_id, image_data):
+    _save_binary(_object_image_path(project_name, object_id), image_data)
+    # 更新图片引用
+    obj = read_object(project_name, object_id)
+    if obj:
+        obj["对象图片名"] = f"{object_id}.jpg"
+        save_object(project_name, object_id, obj)
+    return None
+
+def read_object_image(project_name, object_id):
+    return _read_binary(_object_image_path(project_name, object_id))
+
+def delete_object_image(project_name, object_id):
+    path = _object_image_path(project_name, object_id)
+    if os.path.exists(path):
+        os.remove(path)
+    # 清除引用
+    obj = read_object(project_name, object_id)
+    if obj and "对象图片名" in obj:
+        obj["对象图片名"] = ""
+        save_object(project_name, object_id, obj)
+    return None
+
+# ==============================================================================
+# 音乐
+# ==============================================================================
+
+def _save_music_field(project_name, music_id, field, value):
+    with _transaction(project_name) as conn:
+        updated = conn.execute(f"UPDATE music SET {field}=? WHERE id=?", (value, music_id)).rowcount
+        if not updated:
+            conn.execute(
+                f"INSERT INTO music (id, pos, {field}) VALUES (?, ?, ?)",
+                (music_id, _next_pos(conn, "music"), value)
+            )
+    return None
+
+def _read_music_field(project_name, music_id, field):
+    row = _connect(project_name).execute(f"SELECT {field} FROM music WHERE id=?", (music_id,)).fetchone()
+    return row[0] if row else None
+
+def save_music_prompt(project_name, music_id, prompt):
+    return _save_music_field(project_name, music_id, "prompt", prompt)
+
+def read_music_prompt(project_name, music_id):
+    return _read_music_field(project_name, music_id, "prompt")
+
+def delete_music_prompt(project_name, music_id):
+    with _transaction(project_name) as conn:
+        # 设为空字符串，保留记录
+        conn.execute("UPDATE music SET prompt='' WHERE id=? AND prompt IS NOT NULL", (music_id,))
+    return None
+
+def save_music_content(project_name, music_id, content):
+    return _save_music_field(project_name, music_id, "content", content)
+
+def read_music_content(project_name, music_id):
+    return _read_music_field(project_name, music_id, "content")
+
+def delete_music_content(project_name, music_id):
+    with _transaction(project_name) as conn:
+        conn.execute("UPDATE music SET content='' WHERE id=?", (music_id,))
+    return None
+
+def get_all_music_ids(project_name):
+    rows = _connect(project_name).execute("SELECT id FROM music ORDER BY pos").fetchall()
+    return [r[0] for r in rows]
+
+# ==============================================================================
+# 迁移工具
+# ==============================================================================
+
+def migrate_project_to_sqlite(project_name):
+    """
+    把文件后端（YAML/JSON）的元数据导入 项目数据.db。
+    镜头沿用原来的物理文件夹，二进制素材不移动；原文件保留不删除。
+    在一个事务中完成，失败时数据库保持原样。
+    """
+    base = _get_project_dir(project_name)
+    text_dir = os.path.join(base, "文本")
+    counts = {}
+
+    with _transaction(project_name) as conn:
+        for table in ["summaries", "shots", "objects", "object_names", "object_chapters", "music"]:
+            conn.execute(f"DELETE FROM {table}")
+
+        # 1. 总结
+        n = 0
+        for kind, file_name in [("chapter", "每章总结.json"), ("summary_50", "每50章总结.json")]:
+            data = _load_json(os.path.join(text_dir, file_name))
+            for pos, (k, v) in enumerate(((k, v) for k, v in data.items() if k != 'counts'), 1):
+                conn.execute(
+                    "INSERT INTO summaries (kind, id, pos, content) VALUES (?, ?, ?, ?)", (kind, k, pos, v)
+                )
+                n += 1
+        overall = _read_text_file(os.path.join(text_dir, "全文总结.txt"))
+        if overall is not None:
+            conn.execute(
+                "INSERT INTO summaries (kind, id, pos, content) VALUES ('overall', '全文总结', 1, ?)", (overall,)
+            )
+            n += 1
+        counts["总结"] = n
+
+        # 2. 镜头：沿用 镜头顺序.yaml 中的文件夹
+        sequence = _load_yaml(os.path.join(base, "镜头", "镜头顺序.yaml")) or []
+        for pos, folder_name in enumerate(sequence, 1):
+            info = _load_yaml(os.path.join(base, "镜头", folder_name, "镜头内容.yaml"))
+            conn.execute(
+                "INSERT INTO shots (folder, pos, info) VALUES (?, ?, ?)", (folder_name, pos, _dumps(info))
+            )
+        counts["镜头"] = len(sequence)
+
+        # 3. 对象
+        n = 0
+        categories = _load_yaml(os.path.join(base, "对象", "对象列表.yaml")).get("分类数据", {})
+        for obj_type in OBJECT_TYPES:
+            for object_id, object_data in (categories.get(obj_type) or {}).items():
+                save_object(project_name, object_id, dict(object_data, **{"类型": obj_type}))
+                n += 1
+        counts["对象"] = n
+
+        # 4. 音乐
+        music = _load_yaml(os.path.join(base, "音乐", "音乐列表.yaml"))
+        for pos, (music_id, entry) in enumerate(music.items(), 1):
+            entry = entry or {}
+            conn.execute(
+                "INSERT INTO music (id, pos, prompt, content) VALUES (?, ?, ?, ?)",
+                (music_id, pos, entry.get("音乐prompt"), entry.get("音乐内容"))
+            )
+        counts["音乐"] = len(music)
+
+    print(f"[{project_name}] 已迁移到 SQLite: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把 YAML/JSON 项目导入 SQLite 元数据后端")
+    parser.add_argument("projects", nargs="+", help="项目名称")
+    args = parser.parse_args()
+    for name in args.projects:
+        migrate_project_to_sqlite(name)
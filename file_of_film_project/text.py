@@ -1,6 +1,8 @@
 from .config import _get_project_dir
 import os
-from .utils import _load_json, _save_json, _read_text_file, _save_text_file
+import json
+import mmap
+from .utils import _load_json, _save_json, _read_text_file, _save_text_file, _ensure_dir, _stat_key
 
 def read_raw_text(project_name):
     """
@@ -14,46 +16,244 @@ def read_raw_text(project_name):
 
 def save_raw_text(project_name, text):
     file_path = os.path.join(_get_project_dir(project_name), "文本", "原文.txt")
+    _close_mmap(file_path)
     _save_text_file(file_path, text)
+    # 章节可能直接引用原文的字节范围，原文变化后这些范围失效，需要重新切分
+    index = _load_chapter_index(project_name)
+    if any(entry[0] == _RAW_TEXT_NAME for entry in index["chapters"].values()):
+        print(f"[{project_name}] 原文已更新，旧的章节索引作废，需要重新切分章节。")
+        _save_chapter_index(project_name, _empty_chapter_index())
     return None
 
+# 内存映射缓存：path -> (stat_key, file_obj, mmap)
+# 文件被改写后 stat_key 变化，下次访问时重新映射
+_mmap_cache = {}
+
+def _close_mmap(path):
+    cached = _mmap_cache.pop(path, None)
+    if cached:
+        _, f, mm = cached
+        if mm is not None:
+            mm.close()
+        f.close()
+
+def _get_mmap(path):
+    """返回文件的只读内存映射（空文件返回 b""），不存在返回 None"""
+    key = _stat_key(path)
+    if key is None:
+        _close_mmap(path)
+        return None
+    cached = _mmap_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[2] if cached[2] is not None else b""
+    _close_mmap(path)
+    f = open(path, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if key[1] > 0 else None
+    _mmap_cache[path] = (key, f, mm)
+    return mm if mm is not None else b""
+
+class RawTextReader:
+    """
+    原文.txt 的只读内存映射视图。
+    所有位置均为 UTF-8 字节偏移，只在需要时解码指定范围，
+    切分章节时无需把整本小说读成一个字符串。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        size = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+
+    def __len__(self):
+        return len(self._mm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+    def finditer(self, pattern):
+        """在字节层面执行正则匹配，pattern 必须是 bytes 正则"""
+        return pattern.finditer(self._mm)
+
+    def read_bytes(self, start, end):
+        return self._mm[start:end]
+
+    def decode(self, start, end):
+        return self._mm[start:end].decode('utf-8')
+
+    def strip_range(self, start, end, probe=64):
+        """收缩 [start, end) 去掉首尾空白，效果等同于对解码后的文本调用 str.strip()"""
+        while start < end:
+            head = self._mm[start:min(end, start + probe)].decode('utf-8', 'ignore')
+            stripped = head.lstrip()
+            consumed = len(head.encode('utf-8')) - len(stripped.encode('utf-8'))
+            start += consumed
+            if stripped or consumed == 0:
+                break
+        while end > start:
+            tail = self._mm[max(start, end - probe):end].decode('utf-8', 'ignore')
+            stripped = tail.rstrip()
+            consumed = len(tail.encode('utf-8')) - len(stripped.encode('utf-8'))
+            end -= consumed
+            if stripped or consumed == 0:
+                break
+        return start, end
+
+def open_raw_text(project_name):
+    """
+    以内存映射方式打开原文.txt，返回 RawTextReader（可用 with 管理），
+    原文不存在时返回 None。
+    """
+    path = read_raw_text(project_name)
+    if path is None:
+        return None
+    _close_mmap(path)
+    return RawTextReader(path)
+
+# 章节存储：
+#   文本/章节数据.txt  —— 所有章节正文按 UTF-8 顺序追加
+#   文本/章节索引.json —— {"counts": N, "chapters": {章节id: [数据文件名, 起始字节, 结束字节(, 前缀)]}}
+#                          流式切分尚未完成时另有 "segmenting": true
+# 数据文件也可以是 原文.txt 本身：切分章节时只记录字节范围，不复制正文。
+# 读取单章只需查索引后通过内存映射解码对应字节段，不再解析/重写整个 格式化.json。
+_RAW_TEXT_NAME = "原文.txt"
+_CHAPTER_DATA_NAME = "章节数据.txt"
+_CHAPTER_INDEX_NAME = "章节索引.json"
+_LEGACY_CHAPTER_NAME = "格式化.json"
+
+# 进程内索引缓存：index_path -> (stat_key, index)
+_chapter_index_cache = {}
+
+def _get_text_dir(project_name):
+    return os.path.join(_get_project_dir(project_name), "文本")
+
+def _empty_chapter_index():
+    return {"counts": 0, "chapters": {}}
+
+def _load_chapter_index(project_name):
+    text_dir = _get_text_dir(project_name)
+    index_path = os.path.join(text_dir, _CHAPTER_INDEX_NAME)
+    key = _stat_key(index_path)
+    if key is None:
+        # 兼容旧项目：首次访问时把 格式化.json 导入新存储
+        legacy_path = os.path.join(text_dir, _LEGACY_CHAPTER_NAME)
+        if os.path.exists(legacy_path):
+            legacy = _load_json(legacy_path)
+            items = [(k, v) for k, v in legacy.items() if k != 'counts']
+            return _append_chapters(project_name, _empty_chapter_index(), items)
+        return _empty_chapter_index()
+
+    cached = _chapter_index_cache.get(index_path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    index = _load_json(index_path)
+    index.setdefault("chapters", {})
+    _chapter_index_cache[index_path] = (key, index)
+    return index
+
+def _save_chapter_index(project_name, index):
+    index_path = os.path.join(_get_text_dir(project_name), _CHAPTER_INDEX_NAME)
+    index["counts"] = len(index["chapters"])
+    # 紧凑格式，避免 indent 把每个偏移量拆成多行
+    _save_text_file(index_path, json.dumps(index, ensure_ascii=False, separators=(",", ":")))
+    _chapter_index_cache[index_path] = (_stat_key(index_path), index)
+
+def _append_chapters(project_name, index, items):
+    """把 (chapter_id, text) 依次追加到数据文件，更新并保存索引（只写一次）"""
+    text_dir = _get_text_dir(project_name)
+    data_path = os.path.join(text_dir, _CHAPTER_DATA_NAME)
+    _ensure_dir(text_dir)
+    # 索引为空时说明是重新切分，旧数据全部作废
+    mode = 'ab' if index["chapters"] else 'wb'
+    _close_mmap(data_path)
+    with open(data_path, mode) as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        for chapter_id, text in items:
+            data = text.encode('utf-8')
+            f.write(data)
+            index["chapters"][chapter_id] = [_CHAPTER_DATA_NAME, pos, pos + len(data)]
+            pos += len(data)
+    _save_chapter_index(project_name, index)
+    return index
+
+def _read_chapter_entry(project_name, entry):
+    file_name, start, end = entry[0], entry[1], entry[2]
+    prefix = entry[3] if len(entry) > 3 else ""
+    mm = _get_mmap(os.path.join(_get_text_dir(project_name), file_name))
+    if mm is None:
+        return None
+    return prefix + mm[start:end].decode('utf-8')
+
 def read_chapter(project_name, chapter_id):
     """
-    注意：章节内容存储在'格式化.json'中。
-    这里返回具体的章节内容文本(String)，而不是文件地址，
-    因为单个章节没有独立文件。
+    返回具体的章节内容文本(String)。
+    通过 章节索引.json 定位字节范围，只读取该章节。
     """
-    json_path = os.path.join(_get_project_dir(project_name), "文本", "格式化.json")
-    data = _load_json(json_path)
-    # 根据描述：格式化.json -> 章节id: 章节内容
-    return data.get(chapter_id, None)
+    entry = _load_chapter_index(project_name)["chapters"].get(chapter_id)
+    if entry is None:
+        return None
+    return _read_chapter_entry(project_name, entry)
 
 def save_chapter(project_name, chapter_id, text):
-    json_path = os.path.join(_get_project_dir(project_name), "文本", "格式化.json")
-    data = _load_json(json_path)
-    
-    data[chapter_id] = text
-    # 更新计数，排除 counts 键本身
-    chapter_keys = [k for k in data.keys() if k != 'counts']
-    data['counts'] = len(chapter_keys)
-    
-    _save_json(json_path, data)
+    index = _load_chapter_index(project_name)
+    _append_chapters(project_name, index, [(chapter_id, text)])
+    return None
+
+def save_chapters(project_name, chapters):
+    """
+    批量保存章节。
+    chapters: 可迭代的 (chapter_id, text)，全部追加后只写一次索引。
+    """
+    index = _load_chapter_index(project_name)
+    _append_chapters(project_name, index, chapters)
+    return None
+
+def save_chapter_spans(project_name, spans, complete=True):
+    """
+    批量登记直接引用原文.txt的章节，不复制正文。
+    spans: 可迭代的 (chapter_id, start, end, prefix)，start/end 为原文中的字节偏移，
+    prefix 为读取时拼接在正文前的文本（可为空字符串）。
+    complete=False 表示切分还没结束（流式切分的中间批次），索引中会记下未完成标记，
+    中途崩溃后 is_chapter_segmentation_complete 返回 False，下次运行可据此继续切分。
+    """
+    index = _load_chapter_index(project_name)
+    for chapter_id, start, end, prefix in spans:
+        entry = [_RAW_TEXT_NAME, start, end]
+        if prefix:
+            entry.append(prefix)
+        index["chapters"][chapter_id] = entry
+    if complete:
+        index.pop("segmenting", None)
+    else:
+        index["segmenting"] = True
+    _save_chapter_index(project_name, index)
     return None
 
+def is_chapter_segmentation_complete(project_name):
+    """章节索引非空，且最近一次流式切分已经走到原文末尾"""
+    index = _load_chapter_index(project_name)
+    return bool(index["chapters"]) and not index.get("segmenting", False)
+
 def get_chapter_list(project_name):
-    json_path = os.path.join(_get_project_dir(project_name), "文本", "格式化.json")
-    data = _load_json(json_path)
-    # 返回除 counts 以外的所有键 (即章节ID)
-    return [k for k in data.keys() if k != 'counts']
+    # 返回所有章节ID（保持写入顺序）
+    return list(_load_chapter_index(project_name)["chapters"].keys())
 
 def delete_chapter(project_name, chapter_id):
-    json_path = os.path.join(_get_project_dir(project_name), "文本", "格式化.json")
-    data = _load_json(json_path)
-    if chapter_id in data:
-        del data[chapter_id]
-        chapter_keys = [k for k in data.keys() if k != 'counts']
-        data['counts'] = len(chapter_keys)
-        _save_json(json_path, data)
+    index = _load_chapter_index(project_name)
+    if chapter_id in index["chapters"]:
+        # 只移除索引，数据文件中的字节在下次重新切分时被覆盖
+        del index["chapters"][chapter_id]
+        _save_chapter_index(project_name, index)
     return None
 
 def get_chapter_summary(project_name, chapter_id):
@@ -1,30 +1,239 @@
 import os
+import copy
 import json
+import base64
 import shutil
+import threading
+from contextlib import contextmanager
 import yaml
 
+from . import config
+
+# 优先使用 libyaml 的 C 实现，未编译 libyaml 时退回纯 Python 版本
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YamlDumper = getattr(yaml, "CDumper", yaml.Dumper)
+
+# YAML 解析缓存：path -> ((mtime_ns, size), data)
+# 同一次运行中未变化的文件只解析一次；返回深拷贝，调用方可以随意修改
+_yaml_cache = {}
+
+def _stat_key(path):
+    """返回文件的 (mtime_ns, size)，用于判断内存缓存是否失效；文件不存在返回 None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 def _ensure_dir(path):
     if not os.path.exists(path):
         os.makedirs(path, exist_ok=True)
 
+# ==============================================================================
+# 原子写入与回滚日志
+# ==============================================================================
+# 所有 _save_* 都先写同目录下的临时文件，fsync 后用 os.replace 原子替换目标文件，
+# 进程在任何时刻被杀掉，目标文件要么是旧内容，要么是新内容，不会被截断。
+#
+# 多个文件需要一起生效时（如 save_shots 写若干 镜头内容.yaml 再写 镜头顺序.yaml），
+# 用 `with _journal(项目目录):` 包起来：每个文件第一次被覆盖前，先把它的旧内容
+# 追加到 项目目录/.journal 并 fsync，然后才写新文件。正常结束时删除日志；
+# 块内抛出异常时立即按日志回滚；进程崩溃留下的日志由启动时调用的
+# recover_project_journal（_recover_journal）恢复到 with 块开始前的状态。
+# 同一项目目录的日志块和恢复操作由进程内的目录锁串行化，
+# 一个线程不会回滚另一个线程正在进行中的批量写入。
+
+JOURNAL_NAME = ".journal"
+
+_journal_state = threading.local()
+_journal_locks = {}
+_journal_locks_lock = threading.Lock()
+
+def _journal_lock(root):
+    """返回项目目录（绝对路径）对应的锁"""
+    with _journal_locks_lock:
+        lock = _journal_locks.get(root)
+        if lock is None:
+            lock = _journal_locks[root] = threading.Lock()
+        return lock
+
+def _fsync_dir(path):
+    # Windows 不支持打开目录做 fsync，忽略即可
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _atomic_write(path, data):
+    """原子写入 bytes：临时文件 + fsync + rename"""
+    directory = os.path.dirname(path)
+    _ensure_dir(directory)
+    _journal_before_write(path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(directory)
+
+def _journal_before_write(path):
+    """若当前线程处于 _journal 块中，且该文件本次尚未记录，先把旧内容写入日志"""
+    active = getattr(_journal_state, "active", None)
+    if not active:
+        return
+    root, journal_path, recorded = active[-1]
+    abs_path = os.path.abspath(path)
+    if abs_path in recorded or not abs_path.startswith(root + os.sep):
+        return
+    old = _read_binary(abs_path)
+    record = {
+        "path": os.path.relpath(abs_path, root),
+        "old": base64.b64encode(old).decode('ascii') if old is not None else None,
+    }
+    with open(journal_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    recorded.add(abs_path)
+
+def _recover_journal(root):
+    """
+    崩溃恢复：按回滚日志把 root 下被改动的文件恢复为旧内容，然后删除日志。
+    没有日志时什么都不做。返回恢复的文件数。
+    会等待本进程中同一目录正在进行的日志块结束（那时日志已删除，不会误回滚）。
+    """
+    root = os.path.abspath(root)
+    with _journal_lock(root):
+        return _rollback_journal(root)
+
+def _rollback_journal(root, start=0):
+    """
+    按日志中从字节偏移 start 开始的记录回滚，调用方持有 root 的目录锁。
+    start 为 0 时回滚全部记录并删除日志，否则只截掉这部分记录。
+    """
+    journal_path = os.path.join(root, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        return 0
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        f.seek(start)
+        lines = f.read().splitlines()
+
+    restored = 0
+    # 倒序恢复；最后一行可能是崩溃时写了一半的记录，解析失败直接跳过
+    for line in reversed(lines):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        target = os.path.join(root, record["path"])
+        if record["old"] is None:
+            if os.path.exists(target):
+                os.remove(target)
+                # 顺带清理为新文件创建的空文件夹（如新镜头的文件夹）
+                try:
+                    os.rmdir(os.path.dirname(target))
+                except OSError:
+                    pass
+        else:
+            _atomic_write(target, base64.b64decode(record["old"]))
+        _yaml_cache.pop(target, None)
+        restored += 1
+
+    _discard_journal(journal_path, start)
+    _fsync_dir(root)
+    print(f"[journal] 检测到未完成的写入，已回滚 {restored} 个文件: {root}")
+    return restored
+
+def _discard_journal(journal_path, start):
+    """丢弃日志中从 start 开始的记录；start 为 0 时删除日志文件"""
+    if start == 0:
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        return
+    with open(journal_path, 'r+b') as f:
+        f.truncate(start)
+        f.flush()
+        os.fsync(f.fileno())
+
+@contextmanager
+def _journal(root):
+    """
+    让 with 块内对 root 目录下文件的所有写入整体生效或整体回滚。
+    config.WRITE_JOURNAL 为 False 时只做原子写入，不记日志。
+    嵌套使用时并入最外层的日志。
+    同一目录的日志块在线程之间互斥；进入时不做崩溃恢复（见 recover_project_journal），
+    残留的旧日志原样保留，本块只提交或回滚自己追加的记录。
+    """
+    active = getattr(_journal_state, "active", None)
+    if active is None:
+        active = _journal_state.active = []
+    if not config.WRITE_JOURNAL or active:
+        yield
+        return
+
+    root = os.path.abspath(root)
+    _ensure_dir(root)
+    journal_path = os.path.join(root, JOURNAL_NAME)
+    with _journal_lock(root):
+        start = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+        if start:
+            print(f"[journal] {root} 残留上次崩溃的回滚日志，请先调用 recover_project_journal 恢复。")
+            with open(journal_path, 'a+b') as f:
+                f.seek(start - 1)
+                if f.read(1) != b"\n":
+                    # 崩溃时写了一半的记录，补上换行，免得和本块的第一条记录连在一起
+                    f.write(b"\n")
+                    start += 1
+        active.append((root, journal_path, set()))
+        try:
+            yield
+        except BaseException:
+            active.pop()
+            _rollback_journal(root, start)
+            raise
+        active.pop()
+        _discard_journal(journal_path, start)
+
+def _quarantine(path, error):
+    """
+    文件无法解析时改名为 *.corrupt 保留下来，而不是被下一次保存静默覆盖。
+    """
+    backup = path + ".corrupt"
+    try:
+        os.replace(path, backup)
+    except OSError:
+        backup = None
+    print(f"!!! 文件损坏，无法解析: {path} ({error})" + (f"，已另存为 {backup}" if backup else ""))
+
 def _load_json(path):
     if not os.path.exists(path):
         return {}
     try:
         with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        _quarantine(path, e)
         return {}
 
 def _save_json(path, data):
-    _ensure_dir(os.path.dirname(path))
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    _atomic_write(path, json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8'))
 
 def _save_binary(path, data):
-    _ensure_dir(os.path.dirname(path))
-    with open(path, 'wb') as f:
-        f.write(data)
+    _atomic_write(path, data)
 
 def _read_binary(path):
     if os.path.exists(path):
@@ -41,24 +250,31 @@ def _read_text_file(path):
 
 def _save_text_file(path, text):
     """保存纯文本文件"""
-    _ensure_dir(os.path.dirname(path))
-    with open(path, 'w', encoding='utf-8') as f:
-        f.write(text)
+    _atomic_write(path, text.encode('utf-8'))
 
 def _load_yaml(path):
     """读取YAML文件，失败返回空字典"""
-    if not os.path.exists(path):
+    key = _stat_key(path)
+    if key is None:
         return {}
+    cached = _yaml_cache.get(path)
+    if cached and cached[0] == key:
+        return copy.deepcopy(cached[1])
     try:
         with open(path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f) or {}
-    except Exception:
+            data = yaml.load(f, Loader=_YamlLoader) or {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        _quarantine(path, e)
         return {}
+    _yaml_cache[path] = (key, data)
+    return copy.deepcopy(data)
 
 def _save_yaml(path, data):
     """保存YAML文件，强制使用更易读的块格式"""
-    _ensure_dir(os.path.dirname(path))
-    with open(path, 'w', encoding='utf-8') as f:
-        # allow_unicode=True 显示中文，sort_keys=False 保持插入顺序
-        # default_flow_style=False 强制使用块状格式而不是行内大括号
-        yaml.dump(data, f, allow_unicode=True, sort_keys=False, default_flow_style=False)
\ No newline at end of file
+    _yaml_cache.pop(path, None)
+    # allow_unicode=True 显示中文，sort_keys=False 保持插入顺序
+    # default_flow_style=False 强制使用块状格式而不是行内大括号
+    text = yaml.dump(data, Dumper=_YamlDumper, allow_unicode=True, sort_keys=False, default_flow_style=False)
+    _atomic_write(path, text.encode('utf-8'))
\ No newline at end of file
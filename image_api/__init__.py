@@ -1,5 +1,17 @@
-from .core import generate_image_core
+# core 会导入 torch/diffusers 并创建引擎，只在本进程真正生图时才导入；
+# config.USE_WORKER 为 True 时生图交给独立 worker 进程（python -m image_api.worker）
+from . import config
 from .config import MODELS, DEFAULT_NEGATIVE_PROMPT
+from .scheduler import ImageJob, ImageJobQueue
+from .client import ImageWorkerClient, RemoteImageJobQueue
+
+_client = None
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = ImageWorkerClient()
+    return _client
 
 def generate_image(prompt, model_name="KOALA-1B", width=1024, height=1024):
     """
@@ -9,9 +21,38 @@ def generate_image(prompt, model_name="KOALA-1B", width=1024, height=1024):
     if model_name not in MODELS:
         # Fallback 逻辑
         model_name = "Z Image Turbo"
-        
+
+    if config.USE_WORKER:
+        return _get_client().generate_image(prompt, model_name, width, height)
+    from .core import generate_image_core
     return generate_image_core(prompt, model_name, width, height)
 
+def generate_batch(prompts, model_name="KOALA-1B", width=1024, height=1024, negative_prompts=None):
+    """
+    批量生成图片接口：同一模型、同一分辨率的多条提示词合并推理。
+    按 prompts 顺序返回二进制图片列表；批大小由模块按内存自动决定。
+    """
+    if model_name not in MODELS:
+        model_name = "Z Image Turbo"
+
+    if config.USE_WORKER:
+        return _get_client().generate_batch(prompts, model_name, width, height, negative_prompts)
+    from .core import generate_images_batch_core
+    return generate_images_batch_core(prompts, model_name, width, height, negative_prompts)
+
+def create_job_queue():
+    """返回任务队列：USE_WORKER 时为交给 worker 执行的 RemoteImageJobQueue，否则为本进程的 ImageJobQueue"""
+    if config.USE_WORKER:
+        return RemoteImageJobQueue(_get_client())
+    return ImageJobQueue()
+
+def get_pipeline_cache_stats():
+    """已加载模型的缓存统计（USE_WORKER 时为 worker 进程中的缓存）"""
+    if config.USE_WORKER:
+        return _get_client().stats()["cache"]
+    from .core import get_pipeline_cache_stats
+    return get_pipeline_cache_stats()
+
 def get_model_list():
     """返回模型信息字典"""
     info = {}
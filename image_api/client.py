@@ -0,0 +1,163 @@
+"""
+图片 worker 的轻量客户端：只依赖标准库，不导入 torch/diffusers。
+
+协议（multiprocessing.connection，消息为 pickle 后的 dict）：
+    请求 {"op": "jobs", "id": n, "jobs": [{"prompt", "model_name", "width", "height", "priority", "negative_prompt"}, ...]}
+    每个任务完成时返回 {"id": n, "index": i, "image": bytes} 或 {"id": n, "index": i, "error": str}
+    全部完成后返回 {"id": n, "done": True, "stats": worker 队列统计}
+    请求 {"op": "stats", "id": n} 返回 {"id": n, "done": True, "stats": ..., "cache": 管道缓存统计}
+"""
+import os
+import itertools
+import threading
+from multiprocessing.connection import Client
+
+from . import config
+from .scheduler import ImageJob, print_queue_stats
+
+
+def read_authkey():
+    """客户端使用的认证密钥：环境变量优先，否则读取 worker 启动时写入的密钥文件"""
+    key = os.environ.get(config.WORKER_AUTHKEY_ENV)
+    if key:
+        return bytes.fromhex(key)
+    try:
+        with open(config.WORKER_AUTHKEY_FILE, "r", encoding="utf-8") as f:
+            return bytes.fromhex(f.read().strip())
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"无法读取图片 worker 密钥（{config.WORKER_AUTHKEY_FILE}），worker 是否已启动: {e}")
+
+
+class ImageWorkerClient:
+    """连接图片 worker 进程；同一客户端的请求串行发送，多线程并发请使用多个客户端"""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or config.WORKER_ADDRESS
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _connection(self):
+        if self._conn is None:
+            # worker 每次启动都会换密钥，连接时再读取
+            authkey = self.authkey or read_authkey()
+            try:
+                self._conn = Client(self.address, authkey=authkey)
+            except OSError as e:
+                raise RuntimeError(f"无法连接图片 worker {self.address}: {e}")
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _request(self, message, on_result=None):
+        """发送请求并接收到 done 为止；on_result(index, image, error) 处理逐个返回的任务结果"""
+        with self._lock:
+            conn = self._connection()
+            message = dict(message, id=next(self._ids))
+            try:
+                conn.send(message)
+                while True:
+                    reply = conn.recv()
+                    if reply.get("id") != message["id"]:
+                        continue
+                    if reply.get("done"):
+                        return reply
+                    if on_result is not None:
+                        on_result(reply["index"], reply.get("image"), reply.get("error"))
+            except (EOFError, OSError) as e:
+                # 连接已断开，下次请求重新连接
+                conn.close()
+                self._conn = None
+                raise RuntimeError(f"图片 worker 连接中断: {e}")
+
+    def run_jobs(self, jobs, on_result=None):
+        """提交一组任务（dict 列表），返回 worker 队列统计"""
+        return self._request({"op": "jobs", "jobs": list(jobs)}, on_result)["stats"]
+
+    def generate_batch(self, prompts, model_name, width=1024, height=1024, negative_prompts=None, priority=0):
+        """按 prompts 顺序返回二进制图片列表；任一张失败时抛 RuntimeError"""
+        prompts = list(prompts)
+        if negative_prompts is None or isinstance(negative_prompts, str):
+            negative_prompts = [negative_prompts] * len(prompts)
+        images = [None] * len(prompts)
+        errors = []
+
+        def on_result(index, image, error):
+            if error is not None:
+                errors.append(error)
+            images[index] = image
+
+        self.run_jobs(
+            (
+                {"prompt": p, "model_name": model_name, "width": width, "height": height,
+                 "priority": priority, "negative_prompt": n}
+                for p, n in zip(prompts, negative_prompts)
+            ),
+            on_result,
+        )
+        if errors:
+            raise RuntimeError(f"Generation failed: {errors[0]}")
+        return images
+
+    def generate_image(self, prompt, model_name, width=1024, height=1024, negative_prompt=None):
+        return self.generate_batch([prompt], model_name, width, height, [negative_prompt])[0]
+
+    def stats(self):
+        """worker 的队列统计和管道缓存统计"""
+        reply = self._request({"op": "stats"})
+        return {"queue": reply["stats"], "cache": reply["cache"]}
+
+
+class RemoteImageJobQueue:
+    """
+    与 ImageJobQueue 接口相同的任务队列，任务交给图片 worker 执行。
+    run() 把已提交的任务一次性发给 worker，由 worker 负责按模型分组和批量推理。
+    """
+
+    def __init__(self, client=None):
+        self._client = client or ImageWorkerClient()
+        self._jobs = []
+        self._stats = {"models": {}}
+
+    def submit(self, prompt, model_name, width=1024, height=1024, priority=0, negative_prompt=None, on_done=None):
+        job = ImageJob(prompt, model_name, width, height, priority, negative_prompt, on_done)
+        self._jobs.append(job)
+        return job
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def run(self):
+        jobs, self._jobs = self._jobs, []
+
+        def on_result(index, image, error):
+            job = jobs[index]
+            job.result = image
+            job.error = RuntimeError(error) if error is not None else None
+            if job.on_done is not None:
+                try:
+                    job.on_done(job)
+                except Exception as e:
+                    print(f"[image] 任务回调失败: {e}")
+
+        self._stats = self._client.run_jobs(
+            (
+                {"prompt": j.prompt, "model_name": j.model_name, "width": j.width, "height": j.height,
+                 "priority": j.priority, "negative_prompt": j.negative_prompt}
+                for j in jobs
+            ),
+            on_result,
+        )
+        return self._stats
+
+    def stats(self):
+        """最近一次 run() 结束时 worker 队列的累计统计（所有客户端共享）"""
+        return self._stats
+
+    def print_stats(self):
+        print_queue_stats(self._stats)
@@ -8,6 +8,35 @@ DEFAULT_NEGATIVE_PROMPT = (
     "low quality, bad quality, sketches, bad anatomy, deformed, "
     "disfigured, watermark, text, signature, mutation, ugly"
 )
+
+# 任务队列（ImageJobQueue）为高优先级任务提前切换模型的次数上限
+# 当前模型的任务做完后的正常切换不计入；0 表示严格按模型分组执行
+MAX_MODEL_SWAPS = 2
+
+# 批量推理（generate_batch）的批大小估算
+# 每张图每像素额外占用的内存（字节，fp16；float32 时按两倍计），1024x1024 约 1.3GB
+BATCH_MEMORY_PER_PIXEL = 1300
+# CUDA 上按当前空闲显存减去预留量计算预算
+BATCH_MEMORY_RESERVE = 1536 * 1024 * 1024
+# CPU 上没有可靠的空闲内存查询，直接使用固定预算
+CPU_BATCH_MEMORY_BUDGET = 8 * 1024 * 1024 * 1024
+MAX_BATCH_SIZE = 8
+
+# 已加载管道的缓存预算（字节）：显存中超出时最久未用的管道先卸载到内存，
+# 内存中超出时淘汰。CPU 设备上所有管道都计入内存预算
+PIPELINE_VRAM_BUDGET = 12 * 1024 * 1024 * 1024
+PIPELINE_RAM_BUDGET = 24 * 1024 * 1024 * 1024
+
+# 独立图片 worker 进程（python -m image_api.worker）的监听地址和认证密钥
+# USE_WORKER 为 True 时 generate_image / generate_batch 和素材生成都交给 worker，
+# 调用方进程不再导入 torch/diffusers，多个进程共享 worker 中已加载的模型
+USE_WORKER = False
+WORKER_ADDRESS = ("127.0.0.1", 6010)
+# worker 收到的消息会被反序列化执行，认证密钥不能是公开常量：
+# 优先取环境变量 WORKER_AUTHKEY_ENV（十六进制）；未设置时 worker 每次启动随机生成，
+# 写入只有当前用户可读的 WORKER_AUTHKEY_FILE，同一用户的客户端从该文件读取
+WORKER_AUTHKEY_ENV = "NOVEL2VIDEO_IMAGE_WORKER_KEY"
+WORKER_AUTHKEY_FILE = os.path.join(os.path.expanduser("~"), ".novel2video", "image_worker.key")
 '''
     # --- 2. Qwen Image (通义千问图像) ---
     "Qwen-Image": {
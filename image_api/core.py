@@ -1,7 +1,9 @@
 import os
 import io
+import time
 import torch
 import gc
+from collections import OrderedDict
 from PIL import Image
 from diffusers import (
     DiffusionPipeline, 
@@ -23,6 +25,10 @@ class ImageGeneratorEngine:
         # 添加性能优化标志
         self.is_optimized = False
 
+        # 已加载管道的 LRU 缓存：model_name -> {"pipe", "device", "bytes"}，最久未用的在前
+        self._pipelines = OrderedDict()
+        self._cache_stats = {"hits": 0, "misses": 0, "offloads": 0, "evictions": 0, "hit_time": 0.0, "load_time": 0.0}
+
     def _optimize_pipeline(self, model_name, load_type):
         """对已加载的管道进行性能优化"""
         if self.pipe is None:
@@ -151,22 +157,126 @@ class ImageGeneratorEngine:
             print(f"优化过程中出现错误: {e}")
             print("将继续使用未优化的管道")
 
+    # ==========================================================================
+    # 管道缓存
+    # ==========================================================================
+    # 显存中最多保留 PIPELINE_VRAM_BUDGET 字节的管道，超出时最久未用的先卸载到内存；
+    # 内存中的管道超过 PIPELINE_RAM_BUDGET 时按最久未用淘汰。CPU 设备只有内存一级。
+    # 切回显存中的模型只是换指针，切回内存中的模型只需搬回显存，都不必从磁盘重新加载。
+
+    @staticmethod
+    def _pipeline_bytes(pipe):
+        """管道各组件参数占用的字节数"""
+        total = 0
+        for component in getattr(pipe, "components", {}).values():
+            if hasattr(component, "parameters"):
+                total += sum(p.numel() * p.element_size() for p in component.parameters())
+        return total
+
+    @staticmethod
+    def _disk_bytes(path):
+        """模型文件在磁盘上的大小，用于加载前预留空间"""
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith((".safetensors", ".bin")):
+                    total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def _used_bytes(self, device):
+        return sum(e["bytes"] for e in self._pipelines.values() if e["device"] == device)
+
+    def _evict_pipeline(self, model_name):
+        entry = self._pipelines.pop(model_name)
+        del entry["pipe"]
+        self._cache_stats["evictions"] += 1
+        print(f"已从缓存淘汰 {model_name}")
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+        gc.collect()
+
+    def _move_pipeline(self, model_name, device):
+        """把缓存中的管道搬到指定设备；搬不动（如已启用 CPU offload 的管道）则直接淘汰"""
+        entry = self._pipelines[model_name]
+        try:
+            entry["pipe"].to(device)
+        except Exception as e:
+            print(f"{model_name} 无法移动到 {device}（{e}），从缓存淘汰")
+            self._evict_pipeline(model_name)
+            return False
+        entry["device"] = device
+        if device == "cpu":
+            self._cache_stats["offloads"] += 1
+            print(f"已将 {model_name} 卸载到内存")
+            torch.cuda.empty_cache()
+        return True
+
+    def _enforce_pipeline_budget(self, keep=None, incoming=0):
+        """按 LRU 顺序腾出空间，使已缓存的管道加上 incoming 字节不超过预算；keep 不会被移动"""
+        if self.device == "cuda":
+            for name in list(self._pipelines):
+                if self._used_bytes("cuda") + incoming <= config.PIPELINE_VRAM_BUDGET:
+                    break
+                if name != keep and self._pipelines[name]["device"] == "cuda":
+                    self._move_pipeline(name, "cpu")
+            incoming = 0
+        for name in list(self._pipelines):
+            if self._used_bytes("cpu") + incoming <= config.PIPELINE_RAM_BUDGET:
+                break
+            if name != keep and name in self._pipelines and self._pipelines[name]["device"] == "cpu":
+                self._evict_pipeline(name)
+
+    def pipeline_cache_stats(self):
+        """
+        缓存统计：切换模型时命中（hits）/ 从磁盘加载（misses）的次数、卸载到内存（offloads）
+        和淘汰（evictions）次数、平均命中切换耗时与平均加载耗时（秒），以及当前缓存的模型
+        """
+        s = self._cache_stats
+        return {
+            "hits": s["hits"],
+            "misses": s["misses"],
+            "offloads": s["offloads"],
+            "evictions": s["evictions"],
+            "avg_hit_time": s["hit_time"] / s["hits"] if s["hits"] else 0.0,
+            "avg_load_time": s["load_time"] / s["misses"] if s["misses"] else 0.0,
+            "cached": {name: {"device": e["device"], "bytes": e["bytes"]} for name, e in self._pipelines.items()},
+        }
+
     def _load_model(self, model_name):
         if model_name == self.current_model_name and self.pipe is not None:
             return
 
-        # 卸载当前模型
-        if self.pipe is not None:
-            del self.pipe
-            torch.cuda.empty_cache()
-            gc.collect()
-            
+        entry = self._pipelines.get(model_name)
+        if entry is not None:
+            start = time.perf_counter()
+            self._pipelines.move_to_end(model_name)
+            if entry["device"] != self.device:
+                # 先给搬回来的管道腾出显存
+                self._enforce_pipeline_budget(keep=model_name, incoming=entry["bytes"])
+                if not self._move_pipeline(model_name, self.device):
+                    return self._load_model(model_name)
+                self._enforce_pipeline_budget(keep=model_name)
+            self.pipe = entry["pipe"]
+            self.current_model_name = model_name
+            self._cache_stats["hits"] += 1
+            self._cache_stats["hit_time"] += time.perf_counter() - start
+            return
+
         conf = config.MODELS.get(model_name)
         if not conf:
             raise ValueError(f"Model {model_name} not found.")
 
         path = conf["path"]
         load_type = conf["type"]
+
+        # 当前模型留在缓存中，按新模型的文件大小先腾出空间
+        self.pipe = None
+        self.current_model_name = None
+        self._cache_stats["misses"] += 1
+        self._enforce_pipeline_budget(incoming=self._disk_bytes(path))
+        start = time.perf_counter()
         
         print(f"Loading {model_name} ({load_type}) from {path}...")
         
@@ -259,6 +369,7 @@ class ImageGeneratorEngine:
                         low_cpu_mem_usage=False,
                     )
                     pipe.transformer.compile()
+                self.pipe = pipe
                 
             # 特殊配置：NoobAI 需要 Euler Ancestral 调度器
             if "NoobAI" in model_name:
@@ -272,23 +383,37 @@ class ImageGeneratorEngine:
             self._optimize_pipeline(model_name, load_type)
 
         except Exception as e:
+            self.pipe = None
+            self.current_model_name = None
             raise RuntimeError(f"Failed to load {model_name}: {str(e)}")
 
-    def generate(self, prompt, model_name, width, height, negative_prompt=None):
-        self._load_model(model_name)
-        
+        self._pipelines[model_name] = {"pipe": self.pipe, "device": self.device, "bytes": self._pipeline_bytes(self.pipe)}
+        self._cache_stats["load_time"] += time.perf_counter() - start
+        self._enforce_pipeline_budget(keep=model_name)
+
+    def _run_params(self, model_name, width, height):
         conf = config.MODELS[model_name]
         defaults = conf.get("default_params", {})
-        
-        # 1. 准备参数
-        # 优先使用函数传入的参数，否则使用 config 默认
-        run_params = {
-            "prompt": prompt,
+        return {
             "width": width,
             "height": height,
             "num_inference_steps": defaults.get("num_inference_steps", 25),
             "guidance_scale": defaults.get("guidance_scale", 7.0),
         }
+
+    @staticmethod
+    def _encode_png(image):
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='PNG')
+        return img_byte_arr.getvalue()
+
+    def generate(self, prompt, model_name, width, height, negative_prompt=None):
+        self._load_model(model_name)
+        
+        # 1. 准备参数
+        # 优先使用函数传入的参数，否则使用 config 默认
+        run_params = self._run_params(model_name, width, height)
+        run_params["prompt"] = prompt
         
         # 2. 处理负面提示词
         # 如果调用者没传，就用 Config 里的默认值
@@ -304,19 +429,88 @@ class ImageGeneratorEngine:
             with torch.no_grad():
                 image = self.pipe(**run_params).images
             
-            img_byte_arr = io.BytesIO()
-            image[0].save(img_byte_arr, format='PNG')
-            
             # 清理缓存
             if self.device == "cuda":
                 torch.cuda.empty_cache()
                 
-            return img_byte_arr.getvalue()
+            return self._encode_png(image[0])
             
         except Exception as e:
             raise RuntimeError(f"Generation failed: {str(e)}")
 
+    def _batch_size_for(self, width, height):
+        """按可用内存估算一次前向能放下的图片数"""
+        per_image = width * height * config.BATCH_MEMORY_PER_PIXEL
+        if self.dtype == torch.float32:
+            per_image *= 2
+        if self.device == "cuda":
+            free, _ = torch.cuda.mem_get_info()
+            budget = free - config.BATCH_MEMORY_RESERVE
+        else:
+            budget = config.CPU_BATCH_MEMORY_BUDGET
+        return max(1, min(config.MAX_BATCH_SIZE, int(budget // per_image)))
+
+    @staticmethod
+    def _is_oom(e):
+        oom_type = getattr(torch.cuda, "OutOfMemoryError", None)
+        if isinstance(oom_type, type) and isinstance(e, oom_type):
+            return True
+        if isinstance(e, MemoryError):
+            return True
+        message = str(e).lower()
+        return isinstance(e, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+    def generate_batch(self, prompts, model_name, width, height, negative_prompts=None, batch_size=None):
+        """
+        同一模型、同一分辨率的多条提示词合并成批推理，按输入顺序返回 PNG 二进制列表。
+        negative_prompts 为 None、单个字符串或与 prompts 等长的列表，None 项使用默认负面提示词。
+        batch_size 不传时按内存预算估算；显存/内存不足时批大小减半重试，减到 1 仍不足则报错。
+        """
+        prompts = list(prompts)
+        if not prompts:
+            return []
+        if negative_prompts is None or isinstance(negative_prompts, str):
+            negative_prompts = [negative_prompts] * len(prompts)
+        negative_prompts = [
+            n if n is not None else config.DEFAULT_NEGATIVE_PROMPT for n in negative_prompts
+        ]
+        if len(negative_prompts) != len(prompts):
+            raise ValueError("negative_prompts must match prompts in length.")
+
+        self._load_model(model_name)
+        base_params = self._run_params(model_name, width, height)
+        size = batch_size or self._batch_size_for(width, height)
+        results = []
+        i = 0
+        while i < len(prompts):
+            chunk = slice(i, i + size)
+            run_params = dict(base_params, prompt=prompts[chunk], negative_prompt=negative_prompts[chunk])
+            try:
+                with torch.no_grad():
+                    images = self.pipe(**run_params).images
+            except Exception as e:
+                if self._is_oom(e) and size > 1:
+                    size //= 2
+                    print(f"批量生成内存不足，批大小降为 {size}")
+                    if self.device == "cuda":
+                        torch.cuda.empty_cache()
+                    gc.collect()
+                    continue
+                raise RuntimeError(f"Generation failed: {str(e)}")
+            results.extend(self._encode_png(image) for image in images)
+            i += len(run_params["prompt"])
+
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+        return results
+
 _engine = ImageGeneratorEngine()
 
 def generate_image_core(prompt, model_name, width, height):
-    return _engine.generate(prompt, model_name, width, height)
\ No newline at end of file
+    return _engine.generate(prompt, model_name, width, height)
+
+def generate_images_batch_core(prompts, model_name, width, height, negative_prompts=None):
+    return _engine.generate_batch(prompts, model_name, width, height, negative_prompts)
+
+def get_pipeline_cache_stats():
+    return _engine.pipeline_cache_stats()
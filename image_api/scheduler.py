@@ -0,0 +1,192 @@
+import time
+import itertools
+import threading
+
+from . import config
+
+
+class ImageJob:
+    """一个生图任务；完成后 result 为 PNG 二进制，失败时 error 为异常"""
+
+    def __init__(self, prompt, model_name, width, height, priority=0, negative_prompt=None, on_done=None):
+        self.prompt = prompt
+        self.model_name = model_name
+        self.width = width
+        self.height = height
+        self.priority = priority
+        self.negative_prompt = negative_prompt
+        self.on_done = on_done
+        self.result = None
+        self.error = None
+
+
+class ImageJobQueue:
+    """
+    按模型分组执行的生图任务队列，尽量减少模型切换（每次切换都要从磁盘重新加载管道）。
+
+    调度规则：
+    - 当前已加载的模型还有任务时，优先继续执行它的任务；
+    - 当前模型的任务做完后，切换到剩余任务中优先级最高的模型；
+    - 其他模型出现比当前模型所有任务都更高优先级的任务时，可以提前切换，
+      但提前切换的次数不超过 max_model_swaps（None 表示不限制，0 表示从不提前切换）。
+    同一模型内按优先级从高到低、同优先级按提交顺序执行；
+    同模型、同分辨率的任务最多 MAX_BATCH_SIZE 个合并为一次批量推理（engine.generate_batch）。
+    队列线程安全，run() 执行期间仍可 submit。
+    """
+
+    def __init__(self, engine=None, max_model_swaps=None):
+        self._engine = engine
+        self.max_model_swaps = config.MAX_MODEL_SWAPS if max_model_swaps is None else max_model_swaps
+        self._lock = threading.Lock()
+        self._pending = {}  # model_name -> [(-priority, seq, job)]
+        self._seq = itertools.count()
+        self._stats = {}
+
+    def submit(self, prompt, model_name, width=1024, height=1024, priority=0, negative_prompt=None, on_done=None):
+        """
+        加入一个任务，返回 ImageJob。priority 越大越先执行。
+        on_done(job) 在任务完成或失败后调用，可用于立即保存结果。
+        """
+        if model_name not in config.MODELS:
+            # 与 generate_image 相同的 Fallback 逻辑
+            model_name = "Z Image Turbo"
+        job = ImageJob(prompt, model_name, width, height, priority, negative_prompt, on_done)
+        with self._lock:
+            self._pending.setdefault(model_name, []).append((-priority, next(self._seq), job))
+        return job
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(jobs) for jobs in self._pending.values())
+
+    def _get_engine(self):
+        if self._engine is None:
+            from .core import _engine
+            self._engine = _engine
+        return self._engine
+
+    def _next_jobs(self, current_model, swaps):
+        """取出下一批同模型、同分辨率的任务，返回 (jobs, 是否提前切换)；队列为空返回 ([], False)"""
+        with self._lock:
+            heads = {m: min(jobs) for m, jobs in self._pending.items() if jobs}
+            if not heads:
+                return [], False
+            best_model = min(heads, key=lambda m: heads[m])
+            preempt = False
+            if current_model in heads and best_model != current_model:
+                # 优先级更高（排序键的第一项更小）才值得提前切换
+                outranks = heads[best_model][0] < heads[current_model][0]
+                if outranks and (self.max_model_swaps is None or swaps < self.max_model_swaps):
+                    preempt = True
+                else:
+                    best_model = current_model
+            jobs = self._pending[best_model]
+            head = heads[best_model][2]
+            batch = [
+                entry for entry in sorted(jobs)
+                if (entry[2].width, entry[2].height) == (head.width, head.height)
+            ][:config.MAX_BATCH_SIZE]
+            for entry in batch:
+                jobs.remove(entry)
+            return [entry[2] for entry in batch], preempt
+
+    def _take_all(self, model_name):
+        """取出某个模型的全部待执行任务"""
+        with self._lock:
+            entries = sorted(self._pending.pop(model_name, []))
+        return [entry[2] for entry in entries]
+
+    def _model_stats(self, model_name):
+        return self._stats.setdefault(model_name, {"images": 0, "failed": 0, "loads": 0, "load_time": 0.0, "gen_time": 0.0})
+
+    def run(self):
+        """执行队列中的全部任务（包括执行期间新提交的），返回累计统计及本次的总耗时和提前切换次数"""
+        engine = self._get_engine()
+        current = engine.current_model_name
+        swaps = 0
+        start = time.perf_counter()
+        while True:
+            jobs, preempt = self._next_jobs(current, swaps)
+            if not jobs:
+                break
+            model_name = jobs[0].model_name
+            stats = self._model_stats(model_name)
+            if model_name != engine.current_model_name:
+                if preempt:
+                    swaps += 1
+                    print(f"[image] 高优先级任务提前切换到 {model_name}（{swaps}/{self.max_model_swaps}）")
+                t = time.perf_counter()
+                try:
+                    engine._load_model(model_name)
+                except Exception as e:
+                    # 同一模型的其余任务也无法执行，一起判为失败，避免每批都从磁盘重新加载一次
+                    jobs += self._take_all(model_name)
+                    print(f"[image] 加载 {model_name} 失败，{len(jobs)} 个任务失败: {e}")
+                    for job in jobs:
+                        self._finish(job, error=e)
+                    stats["failed"] += len(jobs)
+                    continue
+                stats["loads"] += 1
+                stats["load_time"] += time.perf_counter() - t
+            current = model_name
+
+            t = time.perf_counter()
+            try:
+                if len(jobs) == 1:
+                    job = jobs[0]
+                    images = [engine.generate(job.prompt, model_name, job.width, job.height, job.negative_prompt)]
+                else:
+                    images = engine.generate_batch(
+                        [job.prompt for job in jobs], model_name, jobs[0].width, jobs[0].height,
+                        [job.negative_prompt for job in jobs],
+                    )
+            except Exception as e:
+                print(f"[image] 生成失败（{model_name}，{len(jobs)} 张）: {e}")
+                stats["failed"] += len(jobs)
+                for job in jobs:
+                    self._finish(job, error=e)
+                continue
+            stats["gen_time"] += time.perf_counter() - t
+            stats["images"] += len(jobs)
+            for job, image in zip(jobs, images):
+                self._finish(job, result=image)
+
+        report = self.stats()
+        report["total_time"] = time.perf_counter() - start
+        report["preemptive_swaps"] = swaps
+        return report
+
+    def _finish(self, job, result=None, error=None):
+        job.result = result
+        job.error = error
+        if job.on_done is not None:
+            try:
+                job.on_done(job)
+            except Exception as e:
+                print(f"[image] 任务回调失败: {e}")
+
+    def stats(self):
+        """
+        各模型的统计：images、failed、loads（加载次数）、load_time、gen_time，
+        images_per_sec（只算生成耗时）和 effective_images_per_sec（计入加载耗时）
+        """
+        report = {"models": {}}
+        for model_name, d in self._stats.items():
+            total = d["gen_time"] + d["load_time"]
+            report["models"][model_name] = dict(
+                d,
+                images_per_sec=d["images"] / d["gen_time"] if d["gen_time"] else 0.0,
+                effective_images_per_sec=d["images"] / total if total else 0.0,
+            )
+        return report
+
+    def print_stats(self):
+        print_queue_stats(self.stats())
+
+
+def print_queue_stats(report):
+    for model_name, d in report["models"].items():
+        print(
+            f"[image] {model_name}: {d['images']} 张（失败 {d['failed']}），加载 {d['loads']} 次 {d['load_time']:.1f}s，"
+            f"生成 {d['gen_time']:.1f}s，{d['images_per_sec']:.2f} 张/秒（含加载 {d['effective_images_per_sec']:.2f}）"
+        )
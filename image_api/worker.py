@@ -0,0 +1,153 @@
+"""
+独立的图片生成 worker 进程：常驻加载模型，通过本地 socket 接收多个进程的生图任务。
+
+启动：
+    python -m image_api.worker [--preload KOALA-1B NoobAI-XL]
+
+所有连接的任务进入同一个 ImageJobQueue，由一个调度线程按模型分组、批量执行，
+因此多个流水线进程共享同一份已加载的模型。协议见 client.py。
+"""
+import argparse
+import os
+import secrets
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+from . import config
+from .core import _engine
+from .scheduler import ImageJobQueue
+
+
+def _write_key_file(path, key):
+    """原子写入只有当前用户可读写的密钥文件（Windows 上依赖用户目录本身的权限）"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, key.hex().encode("ascii"))
+    finally:
+        os.close(fd)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
+
+def _worker_authkey():
+    """返回 (密钥, 写入的密钥文件)；使用环境变量中的密钥时不写文件"""
+    key = os.environ.get(config.WORKER_AUTHKEY_ENV)
+    if key:
+        return bytes.fromhex(key), None
+    key = secrets.token_bytes(32)
+    _write_key_file(config.WORKER_AUTHKEY_FILE, key)
+    return key, config.WORKER_AUTHKEY_FILE
+
+
+class ImageWorker:
+    def __init__(self, address=None, authkey=None):
+        self.address = address or config.WORKER_ADDRESS
+        self.authkey = authkey
+        self._key_file = None
+        self.queue = ImageJobQueue(engine=_engine)
+        self._has_jobs = threading.Event()
+        self._listener = None
+
+    def _dispatch_loop(self):
+        """唯一调用 engine 的线程：有新任务就执行到队列清空"""
+        while True:
+            self._has_jobs.wait()
+            self._has_jobs.clear()
+            try:
+                self.queue.run()
+            except Exception as e:
+                print(f"[image worker] 调度出错: {e}")
+
+    def _handle_jobs(self, conn, send_lock, request):
+        jobs = request.get("jobs", [])
+        remaining = [len(jobs)]
+        count_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                try:
+                    conn.send(message)
+                except (OSError, EOFError):
+                    # 客户端已断开，剩余结果直接丢弃
+                    pass
+
+        def on_done(job, index):
+            if job.error is not None:
+                send({"id": request["id"], "index": index, "error": str(job.error)})
+            else:
+                send({"id": request["id"], "index": index, "image": job.result})
+            with count_lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                send({"id": request["id"], "done": True, "stats": self.queue.stats()})
+
+        if not jobs:
+            send({"id": request["id"], "done": True, "stats": self.queue.stats()})
+            return
+        for index, job in enumerate(jobs):
+            self.queue.submit(
+                job["prompt"], job["model_name"], job.get("width", 1024), job.get("height", 1024),
+                priority=job.get("priority", 0), negative_prompt=job.get("negative_prompt"),
+                on_done=lambda j, index=index: on_done(j, index),
+            )
+        self._has_jobs.set()
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                op = request.get("op")
+                if op == "jobs":
+                    self._handle_jobs(conn, send_lock, request)
+                elif op == "stats":
+                    with send_lock:
+                        conn.send({
+                            "id": request["id"], "done": True,
+                            "stats": self.queue.stats(), "cache": _engine.pipeline_cache_stats(),
+                        })
+                else:
+                    with send_lock:
+                        conn.send({"id": request.get("id"), "done": True, "error": f"unknown op {op}"})
+        finally:
+            conn.close()
+
+    def serve_forever(self, preload=()):
+        for model_name in preload:
+            _engine._load_model(model_name)
+        threading.Thread(target=self._dispatch_loop, daemon=True).start()
+        if self.authkey is None:
+            self.authkey, self._key_file = _worker_authkey()
+        self._listener = Listener(self.address, authkey=self.authkey)
+        print(f"[image worker] 监听 {self.address}，设备 {_engine.device}")
+        try:
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    # 认证失败等单个连接的问题不影响服务
+                    print(f"[image worker] 拒绝连接: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+            if self._key_file is not None:
+                try:
+                    os.remove(self._key_file)
+                except OSError:
+                    pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图片生成 worker 进程")
+    parser.add_argument("--preload", nargs="*", default=[], help="启动时预先加载的模型")
+    args = parser.parse_args()
+    ImageWorker().serve_forever(args.preload)
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import hmac
@@ -10,11 +11,11 @@ from time import mktime
 from urllib.parse import urlencode
 from wsgiref.handlers import format_date_time
 
-import torch
-import websocket
-from diffusers import StableDiffusionPipeline, AutoencoderKL, UNet2DConditionModel
-from openai import OpenAI
-from transformers import CLIPTextModel, CLIPTokenizer
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+# torch / diffusers / transformers / websocket 导入耗时数秒，只在 tts、generate_image 首次调用时导入，
+# 只用 llm() 的流程（摘要、健康检查等）不需要它们
 
 API_KEY = "1"
 API_BASE = "http://maas-api.cn-huabei-1.xf-yun.com/v1"
@@ -23,25 +24,156 @@ TTS_APISecret = "1"
 TTS_APIKey = "1"
 
 
-def llm(prompt: str, llm_name: str="Qwen") -> str:
+# LLM HTTP 连接池：同一 (base_url, api_key) 共用一个客户端，保持长连接，
+# 避免每次请求都重新建立 TCP/TLS 连接
+LLM_MAX_CONNECTIONS = 64            # 每个客户端的最大并发连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS = 32  # 空闲时保留的长连接数
+LLM_KEEPALIVE_EXPIRY = 60.0         # 空闲连接保留秒数
+LLM_TIMEOUT = 600.0                 # 单次请求超时秒数
+
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
+# 事件循环 -> ({(base_url, api_key): AsyncOpenAI}, 关闭钩子)
+# 事件循环结束时由关闭钩子关闭并移除；没走到关闭钩子就被关闭的事件循环，在下次建表时清理
+_async_llm_clients = {}
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
 
-    client = OpenAI(api_key=API_KEY, base_url=API_BASE)
-    match llm_name:
-        case "DeepSeek":
-            model_id = "xopdeepseekv32"
-        case "Qwen":
-            model_id = "xop3qwen1b7"
-        case _:
-            pass
-    messages = prompt
+
+def get_llm_client(base_url: str = None, api_key: str = None) -> OpenAI:
+    """返回 (base_url, api_key) 对应的共享 OpenAI 客户端，首次调用时创建"""
+    key = (base_url or API_BASE, api_key or API_KEY)
+    client = _llm_clients.get(key)
+    if client is None:
+        with _llm_clients_lock:
+            client = _llm_clients.get(key)
+            if client is None:
+                http_client = httpx.Client(limits=_http_limits(), timeout=LLM_TIMEOUT)
+                # 重试只在 modules/llm.py 中做（经过限流、退避和熔断），SDK 自带重试关闭
+                client = OpenAI(api_key=key[1], base_url=key[0], http_client=http_client, max_retries=0)
+                _llm_clients[key] = client
+    return client
+
+
+def close_llm_clients():
+    """关闭所有共享客户端及其连接池"""
+    with _llm_clients_lock:
+        clients = list(_llm_clients.values())
+        _llm_clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def _close_on_loop_shutdown(clients):
+    """
+    挂在事件循环上的异步生成器，停在 yield 处。asyncio.run 退出前调用 loop.shutdown_asyncgens()，
+    会 aclose 所有未结束的异步生成器，借此关闭该循环上的客户端。
+    clients 已被取走（为空）时什么也不做。
+    """
     try:
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=messages,
-            stream=False,
-            temperature=0.7,
-            max_tokens=4096,
-        )
+        yield
+    finally:
+        if clients:
+            pending = list(clients.values())
+            clients.clear()
+            with _llm_clients_lock:
+                _async_llm_clients.pop(asyncio.get_running_loop(), None)
+            for client in pending:
+                await client.close()
+
+
+def _finish_closer(closer):
+    """同步结束关闭钩子（其客户端表已清空，finally 中没有需要等待的操作）"""
+    try:
+        closer.aclose().send(None)
+    except StopIteration:
+        pass
+
+
+def _register_loop_clients(loop):
+    """为新的事件循环建立客户端表并登记关闭钩子，调用方持有 _llm_clients_lock"""
+    for dead in [l for l in _async_llm_clients if l.is_closed()]:
+        # 连接池绑定在已关闭的事件循环上，无法再 await 关闭，只能丢弃
+        clients, closer = _async_llm_clients.pop(dead)
+        clients.clear()
+        _finish_closer(closer)
+    clients = {}
+    closer = _close_on_loop_shutdown(clients)
+    # 同步推进到 yield：首次迭代时事件循环通过 asyncgen 钩子登记这个生成器
+    try:
+        closer.asend(None).send(None)
+    except StopIteration:
+        pass
+    _async_llm_clients[loop] = (clients, closer)
+    return clients
+
+
+def get_async_llm_client(base_url: str = None, api_key: str = None) -> AsyncOpenAI:
+    """
+    返回当前事件循环下 (base_url, api_key) 对应的共享 AsyncOpenAI 客户端。
+    异步连接池绑定在创建它的事件循环上，所以按事件循环分别缓存；
+    事件循环结束时（asyncio.run 退出前）自动关闭，也可以提前调用 aclose_llm_clients。
+    """
+    loop = asyncio.get_running_loop()
+    key = (base_url or API_BASE, api_key or API_KEY)
+    with _llm_clients_lock:
+        entry = _async_llm_clients.get(loop)
+        clients = entry[0] if entry is not None else _register_loop_clients(loop)
+        client = clients.get(key)
+        if client is None:
+            http_client = httpx.AsyncClient(limits=_http_limits(), timeout=LLM_TIMEOUT)
+            client = AsyncOpenAI(api_key=key[1], base_url=key[0], http_client=http_client, max_retries=0)
+            clients[key] = client
+    return client
+
+
+async def aclose_llm_clients():
+    """关闭当前事件循环下的所有共享异步客户端"""
+    loop = asyncio.get_running_loop()
+    with _llm_clients_lock:
+        entry = _async_llm_clients.pop(loop, None)
+    if entry is None:
+        return
+    clients, closer = entry
+    pending = list(clients.values())
+    clients.clear()
+    _finish_closer(closer)
+    for client in pending:
+        await client.close()
+
+
+# 模型简称 -> 服务端模型 ID；不在表中的名称原样作为模型 ID 使用
+LLM_MODEL_IDS = {
+    "DeepSeek": "xopdeepseekv32",
+    "Qwen": "xop3qwen1b7",
+}
+
+
+DEFAULT_TEMPERATURE = 0.7
+LLM_MAX_OUTPUT_TOKENS = 4096
+
+
+def _chat_params(prompt, llm_name, temperature, stream=False):
+    return dict(
+        model=LLM_MODEL_IDS.get(llm_name, llm_name),
+        messages=prompt,
+        stream=stream,
+        temperature=temperature,
+        max_tokens=LLM_MAX_OUTPUT_TOKENS,
+    )
+
+
+def llm(prompt: str, llm_name: str="Qwen", temperature: float=DEFAULT_TEMPERATURE) -> str:
+
+    client = get_llm_client()
+    try:
+        response = client.chat.completions.create(**_chat_params(prompt, llm_name, temperature))
         message = response.choices[0].message
         return message.content
     except Exception as e:
@@ -49,6 +181,57 @@ def llm(prompt: str, llm_name: str="Qwen") -> str:
         raise e
 
 
+async def allm(prompt: str, llm_name: str="Qwen", temperature: float=DEFAULT_TEMPERATURE) -> str:
+    """llm 的 asyncio 版本，参数和返回值相同"""
+    client = get_async_llm_client()
+    try:
+        response = await client.chat.completions.create(**_chat_params(prompt, llm_name, temperature))
+        message = response.choices[0].message
+        return message.content
+    except Exception as e:
+        print(f"{e}")
+        raise e
+
+
+def llm_stream(prompt: str, llm_name: str="Qwen", temperature: float=DEFAULT_TEMPERATURE):
+    """
+    流式调用，逐块产出 (文本增量, finish_reason)；finish_reason 只在最后一块非空。
+    调用方提前关闭生成器（.close()）时会同时关闭 HTTP 响应，服务端停止生成。
+    """
+    client = get_llm_client()
+    try:
+        stream = client.chat.completions.create(**_chat_params(prompt, llm_name, temperature, stream=True))
+    except Exception as e:
+        print(f"{e}")
+        raise e
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            yield (choice.delta.content or ""), choice.finish_reason
+    finally:
+        stream.close()
+
+
+async def allm_stream(prompt: str, llm_name: str="Qwen", temperature: float=DEFAULT_TEMPERATURE):
+    """llm_stream 的 asyncio 版本（异步生成器，提前结束时用 aclose()）"""
+    client = get_async_llm_client()
+    try:
+        stream = await client.chat.completions.create(**_chat_params(prompt, llm_name, temperature, stream=True))
+    except Exception as e:
+        print(f"{e}")
+        raise e
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            yield (choice.delta.content or ""), choice.finish_reason
+    finally:
+        await stream.close()
+
+
 class Ws_Param(object):
     # 初始化时接收 vcn (发音人)
     def __init__(self, APPID, APIKey, APISecret, Text, vcn):
@@ -105,6 +288,8 @@ class Ws_Param(object):
 
 
 def tts(text: str, voice_role: str = "narrator", path: str = "."):
+    import websocket
+
     #print(voice_role)
     VOICE_MAP = {
         "narrator": "x4_yezi",  # 旁白/解说
@@ -210,6 +395,9 @@ def tts(text: str, voice_role: str = "narrator", path: str = "."):
 def generate_image(
     prompt: str, model_name: str = "noobai3", width: int = 512, lenth: int = 512
 ):
+    import torch
+    from diffusers import StableDiffusionPipeline, AutoencoderKL, UNet2DConditionModel
+    from transformers import CLIPTextModel, CLIPTokenizer
 
     model_path = {
         "zimage": "redcraftRedzimageUpdatedDEC03_redzimage15AIO",
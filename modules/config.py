@@ -1,4 +1,87 @@
+import os
+
 Compliance_Review = False
+
+# 章节摘要并发数：<=1 时逐章串行（上一章摘要作为上下文），默认；
+# >1 时开启并发模式，每章改用上一章原文结尾作为上下文，不再等待上一章摘要。
+# 上下文不同会影响摘要质量，已有项目续跑时也会混用两种上下文，按需手动开启
+SUMMARY_WORKERS = 1
+# 并发模式下作为上下文的上一章结尾字数
+SUMMARY_PREV_TAIL_CHARS = 500
+
+# 分镜规划时作为上下文的“前序镜头”摘要长度上限（token）
+BLUEPRINT_PREV_SHOTS_TOKENS = 300
+
+# 镜头技术参数填充并发数，以及每完成多少个镜头批量写回一次
+REFINE_WORKERS = 8
+REFINE_FLUSH_EVERY = 20
+# 每个技术参数请求合并的镜头数，1 表示逐个镜头请求
+REFINE_BATCH_SIZE = 8
+
+# 素材生成：按镜头类型选择生图模型，HighQuality 镜头优先生成
+IMAGE_MODEL_HIGH_QUALITY = "NoobAI-XL"
+IMAGE_MODEL_NORMAL = "KOALA-1B"
+
+# 各模型的速率上限：rpm 为请求数/分钟，tpm 为 token/分钟（输入+输出估算），0 表示不限制。
+# 同一模型的额度由所有阶段、所有线程共享；遇到 429 时自动降速，之后逐步恢复
+LLM_RATE_LIMITS = {
+    "DeepSeek": {"rpm": 60, "tpm": 200000},
+    "Qwen": {"rpm": 120, "tpm": 400000},
+}
+# 未在上表中列出的模型的请求数上限（次/分钟）
+LLM_REQUESTS_PER_MINUTE = 120
+
+# 传输错误（429、5xx、连接/超时）的重试次数与指数退避参数（秒）
+LLM_TRANSPORT_RETRIES = 5
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 60.0
+# 同一模型连续传输失败达到该次数后熔断，冷却期间的调用直接失败
+LLM_BREAKER_THRESHOLD = 8
+LLM_BREAKER_COOLDOWN = 60.0
+
+# 各模型的上下文窗口（token）。未列出的模型按 LLM_DEFAULT_CONTEXT_WINDOW 计算
+LLM_CONTEXT_WINDOWS = {
+    "DeepSeek": 128000,
+    "Qwen": 32768,
+}
+LLM_DEFAULT_CONTEXT_WINDOW = 32768
+# 预留给续写消息和估算误差的 token 数
+LLM_CONTEXT_MARGIN = 1024
+
+# 是否使用流式调用：边接收边校验输出格式，明显无效时提前中止，并统计首 token 延迟
+LLM_STREAM = True
+
+# LLM 响应缓存：相同模型、提示词、temperature 和输出格式的请求直接复用上次结果
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "llm_cache.db")
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 超出后按最近使用时间淘汰
+
+# 模型路由：调用时未指定 model_name 时按阶段（stage）策略选模型
+#   model            首选模型，便宜的阶段交给小模型
+#   fallback         首选模型输出无法解析（或熔断中）时改用的模型
+#   max_input_tokens 输入估算超过该值时直接使用 fallback，小模型长上下文效果差
+LLM_DEFAULT_MODEL = "DeepSeek"
+LLM_STAGE_POLICY = {
+    "chapter_summary": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "summary_50": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "overall_summary": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "extraction": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "ranking": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "compliance": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "profiling": {"model": "DeepSeek"},
+    "blueprint": {"model": "DeepSeek"},
+    # sd_prompt 直接决定出图质量，而 fallback 只在解析失败时触发，格式正确但质量差的结果会直接通过，
+    # 所以默认不降级。确认小模型效果可接受后，可改为
+    # {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 8000} 以节省费用
+    "refinement": {"model": "DeepSeek"},
+    "music_analyzer": {"model": "Qwen", "fallback": "DeepSeek", "max_input_tokens": 24000},
+    "music_director": {"model": "DeepSeek"},
+}
+# 每百万 token 单价（元），只用于按阶段统计花费，请按实际账单修改
+LLM_PRICES = {
+    "DeepSeek": {"input": 2.0, "output": 3.0},
+    "Qwen": {"input": 0.3, "output": 0.6},
+}
 # 假设这些全局变量在主程序中被填充
 lora_list = {
 
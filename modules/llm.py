@@ -1,83 +1,895 @@
 import json
 import yaml
 import re
+import time
+import random
+import asyncio
+import hashlib
+import sqlite3
+import threading
 from copy import deepcopy
-from .AI_api import llm
+from .AI_api import llm, allm, llm_stream, allm_stream, DEFAULT_TEMPERATURE, LLM_MAX_OUTPUT_TOKENS
+from .config import (
+    LLM_STREAM, LLM_REQUESTS_PER_MINUTE, LLM_RATE_LIMITS, LLM_TRANSPORT_RETRIES,
+    LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN, LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES,
+    LLM_CONTEXT_WINDOWS, LLM_DEFAULT_CONTEXT_WINDOW, LLM_CONTEXT_MARGIN,
+    LLM_DEFAULT_MODEL, LLM_STAGE_POLICY, LLM_PRICES,
+)
 import os
 import importlib.util
+
+# 优先使用 libyaml 的 C 解析器，未编译 libyaml 时退回纯 Python 版本
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 class LLMOutputError(Exception):
     pass
 
 
-def _call_llm_with_retry(
-    prompt_vars: dict,
-    context_data,
-    output_format: str = "yaml",
-    model_name: str = "DeepSeek",
-):
+class LLMUnavailableError(Exception):
+    """模型熔断中（连续传输失败过多），调用直接失败而不再请求服务端"""
+    pass
+
+
+# ==============================================================================
+# 限流、退避与熔断
+# ==============================================================================
+# 每个模型一组（所有阶段、所有线程/协程共享）：
+#   _ModelLimiter   请求数/分钟 与 token/分钟 两个令牌桶；遇到 429 速率减半，之后每次成功逐步恢复
+#   _CircuitBreaker 连续传输失败达到阈值后熔断一段时间，期间调用直接抛 LLMUnavailableError；
+#                   冷却后放行，再失败立即重新熔断，成功则恢复
+# 传输错误（429、5xx、连接/超时）按带随机抖动的指数退避重试。
+
+class _TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        # 最多积攒 10 秒的额度，避免空闲后瞬间打满
+        self.capacity = max(per_minute / 6.0, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, cost, scale, now):
+        """返回还需等待的秒数；rate 为 0 表示不限制"""
+        if not self.rate:
+            return 0.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * scale)
+        self.updated = now
+        # 单次开销超过容量时，攒满即可放行（余额会变成负数，由后续请求偿还）
+        need = min(cost, self.capacity)
+        if self.level >= need:
+            return 0.0
+        return (need - self.level) / (self.rate * scale)
+
+    def take(self, cost):
+        if self.rate:
+            self.level -= cost
+
+
+class _ModelLimiter:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = _TokenBucket(rpm)
+        self.tokens = _TokenBucket(tpm)
+        self.scale = 1.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """额度足够时扣除并返回 0，否则返回需要等待的秒数（不扣除）"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.requests.wait_time(1, self.scale, now),
+                self.tokens.wait_time(tokens, self.scale, now),
+            )
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+            return wait
+
+    def debit(self, tokens: int):
+        """请求完成后补扣输出部分的 token"""
+        with self._lock:
+            self.tokens.take(tokens)
+
+    def on_throttled(self):
+        with self._lock:
+            self.scale = max(0.1, self.scale * 0.5)
+
+    def on_success(self):
+        with self._lock:
+            self.scale = min(1.0, self.scale * 1.05)
+
+
+class _CircuitBreaker:
+    def __init__(self, model_name: str, threshold: int, cooldown: float):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            remaining = self.open_until - time.monotonic()
+        if remaining > 0:
+            raise LLMUnavailableError(f"{self.model_name} 熔断中，{remaining:.0f} 秒后重试")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                print(f"[llm] {self.model_name} 连续失败 {self.failures} 次，熔断 {self.cooldown:.0f} 秒。")
+
+
+_model_guards = {}
+_model_guards_lock = threading.Lock()
+
+
+def _get_guard(model_name):
+    guard = _model_guards.get(model_name)
+    if guard is None:
+        with _model_guards_lock:
+            guard = _model_guards.get(model_name)
+            if guard is None:
+                limits = LLM_RATE_LIMITS.get(model_name, {})
+                guard = (
+                    _ModelLimiter(limits.get("rpm", LLM_REQUESTS_PER_MINUTE), limits.get("tpm", 0)),
+                    _CircuitBreaker(model_name, LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN),
+                )
+                _model_guards[model_name] = guard
+    return guard
+
+
+def _retry_delay(error, attempt):
     """
-    Robust LLM call with:
-    - continuation
-    - retry
-    - restart
-    - strict output contract
+    判断传输错误是否值得重试，返回等待秒数；不可重试返回 None。
+    优先使用服务端 Retry-After，否则为带完全抖动的指数退避。
     """
+    status = getattr(error, "status_code", None)
+    name = type(error).__name__
+    retryable = (
+        status == 429
+        or (status is not None and status >= 500)
+        or "Timeout" in name
+        or "Connection" in name
+        or isinstance(error, (ConnectionError, TimeoutError))
+    )
+    if not retryable:
+        return None
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+    except ValueError:
+        pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
 
-    # -------------------------
-    # Configuration
-    # -------------------------
-    MAX_CONTINUE = 3
-    MAX_RETRY = 2
-    MAX_RESTART = 1
 
-    if output_format not in ("yaml", "json", "text"):
-        raise ValueError(f"Unsupported output_format: {output_format}")
+def _reply_text(reply):
+    return reply[0] if isinstance(reply, tuple) else str(reply or "")
 
-    # -------------------------
-    # Prompt construction
-    # -------------------------
+
+def _call_guarded(model_name, messages, send, stage=None):
+    """经过限流、退避重试和熔断发出一次请求；send() 执行实际传输，用量记在 stage 名下"""
+    limiter, breaker = _get_guard(model_name)
+    tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    attempt = 0
+    while True:
+        breaker.check()
+        wait = limiter.reserve(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = limiter.reserve(tokens)
+        start = time.perf_counter()
+        try:
+            reply = send()
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            breaker.record_failure()
+            if getattr(e, "status_code", None) == 429:
+                limiter.on_throttled()
+            attempt += 1
+            if attempt > LLM_TRANSPORT_RETRIES:
+                raise
+            print(f"[llm] {model_name} 请求失败（{type(e).__name__}），{delay:.1f} 秒后第 {attempt} 次重试。")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        limiter.on_success()
+        output_tokens = estimate_tokens(_reply_text(reply))
+        limiter.debit(output_tokens)
+        _usage_stats.record(stage, model_name, time.perf_counter() - start, tokens, output_tokens)
+        return reply
+
+
+async def _acall_guarded(model_name, messages, send, stage=None):
+    """_call_guarded 的 asyncio 版本；send() 返回协程"""
+    limiter, breaker = _get_guard(model_name)
+    tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    attempt = 0
+    while True:
+        breaker.check()
+        wait = limiter.reserve(tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = limiter.reserve(tokens)
+        start = time.perf_counter()
+        try:
+            reply = await send()
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            breaker.record_failure()
+            if getattr(e, "status_code", None) == 429:
+                limiter.on_throttled()
+            attempt += 1
+            if attempt > LLM_TRANSPORT_RETRIES:
+                raise
+            print(f"[llm] {model_name} 请求失败（{type(e).__name__}），{delay:.1f} 秒后第 {attempt} 次重试。")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        limiter.on_success()
+        output_tokens = estimate_tokens(_reply_text(reply))
+        limiter.debit(output_tokens)
+        _usage_stats.record(stage, model_name, time.perf_counter() - start, tokens, output_tokens)
+        return reply
+
+
+# ==============================================================================
+# LLM 响应缓存
+# ==============================================================================
+
+class LLMResponseCache:
+    """
+    持久化的 LLM 响应缓存（SQLite 单文件）。
+    键为 (模型名, 初始消息, temperature, 输出格式) 的 SHA-256，
+    值为最终通过校验（格式解析和调用方的 validate）的原始文本和解析结果。
+    总大小超过 max_bytes 时按最近使用时间淘汰（LRU）。
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, raw TEXT, parsed TEXT, "
+            "size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, messages, temperature, output_format):
+        payload = json.dumps(
+            {"model": model_name, "messages": messages, "temperature": temperature, "format": output_format},
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, output_format):
+        """命中返回 (parsed, raw)，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT raw, parsed FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used=? WHERE key=?", (time.time(), key))
+        raw, parsed = row
+        if parsed is None:
+            # 解析结果无法用 JSON 保存（如 YAML 中的日期），命中时重新解析原文
+            return _parse_output(raw, output_format), raw
+        return json.loads(parsed), raw
+
+    def put(self, key, model_name, raw, parsed):
+        try:
+            parsed_json = json.dumps(parsed, ensure_ascii=False)
+        except (TypeError, ValueError):
+            parsed_json = None
+        size = len(raw.encode("utf-8")) + (len(parsed_json.encode("utf-8")) if parsed_json else 0)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, raw, parsed, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model_name, raw, parsed_json, size, now, now),
+            )
+            self._total += size - (old[0] if old else 0)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            if old is not None:
+                self._conn.execute("DELETE FROM responses WHERE key=?", (key,))
+                self._total -= old[0]
+
+    def _evict(self):
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total = 0
+                break
+            victims = []
+            for key, size in rows:
+                if self._total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                self._total -= size
+            self._conn.executemany("DELETE FROM responses WHERE key=?", victims)
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": self._total}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total = 0
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def _get_response_cache():
+    """按配置懒加载全局缓存；LLM_CACHE_ENABLED 为 False 时返回 None"""
+    global _response_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+    return _response_cache
+
+
+def get_llm_cache_stats():
+    """返回缓存命中/未命中次数、条目数和占用字节数"""
+    cache = _get_response_cache()
+    if cache is None:
+        return {"hits": 0, "misses": 0, "entries": 0, "bytes": 0}
+    return cache.stats()
+
+
+# ==============================================================================
+# 流式输出校验
+# ==============================================================================
+
+# 流式校验提前中止时传给重试协议的 finish_reason
+STREAM_ABORTED = "aborted"
+
+_FENCE_RE = re.compile(r"^\s*(```[a-zA-Z]*[ \t]*\n?)?\s*")
+# YAML 输出契约都是映射或列表：首个非注释行应为 `key:`、`- item`、`---` 或流式集合。
+# 键不含空白（引号键除外），这样 "Here is the result:" 之类的说明文字会被拦下
+_YAML_FIRST_LINE_RE = re.compile(
+    r"""^(---|-(\s|$)|[\[{]|("[^"\n]*"|'[^'\n]*'|[^\s:#\-'"][^\s:]*)\s*:(\s|$))"""
+)
+_HEAD_DECIDE_CHARS = 200
+
+
+class _StreamValidator:
+    """
+    增量校验流式输出，发现明显不符合格式时抛出 LLMOutputError：
+    - json：首个有效字符必须是 { 或 [；括号必须匹配；顶层结构闭合后不能再有正文
+    - yaml：首行必须像映射键或列表项（模型先写一段说明文字的情况会被拦下）
+    - text：不校验
+    截断（括号未闭合）不算错误，交给续写逻辑处理。
+    """
+
+    def __init__(self, output_format: str):
+        self.output_format = output_format
+        self._head = ""
+        self._started = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._closed = False
+
+    def feed(self, delta: str):
+        if self.output_format == "text" or not delta:
+            return
+        if not self._started:
+            self._head += delta
+            body = _FENCE_RE.sub("", self._head, count=1)
+            if not body:
+                return
+            if body[0] == "`" and "\n" not in self._head and len(self._head) < _HEAD_DECIDE_CHARS:
+                # 代码块标记被拆在多个分块里（如 "`" 后跟 "``json"），等收完这一行再判断
+                return
+            if self.output_format == "yaml":
+                self._check_yaml_head(body)
+                return
+            if body[0] not in "{[":
+                raise LLMOutputError(f"JSON 输出开头无效: {body[:50]!r}")
+            self._started = True
+            delta = body
+        if self.output_format == "json":
+            self._scan_json(delta)
+
+    def _check_yaml_head(self, body: str):
+        """跳过空行和 # 注释行，用第一个内容行判断；该行未收完且不够长时继续等待"""
+        *complete, partial = body.split("\n")
+        for line in complete:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            break
+        else:
+            line = partial.strip()
+            if len(partial) < _HEAD_DECIDE_CHARS or line.startswith("#"):
+                return
+        if not _YAML_FIRST_LINE_RE.match(line):
+            raise LLMOutputError(f"YAML 输出开头无效: {line[:50]!r}")
+        self._started = True
+
+    def _scan_json(self, delta: str):
+        pairs = {"}": "{", "]": "["}
+        for ch in delta:
+            if self._closed:
+                if not ch.isspace() and ch != "`":
+                    raise LLMOutputError("JSON 顶层结构结束后仍有多余内容")
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack or self._stack.pop() != pairs[ch]:
+                    raise LLMOutputError("JSON 括号不匹配")
+                if not self._stack:
+                    self._closed = True
+
+
+class _StreamStats:
+    """按模型统计流式请求数、首 token 延迟（TTFT）、总耗时和提前中止次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, model_name, ttft, total, aborted):
+        with self._lock:
+            d = self._data.setdefault(model_name, {
+                "requests": 0, "aborted": 0, "ttft_sum": 0.0, "ttft_max": 0.0, "ttft_count": 0, "total_sum": 0.0,
+            })
+            d["requests"] += 1
+            d["aborted"] += int(aborted)
+            d["total_sum"] += total
+            if ttft is not None:
+                d["ttft_count"] += 1
+                d["ttft_sum"] += ttft
+                d["ttft_max"] = max(d["ttft_max"], ttft)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                model: {
+                    "requests": d["requests"],
+                    "aborted": d["aborted"],
+                    "avg_ttft": d["ttft_sum"] / d["ttft_count"] if d["ttft_count"] else None,
+                    "max_ttft": d["ttft_max"],
+                    "avg_latency": d["total_sum"] / d["requests"],
+                }
+                for model, d in self._data.items()
+            }
+
+
+_stream_stats = _StreamStats()
+
+
+def get_llm_stream_stats():
+    """返回各模型流式调用的首 token 延迟、平均耗时和提前中止次数"""
+    return _stream_stats.snapshot()
+
+
+def _new_validator(output_format, prefix):
+    """续写请求从已接受的前文状态继续校验"""
+    validator = _StreamValidator(output_format)
+    try:
+        validator.feed(prefix)
+    except LLMOutputError:
+        # 前文本身已无法通过校验（非流式结果等），续写部分不再校验
+        validator = _StreamValidator("text")
+    return validator
+
+
+def _stream_call(messages, model_name, temperature, output_format, prefix=""):
+    """
+    流式请求一次，返回 (文本, finish_reason)；校验失败时提前关闭连接并返回 STREAM_ABORTED。
+    prefix 为续写前已接受的文本。
+    """
+    validator = _new_validator(output_format, prefix)
+    start = time.monotonic()
+    ttft = None
+    parts = []
+    finish_reason = None
+    stream = llm_stream(messages, llm_name=model_name, temperature=temperature)
+    try:
+        for delta, reason in stream:
+            if delta:
+                if ttft is None:
+                    ttft = time.monotonic() - start
+                parts.append(delta)
+                validator.feed(delta)
+            if reason:
+                finish_reason = reason
+    except LLMOutputError as e:
+        stream.close()
+        print(f"[stream] {model_name} 输出无效，提前中止: {e}")
+        finish_reason = STREAM_ABORTED
+    _stream_stats.record(model_name, ttft, time.monotonic() - start, finish_reason == STREAM_ABORTED)
+    return "".join(parts), finish_reason
+
+
+async def _astream_call(messages, model_name, temperature, output_format, prefix=""):
+    """_stream_call 的 asyncio 版本"""
+    validator = _new_validator(output_format, prefix)
+    start = time.monotonic()
+    ttft = None
+    parts = []
+    finish_reason = None
+    stream = allm_stream(messages, llm_name=model_name, temperature=temperature)
+    try:
+        async for delta, reason in stream:
+            if delta:
+                if ttft is None:
+                    ttft = time.monotonic() - start
+                parts.append(delta)
+                validator.feed(delta)
+            if reason:
+                finish_reason = reason
+    except LLMOutputError as e:
+        await stream.aclose()
+        print(f"[stream] {model_name} 输出无效，提前中止: {e}")
+        finish_reason = STREAM_ABORTED
+    _stream_stats.record(model_name, ttft, time.monotonic() - start, finish_reason == STREAM_ABORTED)
+    return "".join(parts), finish_reason
+
+
+# ==============================================================================
+# Token 预算
+# ==============================================================================
+# 不依赖具体分词器的估算：中文等非 ASCII 字符约 1 token/字，ASCII 约 4 字符/token。
+# 偏保守，只用于判断上下文是否会超出模型窗口。
+
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7f]")
+_TRIM_MARKER = "\n……（中间省略约 {} 字）……\n"
+_MIN_FIELD_TOKENS = 64
+
+
+def estimate_tokens(text) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    text = str(text)
+    non_ascii = len(_NON_ASCII_RE.findall(text))
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """保留开头，截断到约 max_tokens 个 token"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def _trim_middle(text: str, max_tokens: int) -> str:
+    """保留开头约 2/3 和结尾约 1/3，中间替换为省略标记，使总量不超过 max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens - estimate_tokens(_TRIM_MARKER.format(len(text))), 0)
+    head = truncate_to_tokens(text, keep * 2 // 3)
+    tail_budget = keep - estimate_tokens(head)
+    tail = truncate_to_tokens(text[len(head):][::-1], tail_budget)[::-1]
+    omitted = len(text) - len(head) - len(tail)
+    return head + _TRIM_MARKER.format(omitted) + tail
+
+
+def _context_budget(model_name: str) -> int:
+    """模型窗口扣除输出上限和预留量后，留给输入的 token 数"""
+    window = LLM_CONTEXT_WINDOWS.get(model_name, LLM_DEFAULT_CONTEXT_WINDOW)
+    return window - LLM_MAX_OUTPUT_TOKENS - LLM_CONTEXT_MARGIN
+
+
+class ContextTemplate:
+    """
+    按模板拼成字符串的上下文：template.format(**fields)。
+    发送的文本与直接传格式化好的字符串完全相同，但 _fit_context 可以按字段分别裁剪，
+    也能用 protected_fields 保护某一段（如参考信息），不会把整段文本当成一块首尾截断。
+    """
+
+    def __init__(self, template: str, **fields):
+        self.template = template
+        self.fields = fields
+
+    def render(self) -> str:
+        return self.template.format(**self.fields)
+
+    def __str__(self):
+        return self.render()
+
+
+def _fit_fields(fields: dict, budget: int, model_name: str, protected_fields=(), overhead_per_field=0):
+    """按字段从大到小依次裁剪字符串字段（protected_fields 中的字段不动），返回新的 dict"""
+    sizes = {
+        k: estimate_tokens(v if isinstance(v, str) else json.dumps(v, ensure_ascii=False))
+        for k, v in fields.items()
+    }
+    overflow = sum(sizes.values()) + overhead_per_field * len(sizes) - budget
+    if overflow <= 0:
+        return fields
+
+    fitted = dict(fields)
+    trimmable = sorted(
+        (k for k, v in fitted.items() if isinstance(v, str) and k not in protected_fields),
+        key=lambda k: sizes[k], reverse=True,
+    )
+    for key in trimmable:
+        if overflow <= 0:
+            break
+        target = max(sizes[key] - overflow, _MIN_FIELD_TOKENS)
+        if target >= sizes[key]:
+            continue
+        fitted[key] = _trim_middle(fitted[key], target)
+        new_size = estimate_tokens(fitted[key])
+        print(f"[token] {model_name} 输入超出预算，字段 {key}: {sizes[key]} -> {new_size} tokens")
+        overflow -= sizes[key] - new_size
+    return fitted
+
+
+def _fit_context(prompt_vars: dict, context_data, model_name: str, protected_fields=()):
+    """
+    让 提示词 + 上下文 不超过模型输入预算。
+    context_data 为 dict 或 ContextTemplate 时，按字段从大到小依次裁剪字符串字段
+    （protected_fields 中的字段不动）；为字符串时整体裁剪。裁剪方式为保留首尾、省略中间。
+    """
+    budget = _context_budget(model_name) - estimate_tokens(
+        prompt_vars.get("SYSTEM_PROMPT", "")
+    ) - estimate_tokens(prompt_vars.get("USER_PROMPT_TEMPLATE", ""))
+
+    if isinstance(context_data, str):
+        if estimate_tokens(context_data) <= budget:
+            return context_data
+        print(f"[token] 上下文超出 {model_name} 输入预算 {budget}，已裁剪。")
+        return _trim_middle(context_data, max(budget, _MIN_FIELD_TOKENS))
+
+    if isinstance(context_data, ContextTemplate):
+        # 模板本身的文字（标题、说明）不裁剪，从预算中扣除
+        skeleton = context_data.template.format(**{k: "" for k in context_data.fields})
+        fields = _fit_fields(
+            context_data.fields, budget - estimate_tokens(skeleton), model_name, protected_fields
+        )
+        if fields is context_data.fields:
+            return context_data
+        return ContextTemplate(context_data.template, **fields)
+
+    if not isinstance(context_data, dict):
+        return context_data
+
+    # JSON 序列化的键名、引号和缩进
+    return _fit_fields(context_data, budget, model_name, protected_fields, overhead_per_field=4)
+
+
+# ==============================================================================
+# 模型路由与按阶段统计
+# ==============================================================================
+# 调用方传 stage 而不是写死 model_name。LLM_STAGE_POLICY 决定每个阶段的首选模型、
+# 失败时的后备模型和首选模型可接受的输入上限；显式传 model_name 时不做路由。
+# 每次实际请求的耗时和 token 用量按 (阶段, 模型) 累计，用于估算各阶段花费。
+
+def _route_models(stage, model_name, prompt_vars, context_data):
+    """返回依次尝试的模型列表"""
+    if model_name:
+        return [model_name]
+    policy = LLM_STAGE_POLICY.get(stage, {})
+    model = policy.get("model", LLM_DEFAULT_MODEL)
+    fallback = policy.get("fallback")
+    if not fallback or fallback == model:
+        return [model]
+    limit = policy.get("max_input_tokens")
+    if limit is not None:
+        input_tokens = sum(estimate_tokens(m["content"]) for m in _build_messages(prompt_vars, context_data))
+        if input_tokens > limit:
+            return [fallback]
+    return [model, fallback]
+
+
+class _UsageStats:
+    """按 (阶段, 模型) 统计请求数、缓存命中、回退次数、耗时和 token 用量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _entry(self, stage, model_name):
+        return self._data.setdefault((stage or "default", model_name), {
+            "requests": 0, "cache_hits": 0, "fallbacks": 0, "latency": 0.0, "input_tokens": 0, "output_tokens": 0,
+        })
+
+    def record(self, stage, model_name, latency, input_tokens, output_tokens):
+        with self._lock:
+            d = self._entry(stage, model_name)
+            d["requests"] += 1
+            d["latency"] += latency
+            d["input_tokens"] += input_tokens
+            d["output_tokens"] += output_tokens
+
+    def record_cache_hit(self, stage, model_name):
+        with self._lock:
+            self._entry(stage, model_name)["cache_hits"] += 1
+
+    def record_fallback(self, stage, model_name):
+        """model_name 为失败后被放弃的模型"""
+        with self._lock:
+            self._entry(stage, model_name)["fallbacks"] += 1
+
+    def snapshot(self):
+        report = {}
+        with self._lock:
+            for (stage, model), d in self._data.items():
+                price = LLM_PRICES.get(model, {})
+                cost = (d["input_tokens"] * price.get("input", 0) + d["output_tokens"] * price.get("output", 0)) / 1e6
+                report.setdefault(stage, {})[model] = dict(
+                    d, cost=cost, avg_latency=d["latency"] / d["requests"] if d["requests"] else 0.0,
+                )
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_usage_stats = _UsageStats()
+
+
+def get_llm_stage_report():
+    """
+    返回 {阶段: {模型: 统计}}，统计包含 requests、cache_hits、fallbacks、
+    latency（累计秒数）、avg_latency、input_tokens、output_tokens（估算）和 cost（按 LLM_PRICES）
+    """
+    return _usage_stats.snapshot()
+
+
+def print_llm_stage_report():
+    """打印各阶段、各模型的用量、耗时和花费"""
+    report = get_llm_stage_report()
+    if not report:
+        return
+    print("[llm] 各阶段模型用量：")
+    print(f"  {'stage':<16}{'model':<10}{'requests':>9}{'cached':>7}{'fallback':>9}{'avg_s':>8}{'input':>10}{'output':>10}{'cost':>10}")
+    total_cost = 0.0
+    for stage in sorted(report):
+        for model, d in sorted(report[stage].items()):
+            total_cost += d["cost"]
+            print(
+                f"  {stage:<16}{model:<10}{d['requests']:>9}{d['cache_hits']:>7}{d['fallbacks']:>9}"
+                f"{d['avg_latency']:>8.2f}{d['input_tokens']:>10}{d['output_tokens']:>10}{d['cost']:>10.4f}"
+            )
+    print(f"  合计花费: {total_cost:.4f}")
+
+
+def _build_messages(prompt_vars: dict, context_data):
     system_prompt = prompt_vars.get("SYSTEM_PROMPT", "").strip()
 
     user_template = prompt_vars.get("USER_PROMPT_TEMPLATE", "")
     if isinstance(context_data, (dict, list)):
         context_str = json.dumps(context_data, ensure_ascii=False, indent=2)
+    elif isinstance(context_data, ContextTemplate):
+        context_str = context_data.render()
     else:
         context_str = str(context_data)
 
     user_prompt = user_template + "\n" + context_str
 
-    base_messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
 
+
+def _strip_markdown(text: str) -> str:
+    text = re.sub(r"```(yaml|json)?", "", text)
+    return text.replace("```", "").strip()
+
+
+def _parse_output(text: str, output_format: str):
+    if output_format == "text":
+        return text
+
+    try:
+        if output_format == "json":
+            return json.loads(text)
+        else:
+            return yaml.load(text, Loader=_YamlLoader)
+    except Exception as e:
+        raise LLMOutputError(str(e))
+
+
+def _llm_retry_protocol(base_messages: list, output_format: str = "yaml"):
+    """
+    Retry / continuation / restart logic as a transport-agnostic generator.
+
+    Protocol:
+    - yields (messages to send, text accepted so far in this attempt);
+      the second item is non-empty for continuation requests so that a
+      streaming validator can resume from where the reply was cut
+    - receives the raw model reply via .send(text) or
+      .send((text, finish_reason)); finish_reason "length" marks a
+      truncated reply, STREAM_ABORTED a reply the stream validator
+      rejected early
+    - returns (parsed result, cleaned raw text) as StopIteration.value,
+      or raises LLMOutputError
+
+    _call_llm_with_retry and acall_llm_with_retry drive it with the
+    blocking and the asyncio transport respectively.
+    """
+
     # -------------------------
-    # Helpers
+    # Configuration
     # -------------------------
-    def _call(messages):
-        resp = llm(messages, llm_name=model_name)
-        return resp if isinstance(resp, str) else str(resp)
+    MAX_CONTINUE = 3
+    MAX_RETRY = 2
+    MAX_RESTART = 1
 
-    def _strip_markdown(text: str) -> str:
-        text = re.sub(r"```(yaml|json)?", "", text)
-        return text.replace("```", "").strip()
+    # -------------------------
+    # Helpers
+    # -------------------------
+    def _call(messages, prefix=""):
+        resp = yield messages, prefix
+        if isinstance(resp, tuple):
+            text, finish_reason = resp
+            return (text or ""), finish_reason
+        return (resp if isinstance(resp, str) else str(resp)), None
 
     def _parse(text: str):
-        if output_format == "text":
-            return text
-
-        try:
-            if output_format == "json":
-                return json.loads(text)
-            else:
-                return yaml.safe_load(text)
-        except Exception as e:
-            raise LLMOutputError(str(e))
+        return _parse_output(text, output_format)
 
-    def _is_obviously_truncated(text: str) -> bool:
+    def _is_obviously_truncated(text: str, finish_reason) -> bool:
         """
-        Heuristic only. Real trust is on parsing failure.
+        Trust the provider's finish_reason when the transport reports one,
+        fall back to a heuristic otherwise. Real trust is on parsing failure.
         """
+        if finish_reason is not None:
+            return finish_reason == "length"
         stripped = text.rstrip()
         if output_format == "json":
             return not stripped.endswith(("}", "]"))
@@ -116,17 +928,17 @@ def _call_llm_with_retry(
             continue_count = 0
 
             # --- First call ---
-            current = _call(messages)
+            current, finish_reason = yield from _call(messages)
             full_text += current
 
             # --- Continue if needed ---
-            while continue_count < MAX_CONTINUE:
+            while continue_count < MAX_CONTINUE and finish_reason != STREAM_ABORTED:
                 try:
                     cleaned = _strip_markdown(full_text)
                     _parse(cleaned)
                     break  # parse success
                 except LLMOutputError:
-                    if not _is_obviously_truncated(full_text):
+                    if not _is_obviously_truncated(full_text, finish_reason):
                         break
 
                 continue_count += 1
@@ -134,13 +946,15 @@ def _call_llm_with_retry(
                 messages.append(
                     {"role": "user", "content": _continue_prompt(current)}
                 )
-                current = _call(messages)
+                current, finish_reason = yield from _call(messages, full_text)
                 full_text += current
 
             # --- Final parse attempt ---
             try:
+                if finish_reason == STREAM_ABORTED:
+                    raise LLMOutputError("stream aborted by validator")
                 cleaned = _strip_markdown(full_text)
-                return _parse(cleaned)
+                return _parse(cleaned), cleaned
             except LLMOutputError:
                 retry_count += 1
                 if retry_count > MAX_RETRY:
@@ -169,6 +983,160 @@ def _call_llm_with_retry(
 
     raise LLMOutputError("LLM failed to produce valid output after retries and restart.")
 
+
+def _check_output_format(output_format):
+    if output_format not in ("yaml", "json", "text"):
+        raise ValueError(f"Unsupported output_format: {output_format}")
+
+
+def _is_valid(validate, parsed):
+    """调用方的结果校验；没有 validate 时视为通过，validate 自身出错视为不通过"""
+    if validate is None:
+        return True
+    try:
+        return bool(validate(parsed))
+    except Exception:
+        return False
+
+
+def _call_llm_once(prompt_vars, context_data, output_format, model_name, temperature, use_cache, protected_fields, stage, validate=None):
+    """
+    用指定模型完成一次完整调用（续写 / 重试 / 重启）。
+    只有通过 validate 的结果才写入缓存；命中的缓存未通过 validate 时删除并重新请求。
+    """
+    context_data = _fit_context(prompt_vars, context_data, model_name, protected_fields)
+    base_messages = _build_messages(prompt_vars, context_data)
+    cache = _get_response_cache() if use_cache else None
+    if cache is not None:
+        key = cache.make_key(model_name, base_messages, temperature, output_format)
+        hit = cache.get(key, output_format)
+        if hit is not None:
+            if _is_valid(validate, hit[0]):
+                _usage_stats.record_cache_hit(stage, model_name)
+                return hit[0]
+            cache.delete(key)
+
+    protocol = _llm_retry_protocol(base_messages, output_format)
+    try:
+        messages, prefix = next(protocol)
+        while True:
+            if LLM_STREAM:
+                send = lambda: _stream_call(messages, model_name, temperature, output_format, prefix)
+            else:
+                send = lambda: llm(messages, llm_name=model_name, temperature=temperature)
+            reply = _call_guarded(model_name, messages, send, stage)
+            messages, prefix = protocol.send(reply)
+    except StopIteration as done:
+        parsed, raw = done.value
+
+    if cache is not None and _is_valid(validate, parsed):
+        cache.put(key, model_name, raw, parsed)
+    return parsed
+
+
+async def _acall_llm_once(prompt_vars, context_data, output_format, model_name, temperature, use_cache, protected_fields, stage, validate=None):
+    """_call_llm_once 的 asyncio 版本；缓存读写是同步 SQLite 调用，放到线程池执行，不阻塞事件循环"""
+    context_data = _fit_context(prompt_vars, context_data, model_name, protected_fields)
+    base_messages = _build_messages(prompt_vars, context_data)
+    cache = await asyncio.to_thread(_get_response_cache) if use_cache else None
+    if cache is not None:
+        key = cache.make_key(model_name, base_messages, temperature, output_format)
+        hit = await asyncio.to_thread(cache.get, key, output_format)
+        if hit is not None:
+            if _is_valid(validate, hit[0]):
+                _usage_stats.record_cache_hit(stage, model_name)
+                return hit[0]
+            await asyncio.to_thread(cache.delete, key)
+
+    protocol = _llm_retry_protocol(base_messages, output_format)
+    try:
+        messages, prefix = next(protocol)
+        while True:
+            if LLM_STREAM:
+                send = lambda: _astream_call(messages, model_name, temperature, output_format, prefix)
+            else:
+                send = lambda: allm(messages, llm_name=model_name, temperature=temperature)
+            reply = await _acall_guarded(model_name, messages, send, stage)
+            messages, prefix = protocol.send(reply)
+    except StopIteration as done:
+        parsed, raw = done.value
+
+    if cache is not None and _is_valid(validate, parsed):
+        await asyncio.to_thread(cache.put, key, model_name, raw, parsed)
+    return parsed
+
+
+def _call_llm_with_retry(
+    prompt_vars: dict,
+    context_data,
+    output_format: str = "yaml",
+    model_name: str = None,
+    temperature: float = DEFAULT_TEMPERATURE,
+    use_cache: bool = True,
+    protected_fields=(),
+    stage: str = None,
+    validate=None,
+):
+    """
+    Robust LLM call with:
+    - continuation
+    - retry
+    - restart
+    - strict output contract
+    - persistent response cache (see LLMResponseCache); validate(parsed) -> bool
+      is the caller's own check of the result: only results that pass it are
+      cached, and a cached result that fails it is evicted and re-requested
+      (a fresh result that fails is still returned, but not cached)
+    - input trimmed to the model's context window (see _fit_context);
+      protected_fields are never trimmed
+    - model routing: without model_name the model is chosen from
+      LLM_STAGE_POLICY[stage] and the input size, and the fallback model is
+      used when the preferred one fails (see _route_models)
+    """
+    _check_output_format(output_format)
+    models = _route_models(stage, model_name, prompt_vars, context_data)
+    for i, model in enumerate(models):
+        try:
+            return _call_llm_once(
+                prompt_vars, context_data, output_format, model, temperature, use_cache, protected_fields, stage, validate
+            )
+        except (LLMOutputError, LLMUnavailableError) as e:
+            if i == len(models) - 1:
+                raise
+            _usage_stats.record_fallback(stage, model)
+            print(f"[llm] 阶段 {stage}：{model} 失败（{type(e).__name__}），改用 {models[i + 1]}。")
+
+
+async def acall_llm_with_retry(
+    prompt_vars: dict,
+    context_data,
+    output_format: str = "yaml",
+    model_name: str = None,
+    temperature: float = DEFAULT_TEMPERATURE,
+    use_cache: bool = True,
+    protected_fields=(),
+    stage: str = None,
+    validate=None,
+):
+    """
+    asyncio version of _call_llm_with_retry: same continuation / retry /
+    restart contract, the same response cache and model routing, requests
+    go through the async transport (allm). Many calls can be awaited
+    concurrently with asyncio.gather.
+    """
+    _check_output_format(output_format)
+    models = _route_models(stage, model_name, prompt_vars, context_data)
+    for i, model in enumerate(models):
+        try:
+            return await _acall_llm_once(
+                prompt_vars, context_data, output_format, model, temperature, use_cache, protected_fields, stage, validate
+            )
+        except (LLMOutputError, LLMUnavailableError) as e:
+            if i == len(models) - 1:
+                raise
+            _usage_stats.record_fallback(stage, model)
+            print(f"[llm] 阶段 {stage}：{model} 失败（{type(e).__name__}），改用 {models[i + 1]}。")
+
 # ==============================================================================
 # Helper Function: 动态加载提示词文件
 # ==============================================================================
@@ -188,7 +1156,7 @@ def _load_prompt_vars(prompt_name: str):
         raise FileNotFoundError(f"提示词文件未找到: {file_path}")
 
     with open(file_path, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f) or {}
+        data = yaml.load(f, Loader=_YamlLoader) or {}
 
     prompts = data.get("prompts", {})
 
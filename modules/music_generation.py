@@ -161,7 +161,8 @@ def _generate_music_prompts(project_name: str):
             summary = _call_llm_with_retry(
                 analyzer_prompt,
                 {"shots_text": text},
-                output_format="text"
+                output_format="text",
+                stage="music_analyzer"
             )
 
             if summary:
@@ -181,7 +182,8 @@ def _generate_music_prompts(project_name: str):
                 "timeline_summary": timeline_summary,
                 "chapter_context": chapter_context
             },
-            output_format="json"
+            output_format="json",
+            stage="music_director"
         )
 
         if isinstance(response, dict):
@@ -1,5 +1,6 @@
 import os
 import re
+import codecs
 import json
 import yaml
 import importlib.util
@@ -9,159 +10,336 @@ import time
 import subprocess
 import sys
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from pathlib import Path
 import glob
 from .AI_api import tts,llm 
-from .config import lora_list,speaker_list,Compliance_Review
-from .llm import _call_llm_with_retry, _load_prompt_vars
+from .config import lora_list,speaker_list,Compliance_Review,SUMMARY_WORKERS,SUMMARY_PREV_TAIL_CHARS,REFINE_WORKERS,REFINE_FLUSH_EVERY,REFINE_BATCH_SIZE,BLUEPRINT_PREV_SHOTS_TOKENS,IMAGE_MODEL_HIGH_QUALITY,IMAGE_MODEL_NORMAL
+from .llm import _call_llm_with_retry, _load_prompt_vars, truncate_to_tokens, print_llm_stage_report, LLMOutputError, ContextTemplate
 
 # 获取当前文件的父目录的父目录（即module1和module2的共同父目录）
 current_dir = Path(__file__).parent
 parent_dir = current_dir.parent
 sys.path.append(str(parent_dir))
-from image_api import generate_image
 from file_of_film_project import *
 from .music_generation import _generate_music_prompts
+
+# LLM 结果的结构校验：传给 _call_llm_with_retry(validate=...)，不合格的回答不写入响应缓存
+def _is_yaml_dict(result):
+    return isinstance(result, dict)
+
+def _is_shot_list(result):
+    return isinstance(result, list) and all(isinstance(shot, dict) for shot in result)
+
 # ==============================================================================
 # 一、 文本预处理模块
 # ==============================================================================
 
-def _format_text(project_name):
+def _utf8_alternation(chars):
+    """把字符集合转成 UTF-8 字节正则的分组（字节正则的 [] 无法匹配多字节汉字）"""
+    return b"(?:" + b"|".join(re.escape(c.encode("utf-8")) for c in chars) + b")"
+
+# 匹配 "第x章" 或 "Chapter x" 等，考虑中文数字
+# 等价于 r"(第[0-9一二三四五六七八九十百千]+[章|节]|Chapter\s*\d+)"，但作用在原文字节上
+CHAPTER_PATTERN = re.compile(
+    b"(" + "第".encode("utf-8")
+    + _utf8_alternation("0123456789一二三四五六七八九十百千") + b"+"
+    + _utf8_alternation("章|节")
+    + rb"|Chapter\s*\d+)"
+)
+
+# 流式切分参数
+SEGMENT_BLOCK_SIZE = 1 << 20    # 每次从原文读取的字节数
+CHAPTER_HEADER_MAX_BYTES = 256  # 章节标题的最大字节长度，块边界附近保留这么多字节等待下一块
+FORMAT_FLUSH_EVERY = 64         # 每切出多少章写一次章节索引
+
+def _iter_header_starts(raw_text_path, block_size=SEGMENT_BLOCK_SIZE):
     """
-    智能切分原文，建立章节索引。
+    按块读取原文，逐个产出章节标题在原文中的起始字节偏移。
+    缓冲区末尾 CHAPTER_HEADER_MAX_BYTES 字节内的匹配可能被块边界截断，
+    留到读入下一块后再判断，因此跨块的标题也能正确识别。内存占用与原文大小无关。
+    """
+    keep = CHAPTER_HEADER_MAX_BYTES
+    with open(raw_text_path, 'rb') as f:
+        buf = b""
+        buf_offset = 0  # buf[0] 在原文中的偏移
+        eof = False
+        while not eof:
+            block = f.read(block_size)
+            eof = not block
+            buf += block
+
+            # 非末尾时，只确认结束位置离缓冲区末尾足够远的匹配
+            limit = len(buf) if eof else max(0, len(buf) - keep)
+            scan_pos = 0
+            for m in CHAPTER_PATTERN.finditer(buf):
+                if m.end() > limit:
+                    # 可能被块边界截断，下一轮从它的起点重新匹配
+                    scan_pos = m.start()
+                    break
+                yield buf_offset + m.start()
+                scan_pos = m.end()
+            else:
+                scan_pos = max(scan_pos, limit)
+
+            # 丢弃已确认不含标题起点的部分
+            buf = buf[scan_pos:]
+            buf_offset += scan_pos
+
+def _iter_fixed_chunks(raw, chunk_size=2000, search_range=200):
+    """
+    未匹配到章节时按字数切分。
+    每次只解码当前位置之后的一个小窗口，在窗口内按字符寻找切割点。
+    产出 (start, end, chunk_index)。
+    """
+    total_len = len(raw)
+    window_chars = chunk_size + search_range
+    current_pos = 0
+    chapter_count = 1
+
+    while current_pos < total_len:
+        window_bytes = raw.read_bytes(current_pos, current_pos + window_chars * 4)
+        at_end = current_pos + len(window_bytes) >= total_len
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        window = decoder.decode(window_bytes, final=at_end)[:window_chars]
+        at_end = at_end and len(window.encode("utf-8")) == len(window_bytes)
+
+        if at_end and len(window) <= chunk_size:
+            cut_pos = len(window)
+        else:
+            # 在 chunk_size 前后 search_range 范围内寻找最佳切割点
+            search_start = chunk_size - search_range
+            window_text = window[search_start:window_chars]
+
+            # 寻找 \n 或 句号
+            # 优先找换行符
+            newline_idx = window_text.rfind('\n')
+            period_idx = window_text.rfind('。')
+
+            if newline_idx != -1:
+                cut_pos = search_start + newline_idx + 1 # 保留换行符
+            elif period_idx != -1:
+                cut_pos = search_start + period_idx + 1 # 保留句号
+            else:
+                cut_pos = chunk_size # 强制切割
+
+        piece = window[:cut_pos]
+        if piece.strip():
+            lead = len(piece) - len(piece.lstrip())
+            start = current_pos + len(piece[:lead].encode("utf-8"))
+            end = current_pos + len(piece.rstrip().encode("utf-8"))
+            yield start, end, chapter_count
+            chapter_count += 1
+
+        current_pos += len(piece.encode("utf-8"))
+
+def _iter_chapter_spans(raw_text_path, block_size=SEGMENT_BLOCK_SIZE):
+    """
+    流式章节切分，逐章产出 (chapter_id, start, end, prefix)。
+    优先按章节标题切分：读到下一个标题时即可产出上一章；
+    整本都没有标题时，再按字数切分。
+    """
+    with RawTextReader(raw_text_path) as raw:
+        prev_start = None
+        count = 0
+        for header_start in _iter_header_starts(raw_text_path, block_size):
+            if prev_start is not None:
+                # 结束位置是下一个章节的开始，内容包含标题
+                start, end = raw.strip_range(prev_start, header_start)
+                yield f"chapter_{count}", start, end, ""
+            prev_start = header_start
+            count += 1
+
+        if prev_start is not None:
+            # 最后一章到文本末尾
+            start, end = raw.strip_range(prev_start, len(raw))
+            yield f"chapter_{count}", start, end, ""
+            return
+
+        # 如果未匹配到章节，按字数切分，自动添加伪标题以便后续识别
+        for start, end, n in _iter_fixed_chunks(raw):
+            yield f"chapter_{n}", start, end, f"第 {n} 部分\n\n"
+
+def _iter_format_text(project_name):
+    """
+    边切分边保存：每攒够 FORMAT_FLUSH_EVERY 章写一次索引，
+    然后产出这些已可读取的章节ID，下游（如摘要生成）不必等整本切完。
+    中间批次在索引中留下未完成标记，最后一次写入时清除；
+    上次切分中途中断时，重新扫描原文（切分结果确定，已登记的章节原样覆盖）并补全剩余章节。
     """
     raw_text_path = read_raw_text(project_name)
     
-    if not os.path.exists(raw_text_path):
+    if raw_text_path is None or not os.path.exists(raw_text_path):
         raise FileNotFoundError(f"原文文件不存在: {raw_text_path}")
-        
-    with open(raw_text_path, 'r', encoding='utf-8') as f:
-        full_text = f.read()
 
-    # 1. 尝试正则匹配章节头
-    # 匹配 "第x章" 或 "Chapter x" 等，考虑中文数字
-    chapter_pattern = r"(第[0-9一二三四五六七八九十百千]+[章|节]|Chapter\s*\d+)"
-    matches = list(re.finditer(chapter_pattern, full_text))
-    
-    chapters = []
-    
-    if len(matches) > 0:
-        # 如果匹配到章节
-        for i in range(len(matches)):
-            start_idx = matches[i].start()
-            # 结束位置是下一个章节的开始，如果是最后一章则是文本末尾
-            end_idx = matches[i+1].start() if i < len(matches) - 1 else len(full_text)
-            
-            # 提取标题和内容
-            # 标题通常在 matches[i].group() 中，但可能包含换行，需要清理
-            # 这里简单起见，使用章节 ID 自动生成，内容包含标题
-            content = full_text[start_idx:end_idx].strip()
-            chapter_id = f"chapter_{i+1}"
-            chapters.append((chapter_id, content))
-    else:
-        # 如果未匹配到章节，按字数切分
-        chunk_size = 2000
-        search_range = 200
-        current_pos = 0
-        chapter_count = 1
-        text_len = len(full_text)
-        
-        while current_pos < text_len:
-            target_pos = current_pos + chunk_size
-            
-            if target_pos >= text_len:
-                cut_pos = text_len
-            else:
-                # 在 target_pos 前后 search_range 范围内寻找最佳切割点
-                search_start = max(current_pos, target_pos - search_range)
-                search_end = min(text_len, target_pos + search_range)
-                window_text = full_text[search_start:search_end]
-                
-                # 寻找 \n 或 句号
-                # 优先找换行符
-                newline_idx = window_text.rfind('\n')
-                period_idx = window_text.rfind('。')
-                
-                if newline_idx != -1:
-                    cut_pos = search_start + newline_idx + 1 # 保留换行符
-                elif period_idx != -1:
-                    cut_pos = search_start + period_idx + 1 # 保留句号
-                else:
-                    cut_pos = target_pos # 强制切割
-            
-            content = full_text[current_pos:cut_pos].strip()
-            if content:
-                chapter_id = f"chapter_{chapter_count}"
-                # 自动添加伪标题以便后续识别
-                content = f"第 {chapter_count} 部分\n\n{content}"
-                chapters.append((chapter_id, content))
-                chapter_count += 1
-            
-            current_pos = cut_pos
+    done = len(get_chapter_list(project_name))
+    if done:
+        print(f"[{project_name}] 上次切分未完成（已登记 {done} 章），重新扫描原文补全章节索引。")
 
-    # 存储所有章节
-    for ch_id, ch_content in chapters:
-        save_chapter(project_name, ch_id, ch_content)
-    
-    print(f"[{project_name}] 原文处理完成，共切分 {len(chapters)} 章。")
+    pending = []
+    total = 0
+    for span in _iter_chapter_spans(raw_text_path):
+        pending.append(span)
+        if len(pending) >= FORMAT_FLUSH_EVERY:
+            save_chapter_spans(project_name, pending, complete=False)
+            total += len(pending)
+            yield from (chapter_id for chapter_id, *_ in pending)
+            pending = []
+
+    # 即使没有剩余章节也要写一次，清除未完成标记
+    save_chapter_spans(project_name, pending, complete=True)
+    total += len(pending)
+    yield from (chapter_id for chapter_id, *_ in pending)
+
+    print(f"[{project_name}] 原文处理完成，共切分 {total} 章。")
+
+def _format_text(project_name):
+    """
+    智能切分原文，建立章节索引。
+    原文按块流式扫描，只记录每章在原文中的字节范围，不整体解码、不复制正文。
+    """
+    for _ in _iter_format_text(project_name):
+        pass
 
 # ==============================================================================
 # 二、 摘要生成模块 (Summary System)
 # ==============================================================================
 
-def _generate_chapter_summary(project_name):
+_CHAPTER_SUMMARY_TEMPLATE = """
+### 上下文信息
+{prev_label}：
+{prev_content}
+
+### 待处理文本
+本章内容：
+{current_text}
+
+### 参考信息
+下一章预读（仅供连贯性参考，不可剧透）：
+{next_preview}
+"""
+
+def _build_chapter_summary_context(prev_label, prev_content, current_text, next_preview):
+    """按字段构造上下文，超出输入预算时先裁剪上一章和本章，参考信息（next_preview）不裁剪"""
+    return ContextTemplate(
+        _CHAPTER_SUMMARY_TEMPLATE,
+        prev_label=prev_label, prev_content=prev_content,
+        current_text=current_text, next_preview=next_preview,
+    )
+
+_CHAPTER_SUMMARY_PROTECTED = ("prev_label", "next_preview")
+
+def _iter_chapter_summary_inputs(project_name, chapter_ids):
+    """
+    按顺序产出 (chapter_id, prev_id, current_text, next_preview)。
+    需要预读下一章，所以始终向前多取一个；预读的正文留给下一轮，每章只读一次。
+    """
+    chapter_iter = iter(chapter_ids)
+    chapter_id = next(chapter_iter, None)
+    current_text = read_chapter(project_name, chapter_id) if chapter_id is not None else None
+    prev_id = None
+
+    while chapter_id is not None:
+        next_id = next(chapter_iter, None)
+
+        # 下一章预读（截取前 500 字）
+        next_text = None
+        next_preview = "无（这是最后一章）"
+        if next_id is not None:
+            next_text = read_chapter(project_name, next_id)
+            next_preview = next_text[:500] + "..."
+
+        yield chapter_id, prev_id, current_text, next_preview
+
+        prev_id, chapter_id, current_text = chapter_id, next_id, next_text
+
+def _generate_chapter_summary(project_name, chapter_ids=None, workers=None, skip_existing=False):
     """
     生成每章的详细摘要。
+    chapter_ids 可以是任意可迭代对象（例如 _iter_format_text 的生成器），
+    这样可以一边切分原文一边生成摘要；默认处理全部章节。
+    workers 默认取 config.SUMMARY_WORKERS，>1 时并发生成（见 _generate_chapter_summary_parallel）。
+    skip_existing=True 时跳过已有摘要的章节（用于中断后续跑），它们仍作为下一章的上文。
     """
     prompt_vars = _load_prompt_vars("_generate_chapter_summary.yaml")
-    chapter_ids = get_chapter_list(project_name)
-    
-    # 按照 ID 排序（假设 ID 格式包含数字或顺序一致，简单排序）
-    # 如果 ID 是 "chapter_1", "chapter_2"，字符串排序可能不准，这里假设 get_chapter_list 返回有序列表
+    if chapter_ids is None:
+        chapter_ids = get_chapter_list(project_name)
+    if workers is None:
+        workers = SUMMARY_WORKERS
+    if workers > 1:
+        return _generate_chapter_summary_parallel(project_name, chapter_ids, prompt_vars, workers, skip_existing)
     
-    for i, chapter_id in enumerate(chapter_ids):
-        # 1. 读取文本
-        current_text = read_chapter(project_name, chapter_id)
-        
-        # 上一章摘要
+    # 假设 chapter_ids 按章节顺序给出
+    for chapter_id, prev_id, current_text, next_preview in _iter_chapter_summary_inputs(project_name, chapter_ids):
+        if skip_existing and get_chapter_summary(project_name, chapter_id) is not None:
+            continue
+
+        # 1. 上一章摘要
         prev_summary = "无（这是第一章）"
-        if i > 0:
-            prev_id = chapter_ids[i-1]
+        if prev_id is not None:
             try:
                 prev_summary = get_chapter_summary(project_name, prev_id)
             except:
                 prev_summary = "（上一章摘要未生成）"
-        
-        # 下一章预读（截取前 500 字）
-        next_preview = "无（这是最后一章）"
-        if i < len(chapter_ids) - 1:
-            next_id = chapter_ids[i+1]
-            next_text = read_chapter(project_name, next_id)
-            next_preview = next_text[:500] + "..."
             
         # 2. 构建 Context
-        context_data = f"""
-### 上下文信息
-上一章摘要：
-{prev_summary}
-
-### 待处理文本
-本章内容：
-{current_text}
+        context_data = _build_chapter_summary_context("上一章摘要", prev_summary, current_text, next_preview)
 
-### 参考信息
-下一章预读（仅供连贯性参考，不可剧透）：
-{next_preview}
-"""
         # 3. 调用 LLM
         # 这里要求输出纯文本，所以 format="text"
-        summary = _call_llm_with_retry(prompt_vars, context_data, output_format="text", model_name="Qwen")
+        summary = _call_llm_with_retry(prompt_vars, context_data, output_format="text", protected_fields=_CHAPTER_SUMMARY_PROTECTED, stage="chapter_summary")
         
         # 4. 保存
         save_chapter_summary(project_name, chapter_id, summary)
         print(f"[{project_name}] 章节 {chapter_id} 摘要生成完毕。")
 
+def _generate_chapter_summary_parallel(project_name, chapter_ids, prompt_vars, workers, skip_existing=False):
+    """
+    并发生成章节摘要。
+    每章的上下文改用上一章原文的结尾（而不是上一章摘要），章节之间没有依赖，可以同时请求。
+    在途请求最多 workers*2 个，输入是生成器时也只会按需向前读取；
+    结果严格按章节顺序保存和打印，与串行模式的输出顺序一致。
+    请求速率由 llm.py 中的全局限速器控制。
+    """
+    print(f"[{project_name}] 并发生成章节摘要，并发数 {workers}。")
+    pending = deque()
+
+    def _save_oldest():
+        chapter_id, future = pending.popleft()
+        summary = future.result()
+        save_chapter_summary(project_name, chapter_id, summary)
+        print(f"[{project_name}] 章节 {chapter_id} 摘要生成完毕。")
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    prev_tail = None
+    try:
+        for chapter_id, prev_id, current_text, next_preview in _iter_chapter_summary_inputs(project_name, chapter_ids):
+            if skip_existing and get_chapter_summary(project_name, chapter_id) is not None:
+                prev_tail = "..." + (current_text or "")[-SUMMARY_PREV_TAIL_CHARS:]
+                continue
+            prev_content = prev_tail if prev_id is not None else "无（这是第一章）"
+            context_data = _build_chapter_summary_context("上一章结尾", prev_content, current_text, next_preview)
+            future = pool.submit(
+                _call_llm_with_retry, prompt_vars, context_data, output_format="text",
+                protected_fields=_CHAPTER_SUMMARY_PROTECTED, stage="chapter_summary"
+            )
+            pending.append((chapter_id, future))
+            prev_tail = "..." + (current_text or "")[-SUMMARY_PREV_TAIL_CHARS:]
+
+            # 控制在途数量，同时尽早按顺序落盘
+            while len(pending) >= workers * 2 or (pending and pending[0][1].done()):
+                _save_oldest()
+
+        while pending:
+            _save_oldest()
+    except BaseException:
+        # 出错时取消还没开始的请求，已在途的请求等待结束
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
 
 def _generate_summary_on_50_chapters(project_name):
     """
@@ -186,12 +364,15 @@ def _generate_summary_on_50_chapters(project_name):
             except:
                 continue
         
-        context_data = f"""
-### 章节摘要列表 ({len(chunk)}章)
+        context_data = ContextTemplate(
+            """
+### 章节摘要列表 ({count}章)
 {summaries_text}
-"""
+""",
+            count=len(chunk), summaries_text=summaries_text,
+        )
         # 调用 LLM，要求纯文本
-        summary_50 = _call_llm_with_retry(prompt_vars, context_data, output_format="text", model_name="Qwen")
+        summary_50 = _call_llm_with_retry(prompt_vars, context_data, output_format="text", stage="summary_50")
         
         # 保存
         save_summary_on_50_chapters(project_name, summary_id, summary_50)
@@ -212,12 +393,15 @@ def _generate_overall_summary(project_name):
         content = get_summary_on_50_chapters(project_name, s_id)
         all_summaries_text += f"[{s_id} 内容]:\n{content}\n\n"
         
-    context_data = f"""
+    context_data = ContextTemplate(
+        """
 ### 所有的长篇摘要
 {all_summaries_text}
-"""
+""",
+        all_summaries_text=all_summaries_text,
+    )
     # 调用 LLM，强制要求 YAML
-    overall_data = _call_llm_with_retry(prompt_vars, context_data, output_format="yaml", model_name="Qwen")
+    overall_data = _call_llm_with_retry(prompt_vars, context_data, output_format="yaml", stage="overall_summary")
     
     # 转换为字符串或直接保存（API save_overall_summary 接受 string 还是 dict？
     # 根据 "save_overall_summary(project_name, summary): 保存到 全文总结.txt"，
@@ -285,7 +469,7 @@ def _generate_objects(project_name):
         print(f"  - 正在分析第 {idx+1}/{len(chunks)} 批次章节...")
         try:
             # 调用 LLM
-            result = _call_llm_with_retry(extraction_prompt_vars, context_data, output_format="yaml", model_name="Qwen")
+            result = _call_llm_with_retry(extraction_prompt_vars, context_data, output_format="yaml", stage="extraction", validate=_is_yaml_dict)
             
             # 解析结果: 预期结构 {"thoughts": "...", "entities": [...]}
             entities = result.get("entities", [])
@@ -334,7 +518,7 @@ def _generate_objects(project_name):
         "entity_list": entity_list_str
     }
     
-    rank_result = _call_llm_with_retry(ranking_prompt_vars, context_data, output_format="yaml", model_name="Qwen")
+    rank_result = _call_llm_with_retry(ranking_prompt_vars, context_data, output_format="yaml", stage="ranking", validate=_is_yaml_dict)
     #print('-'*30)#debug
     #print(rank_result)
     # 预期结构: { "thoughts": "...", "main_objects": [...], "secondary_objects": [...] }
@@ -394,122 +578,127 @@ def _generate_objects(project_name):
     # 计数器用于生成 ID
     id_counters = {"char": 1, "loc": 1, "item": 1, "obj": 1}
     
-    for obj_struct in final_objects_to_save:
-        # 生成 ID
-        prefix = obj_struct["id_prefix"]
-        obj_id = f"{prefix}_{id_counters[prefix]:03d}"
-        id_counters[prefix] += 1
+    # 对象会话：次要对象只在内存中累积，每个主要对象画像完成后落盘一次，
+    # 进程崩溃或被杀时最多丢失当前这一个主要对象的 LLM 结果
+    with object_session(project_name):
+        for obj_struct in final_objects_to_save:
+            # 生成 ID
+            prefix = obj_struct["id_prefix"]
+            obj_id = f"{prefix}_{id_counters[prefix]:03d}"
+            id_counters[prefix] += 1
         
-        name = obj_struct["name"]
-        is_main = obj_struct["is_main"]
+            name = obj_struct["name"]
+            is_main = obj_struct["is_main"]
         
-        # 基础数据
-        save_data = {
-            "名称": name,
-            "类型": obj_struct["category"],
-            "别名": obj_struct["aliases"],
-            "所在章节列表": obj_struct["source_chapters"],
-            "is_main_object": is_main
-        }
+            # 基础数据
+            save_data = {
+                "名称": name,
+                "类型": obj_struct["category"],
+                "别名": obj_struct["aliases"],
+                "所在章节列表": obj_struct["source_chapters"],
+                "is_main_object": is_main
+            }
         
-        # 只有主要对象才进行昂贵的 Profiling 调用
-        # 次要对象只保存基础信息
-        if is_main:
-            print(f"  - 分析主要对象: {name} ({obj_id})...")
+            # 只有主要对象才进行昂贵的 Profiling 调用
+            # 次要对象只保存基础信息
+            if is_main:
+                print(f"  - 分析主要对象: {name} ({obj_id})...")
             
-            # 构建章节范围描述 (e.g., "chapter_1, chapter_5, ...")
-            # 限制长度，防止 token 溢出
-            chapter_range_str = ", ".join(obj_struct["source_chapters"][:20])
-            if len(obj_struct["source_chapters"]) > 20:
-                chapter_range_str += " 等..."
-
-            context_data = {
-                "target_object": name,
-                "chapter_range": chapter_range_str,
-                "overall_summary": overall_summary,
-                "lora_list": lora_list_str,
-                "speaker_list": json.dumps(speaker_list, ensure_ascii=False)
-            }
+                # 构建章节范围描述 (e.g., "chapter_1, chapter_5, ...")
+                # 限制长度，防止 token 溢出
+                chapter_range_str = ", ".join(obj_struct["source_chapters"][:20])
+                if len(obj_struct["source_chapters"]) > 20:
+                    chapter_range_str += " 等..."
+
+                context_data = {
+                    "target_object": name,
+                    "chapter_range": chapter_range_str,
+                    "overall_summary": overall_summary,
+                    "lora_list": lora_list_str,
+                    "speaker_list": json.dumps(speaker_list, ensure_ascii=False)
+                }
             
-            try:
-                # 调用 LLM
-                profile_result = _call_llm_with_retry(profiling_prompt_vars, context_data, output_format="yaml")
+                try:
+                    # 调用 LLM
+                    profile_result = _call_llm_with_retry(profiling_prompt_vars, context_data, output_format="yaml", stage="profiling", validate=_is_yaml_dict)
                 
-                # 移除 thoughts 字段，保留纯净数据
-                if "thoughts" in profile_result:
-                    print(f"    [思考] {profile_result.pop('thoughts')}")
+                    # 移除 thoughts 字段，保留纯净数据
+                    if "thoughts" in profile_result:
+                        print(f"    [思考] {profile_result.pop('thoughts')}")
                 
-                # 整合结果到 save_data
-                # profile_result 预期包含: object_name, type, default_state, change_states
+                    # 整合结果到 save_data
+                    # profile_result 预期包含: object_name, type, default_state, change_states
                 
-                # 1. 默认状态
-                default_state = profile_result.get("default_state", {})
-                save_data["描述"] = default_state.get("appearance_cn", "")
-                save_data["性格"] = default_state.get("personality", "")
+                    # 1. 默认状态
+                    default_state = profile_result.get("default_state", {})
+                    save_data["描述"] = default_state.get("appearance_cn", "")
+                    save_data["性格"] = default_state.get("personality", "")
                 
-                # 构造 standardized states 列表
-                # 我们将 default 也视为一种状态，名为 'default'
-                states = []
+                    # 构造 standardized states 列表
+                    # 我们将 default 也视为一种状态，名为 'default'
+                    states = []
                 
-                # 添加默认状态
-                states.append({
-                    "state_name": "default",
-                    "visual_description": default_state.get("visual_description", ""),
-                    "appearance_prompts": "", # 留给 refinement 阶段翻译或在此处翻译
-                    "trigger_keywords": ["通用", "default"], # 默认触发
-                    "recommended_lora": default_state.get("recommended_lora", "None"),
-                    "lora_weight": default_state.get("lora_weight", 0.8),
-                    "speaker": default_state.get("speaker", "narrator")
-                })
+                    # 添加默认状态
+                    states.append({
+                        "state_name": "default",
+                        "visual_description": default_state.get("visual_description", ""),
+                        "appearance_prompts": "", # 留给 refinement 阶段翻译或在此处翻译
+                        "trigger_keywords": ["通用", "default"], # 默认触发
+                        "recommended_lora": default_state.get("recommended_lora", "None"),
+                        "lora_weight": default_state.get("lora_weight", 0.8),
+                        "speaker": default_state.get("speaker", "narrator")
+                    })
 
                 
                 
-                # 添加变化状态
-                changes = profile_result.get("states", [])
-                if changes:
-                    for change in changes:
-                        # 清洗 trigger_conditions 为 list
-                        triggers = change.get("state_name", "")
-                        if isinstance(triggers, str):
-                            triggers = [t.strip() for t in triggers.split(",")]
+                    # 添加变化状态
+                    changes = profile_result.get("states", [])
+                    if changes:
+                        for change in changes:
+                            # 清洗 trigger_conditions 为 list
+                            triggers = change.get("state_name", "")
+                            if isinstance(triggers, str):
+                                triggers = [t.strip() for t in triggers.split(",")]
                             
-                        states.append({
-                            "state_name": change.get("state_name", "unknown_state"),
-                            "visual_description": change.get("appearance_cn", ""),
-                            "trigger_keywords": triggers,
-                            "recommended_lora": change.get("recommended_lora", "None"),
-                            "lora_weight": change.get("lora_weight", 0.8),
-                            "speaker": change.get("speaker", "narrator")
-                        })
+                            states.append({
+                                "state_name": change.get("state_name", "unknown_state"),
+                                "visual_description": change.get("appearance_cn", ""),
+                                "trigger_keywords": triggers,
+                                "recommended_lora": change.get("recommended_lora", "None"),
+                                "lora_weight": change.get("lora_weight", 0.8),
+                                "speaker": change.get("speaker", "narrator")
+                            })
                 
-                save_data["states"] = states
+                    save_data["states"] = states
                 
-            except Exception as e:
-                print(f"    ! 对象 {name} 画像生成出错: {e}")
-                print(f"错误类型: {type(e).__name__}")
-                print(f"错误信息processor at 490: {e}")
-                print("错误追踪:")
-                traceback.print_exc()  # 打印完整的错误堆栈
-                # 出错时保留基础数据，避免 ID 丢失
+                except Exception as e:
+                    print(f"    ! 对象 {name} 画像生成出错: {e}")
+                    print(f"错误类型: {type(e).__name__}")
+                    print(f"错误信息processor at 490: {e}")
+                    print("错误追踪:")
+                    traceback.print_exc()  # 打印完整的错误堆栈
+                    # 出错时保留基础数据，避免 ID 丢失
+                    save_data["states"] = [{
+                        "state_name": "default", 
+                        "visual_description": "数据生成失败，仅有占位符。",
+                        "trigger_keywords": ["default"]
+                    }]
+
+            else:
+                # 次要对象：仅填充默认占位
+                save_data["描述"] = "次要对象，未生成详细画像。"
                 save_data["states"] = [{
-                    "state_name": "default", 
-                    "visual_description": "数据生成失败，仅有占位符。",
+                    "state_name": "default",
+                    "visual_description": "次要对象",
                     "trigger_keywords": ["default"]
                 }]
-
-        else:
-            # 次要对象：仅填充默认占位
-            save_data["描述"] = "次要对象，未生成详细画像。"
-            save_data["states"] = [{
-                "state_name": "default",
-                "visual_description": "次要对象",
-                "trigger_keywords": ["default"]
-            }]
         
-        # ---------------------------------------------------------------------
-        # 步骤 4: 保存结果
-        # ---------------------------------------------------------------------
-        save_object(project_name, obj_id, save_data)
+            # ---------------------------------------------------------------------
+            # 步骤 4: 保存结果（主要对象保存后立即落盘）
+            # ---------------------------------------------------------------------
+            save_object(project_name, obj_id, save_data)
+            if is_main:
+                flush_object_session(project_name)
         
     print(f"[{project_name}] 对象分析全部完成。")
 
@@ -671,9 +860,12 @@ def _process_text_to_shots_blueprint(project_name):
                 prompt_vars,
                 context_data,
                 output_format="yaml",
-                model_name="DeepSeek"
+                protected_fields=("text_segment",),
+                stage="blueprint",
+                validate=_is_shot_list
             )
 
+            new_shots = []
             for shot in blueprint_result:
                 shot_info = {
                     "text": shot.get("text_source", ""),
@@ -699,94 +891,222 @@ def _process_text_to_shots_blueprint(project_name):
                     }
                 }
 
-                save_shot(project_name, shot_counter, shot_info)
+                new_shots.append((shot_counter, shot_info))
 
                 prev_shots_context = (
                     f"Shot {shot_counter}: {shot_info['visual_summary']}\n"
                     + prev_shots_context
                 )
-                if len(prev_shots_context) > 500:
-                    prev_shots_context = prev_shots_context[:500]
+                prev_shots_context = truncate_to_tokens(prev_shots_context, BLUEPRINT_PREV_SHOTS_TOKENS)
 
                 shot_counter += 1
 
+            # 每次 LLM 返回的镜头一次性写入，只更新一次镜头顺序表
+            save_shots(project_name, new_shots)
+
         print(f"[{project_name}] 章节 {chapter_id} 分镜规划完成。")
 
 
-def _refine_shot_technical_details(project_name):
+def _resolve_object_state(project_name, shot_info):
+    """
+    返回 (对象引用, 状态设定)：镜头主要对象在指定状态下的视觉设定。
+    对象引用形如 "名称/状态"，批量模式下同一对象状态只发送一次。
+    """
+    # 根据 shot_info['main_object'] 找到对应的对象详细配置
+    # Blueprint 返回的是 name，通过对象索引按名称/别名直接查到对象
+    target_obj_name = shot_info.get("main_object")
+    target_obj_data = find_object_by_name(project_name, target_obj_name) or {}
+    
+    # 提取特定状态的描述
+    state_name = shot_info.get("object_state", "default")
+    state_details = "Default Appearance"
+    
+    if "states" in target_obj_data:
+        for s in target_obj_data["states"]:
+            if s["state_name"] == state_name:
+                state_details = s
+                break
+    
+    return f"{target_obj_name}/{state_name}", state_details
+
+def _build_refine_context(project_name, shot_info):
+    """为单个镜头构造技术参数填充的上下文"""
+    _, state_details = _resolve_object_state(project_name, shot_info)
+    object_details_str = json.dumps(state_details, ensure_ascii=False)
+    
+    return {
+        "shot_blueprint": json.dumps(shot_info, ensure_ascii=False),
+        "object_details": object_details_str,
+        "style_lora": "Style Lora: None (Use Base Model Style)", # 全局风格可配置
+        "speaker_list": json.dumps(speaker_list, ensure_ascii=False)
+    }
+
+def _build_refine_batch_context(project_name, batch):
+    """
+    为一批镜头构造共享上下文：speaker_list、风格和对象设定只出现一次，
+    每个镜头通过 object_ref 引用对象设定。
+    batch: [(shot_id, shot_info), ...]
+    """
+    object_details = {}
+    shots = []
+    for shot_id, shot_info in batch:
+        ref, state_details = _resolve_object_state(project_name, shot_info)
+        object_details[ref] = state_details
+        shots.append({"shot_id": shot_id, "shot_blueprint": shot_info, "object_ref": ref})
+    return {
+        "style_lora": "Style Lora: None (Use Base Model Style)", # 全局风格可配置
+        "speaker_list": speaker_list,
+        "object_details": object_details,
+        "shots": shots
+    }
+
+def _refine_result_to_update(refine_result):
+    """把 LLM 返回的技术参数转换为镜头字段"""
+    return {
+        "prompt": refine_result.get("sd_prompt", ""),
+        "negative_prompt": refine_result.get("negative_prompt", ""),
+        "script": refine_result.get("audio_script", ""),
+        "speaker_id": refine_result.get("speaker_id", ""),
+        "tts_emotion": refine_result.get("tts_emotion", "neutral")
+    }
+
+def _is_refine_result(result):
+    return isinstance(result, dict) and bool(result.get("sd_prompt"))
+
+def _refine_items_by_id(result):
+    """批量返回中字段完整的镜头，按 shot_id（字符串）索引"""
+    items = result.get("shots", []) if isinstance(result, dict) else result
+    by_id = {}
+    for item in items or []:
+        if isinstance(item, dict) and item.get("sd_prompt") and "shot_id" in item:
+            by_id[str(item["shot_id"])] = item
+    return by_id
+
+def _refine_single(prompt_vars, shot_id, context_data):
+    """单镜头请求，返回 [(shot_id, 更新字段或异常)]"""
+    try:
+        result = _call_llm_with_retry(
+            prompt_vars, context_data, output_format="yaml", protected_fields=("shot_blueprint",),
+            stage="refinement", validate=_is_refine_result
+        )
+        if not _is_refine_result(result):
+            raise LLMOutputError(f"技术参数缺少 sd_prompt: {str(result)[:200]}")
+        return [(shot_id, _refine_result_to_update(result))]
+    except Exception as e:
+        return [(shot_id, e)]
+
+def _refine_batch(batch_prompt_vars, single_prompt_vars, batch_context, single_contexts):
+    """
+    多镜头合并为一次请求，按 shot_id 取回各镜头结果。
+    整批解析失败，或某个镜头缺失/字段不完整时，该镜头单独用单镜头提示词重试。
+    single_contexts: {shot_id: 单镜头上下文}
+    返回 [(shot_id, 更新字段或异常), ...]
+    """
+    expected = {str(shot_id) for shot_id in single_contexts}
+    by_id = {}
+    try:
+        # 缺镜头的批量结果不进缓存，否则重跑时会一直拿到同一个不完整的回答
+        result = _call_llm_with_retry(
+            batch_prompt_vars, batch_context, output_format="yaml", stage="refinement",
+            validate=lambda r: expected <= _refine_items_by_id(r).keys()
+        )
+        by_id = _refine_items_by_id(result)
+    except Exception as e:
+        print(f"  ! 批量技术参数解析失败，逐个重试 {len(single_contexts)} 个镜头: {e}")
+
+    results = []
+    for shot_id, context_data in single_contexts.items():
+        item = by_id.get(str(shot_id))
+        if item is not None:
+            results.append((shot_id, _refine_result_to_update(item)))
+        else:
+            results.extend(_refine_single(single_prompt_vars, shot_id, context_data))
+    return results
+
+def _refine_shot_technical_details(project_name, workers=None, batch_size=None):
     """
     阶段 2：技术参数填充 (Blueprints -> SD Prompts & Audio Scripts)
+    各镜头之间互不依赖，由 workers 个线程并发请求 LLM（默认 config.REFINE_WORKERS）。
+    batch_size > 1 时每个请求合并 batch_size 个镜头（默认 config.REFINE_BATCH_SIZE），
+    共享的发音人列表和对象设定只发送一次。
+    上下文构造和读写存储都在主线程完成，结果每 REFINE_FLUSH_EVERY 个
+    通过 update_shots_info 批量写回。
     """
-    print(f"[{project_name}] 开始生成技术参数...")
+    if workers is None:
+        workers = REFINE_WORKERS
+    if batch_size is None:
+        batch_size = REFINE_BATCH_SIZE
+    workers = max(1, workers)
+    batch_size = max(1, batch_size)
+    print(f"[{project_name}] 开始生成技术参数，并发数 {workers}，每请求 {batch_size} 个镜头...")
     prompt_vars = _load_prompt_vars("Technical Refinement.yaml")
+    batch_prompt_vars = _load_prompt_vars("Technical Refinement Batch.yaml") if batch_size > 1 else None
     
     shot_ids = get_list_shots(project_name)
-    all_objects = list_all_objects(project_name)
-    
-    # 构造更详细的对象字典，供查找
-    # 假设 list_all_objects 返回 {obj_id: data}
-    object_lookup = all_objects 
-    
-    # 批量处理或逐个处理
-    for shot_id in shot_ids:
-        shot_info = read_shot_info(project_name, shot_id)
-        
-        # 如果已经生成过 Prompt，跳过 (支持断点续传)
-        if shot_info.get("prompt") and shot_info.get("script"):
-            continue
+    start_time = time.time()
+    done_count = 0
+    buffer = []
+
+    def _flush():
+        nonlocal done_count
+        if not buffer:
+            return
+        update_shots_info(project_name, buffer)
+        done_count += len(buffer)
+        buffer.clear()
+        elapsed = max(time.time() - start_time, 1e-6)
+        print(f"[{project_name}] 已完成 {done_count} 个镜头的技术参数，"
+              f"速度 {done_count / elapsed * 60:.1f} 镜头/分钟。")
+
+    def _collect(pending):
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            del pending[future]
+            for shot_id, update in future.result():
+                # 单个镜头失败不影响其他镜头，下次运行会重新处理
+                if isinstance(update, Exception):
+                    print(f"[{project_name}] 镜头 {shot_id} 技术参数生成失败: {update}")
+                else:
+                    buffer.append((shot_id, update))
+        if len(buffer) >= REFINE_FLUSH_EVERY:
+            _flush()
+
+    pending = {}
+    batch = []
+
+    def _submit(pool):
+        single_contexts = {sid: _build_refine_context(project_name, info) for sid, info in batch}
+        if batch_size > 1:
+            batch_context = _build_refine_batch_context(project_name, batch)
+            future = pool.submit(_refine_batch, batch_prompt_vars, prompt_vars, batch_context, single_contexts)
+        else:
+            (shot_id, context_data), = single_contexts.items()
+            future = pool.submit(_refine_single, prompt_vars, shot_id, context_data)
+        pending[future] = [sid for sid, _ in batch]
+        batch.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for shot_id in shot_ids:
+            shot_info = read_shot_info(project_name, shot_id)
             
-        # 准备 Object Details
-        # 根据 shot_info['main_object'] 找到对应的对象详细配置
-        # 这里存在名字匹配问题。Blueprint 返回的是 name，我们需要 map 到 id 或直接用 name 查
-        # 建议在 blueprint 阶段让 LLM 返回 object_id 更稳健，但 prompt 示例是 name。
-        # 这里的逻辑：遍历 all_objects 找 name 匹配
-        
-        target_obj_name = shot_info.get("main_object")
-        target_obj_data = {}
-        #print('—'*20)
-        #print(object_lookup)#debug
-        #print('—'*20)
-        for odata in object_lookup:
-            oid = odata["id"]
-            if odata.get("名称") == target_obj_name or target_obj_name in odata.get("别名", []):
-                target_obj_data = odata
-                break
-        
-        # 提取特定状态的描述
-        state_name = shot_info.get("object_state", "default")
-        state_details = "Default Appearance"
-        
-        if "states" in target_obj_data:
-            for s in target_obj_data["states"]:
-                if s["state_name"] == state_name:
-                    state_details = s
-                    break
-        
-        object_details_str = json.dumps(state_details, ensure_ascii=False)
-        
-        context_data = {
-            "shot_blueprint": json.dumps(shot_info, ensure_ascii=False),
-            "object_details": object_details_str,
-            "style_lora": "Style Lora: None (Use Base Model Style)", # 全局风格可配置
-            "speaker_list": json.dumps(speaker_list, ensure_ascii=False)
-        }
-        
-        # 调用 LLM
-        refine_result = _call_llm_with_retry(prompt_vars, context_data, output_format="yaml")
-        
-        # 更新 shot_info
-        update_data = {
-            "prompt": refine_result.get("sd_prompt", ""),
-            "negative_prompt": refine_result.get("negative_prompt", ""),
-            "script": refine_result.get("audio_script", ""),
-            "speaker_id": refine_result.get("speaker_id", ""),
-            "tts_emotion": refine_result.get("tts_emotion", "neutral")
-        }
-        
-        update_shot_info(project_name, shot_id, update_data)
-        
-        if shot_id % 10 == 0:
-            print(f"[{project_name}] 已处理 {shot_id} 个镜头的技术参数。")
+            # 如果已经生成过 Prompt，跳过 (支持断点续传)
+            if shot_info.get("prompt") and shot_info.get("script"):
+                continue
+
+            batch.append((shot_id, shot_info))
+            if len(batch) >= batch_size:
+                _submit(pool)
+
+            # 在途请求最多 workers*2 个
+            if len(pending) >= workers * 2:
+                _collect(pending)
+
+        if batch:
+            _submit(pool)
+        while pending:
+            _collect(pending)
+    _flush()
+    print(f"[{project_name}] 技术参数生成完毕，用时 {time.time() - start_time:.1f} 秒。")
 
 
 # ==============================================================================
@@ -798,17 +1118,26 @@ def analyze_text_to_shots(project_name):
     一键执行文本到镜头的全流程。
     """
     try:
+        # 0. 上次运行若在批量写入中途崩溃，先回滚到一致状态
+        recover_project_journal(project_name)
+
         # 1. 文本处理
-        # 检查是否已处理过 (简单检查第一章是否存在)
-        if not get_chapter_list(project_name):
-            _format_text(project_name)
+        # 未切分或上次切分中途中断时，得到一个边切分边产出章节ID的生成器
+        chapter_stream = None
+        if not is_chapter_segmentation_complete(project_name):
+            chapter_stream = _iter_format_text(project_name)
             
         # 2. 摘要生成
         # 检查是否已有摘要
         if get_chapter_summary(project_name, "chapter_1")!=None:
-            pass
+            if chapter_stream is not None:
+                # 上次在切分和摘要并行期间中断：补全切分，并为缺少摘要的章节补生成
+                _generate_chapter_summary(project_name, chapter_stream, skip_existing=True)
+                _generate_summary_on_50_chapters(project_name)
+                _generate_overall_summary(project_name)
         else:
-            _generate_chapter_summary(project_name)
+            # 摘要与切分流水线并行：切出一批章节就开始总结
+            _generate_chapter_summary(project_name, chapter_stream)
             _generate_summary_on_50_chapters(project_name)
             _generate_overall_summary(project_name)
             
@@ -830,6 +1159,7 @@ def analyze_text_to_shots(project_name):
         _generate_music_prompts(project_name)
         #generate_music(project_name)
         print(f"[{project_name}] 分析流程全部完成。")
+        print_llm_stage_report()
         return True
         
     except Exception as e:
@@ -844,8 +1174,24 @@ def generate_all(project_name):
     """
     shot_ids = get_list_shots(project_name)
     print(f"[{project_name}] 开始生成素材，共 {len(shot_ids)} 个镜头。")
-    HighQualitylist=[]
-    normallist=[]
+    # image_api 只在生成素材时导入，只做文本分析的流程不必加载它
+    from image_api import create_job_queue
+    # 图片任务按模型分组执行，避免来回切换模型
+    image_queue = create_job_queue()
+    width, length = 1024, 576 # 16:9
+
+    failed_shots = []
+
+    def _save_image(job, shot_id):
+        if job.error is not None:
+            failed_shots.append(shot_id)
+            return
+        try:
+            save_shot_image(project_name, shot_id, job.result)
+        except Exception as e:
+            print(f"镜头 {shot_id} 图片保存失败: {e}")
+            failed_shots.append(shot_id)
+
     for shot_id in shot_ids:
         shot_info = read_shot_info(project_name, shot_id)
         
@@ -854,15 +1200,12 @@ def generate_all(project_name):
             print(f"Generating Image for Shot {shot_id}...")
             prompt = shot_info.get("prompt")
             if prompt:
-                # 简单根据 type 决定参数
-                width, length = 1024, 576 # 16:9
+                # 简单根据 type 决定模型，生成完成后立即保存
+                on_done = lambda job, shot_id=shot_id: _save_image(job, shot_id)
                 if shot_info.get("镜头类型")=="HighQuality":
-                    HighQualitylist.append([prompt,shot_id])
-                    #img_data = generate_image(prompt, model_name="NoobAI-XL", width=width, height=length)
+                    image_queue.submit(prompt, IMAGE_MODEL_HIGH_QUALITY, width, length, priority=1, on_done=on_done)
                 else:
-                    normallist.append([prompt,shot_id])
-                    #img_data = generate_image(prompt, model_name="KOALA-1B", width=width, height=length)
-                #save_shot_image(project_name, shot_id, img_data)
+                    image_queue.submit(prompt, IMAGE_MODEL_NORMAL, width, length, on_done=on_done)
         
         # 2. 语音生成
         if read_shot_audio(project_name, shot_id) == None and False:#debug
@@ -872,13 +1215,11 @@ def generate_all(project_name):
                 spk_id = shot_info.get("speaker_id", "narrator")
                 audio_data = tts(script, voice_role=spk_id)
                 save_shot_audio(project_name, shot_id, audio_data)
-    for i in HighQualitylist:
-        img_data = generate_image(i[0], model_name="KOALA-1B", width=width, height=length)
-        save_shot_image(project_name, i[1], img_data)
-
-    for i in normallist:
-        img_data = generate_image(i[0], model_name="KOALA-1B", width=width, height=length)
-        save_shot_image(project_name, i[1], img_data)
+    image_queue.run()
+    image_queue.print_stats()
+    if failed_shots:
+        # 队列会吞掉单个任务的异常，这里汇总后抛出，避免后续合成视频时才因缺图报错
+        raise RuntimeError(f"[{project_name}] {len(failed_shots)} 个镜头图片生成失败: {sorted(failed_shots)}")
     print(f"[{project_name}] 素材生成完毕。")
     return True
 
@@ -1203,7 +1544,9 @@ def _Compliance_Review(project_name):
             # 策略：我们手动格式化模板内容作为 context_data 传入，并将传入 helper 的 template 置空，
             # 这样可以完美利用 helper 的重试逻辑，同时保证 Prompt 格式正确。
             
-            formatted_message = raw_user_template.format(
+            # 按字段构造，超出输入预算时只裁剪章节正文
+            formatted_message = ContextTemplate(
+                raw_user_template,
                 chapter_title=chapter_title,
                 chapter_content=content
             )
@@ -1218,7 +1561,8 @@ def _Compliance_Review(project_name):
                 prompt_vars=runtime_prompt_vars,
                 context_data=formatted_message, 
                 output_format="yaml",
-                model_name="Qwen"
+                protected_fields=("chapter_title",),
+                stage="compliance"
             )
 
             # 6. 解析结果并处理
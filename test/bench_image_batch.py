@@ -0,0 +1,51 @@
+"""
+对比逐张生成（generate_image）和批量生成（generate_batch）的吞吐。
+
+需要本地已下载对应模型；没有 GPU 时在 CPU 上运行，建议用较小分辨率和较少步数：
+    python test/bench_image_batch.py --model KOALA-1B --images 8 --width 512 --height 512 --steps 4
+"""
+import argparse
+import os
+import sys
+import time
+
+
+def _benchmark(model_name, n_images, width, height, steps, batch_size):
+    import image_api
+    from image_api import config
+    from image_api.core import _engine
+
+    if steps:
+        config.MODELS[model_name].setdefault("default_params", {})["num_inference_steps"] = steps
+    prompts = [f"a cat sitting on a chair, style {i}" for i in range(n_images)]
+
+    # 先加载模型并预热，避免把加载耗时算进第一种方式
+    _engine.generate(prompts[0], model_name, width, height)
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        image_api.generate_image(prompt, model_name, width, height)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _engine.generate_batch(prompts, model_name, width, height, batch_size=batch_size)
+    batched = time.perf_counter() - start
+
+    size = batch_size or _engine._batch_size_for(width, height)
+    print(f"模型: {model_name}，设备: {_engine.device}，{n_images} 张 {width}x{height}，批大小 {size}")
+    print(f"逐张生成: {single:.1f}s，{n_images/single:.3f} 张/秒")
+    print(f"批量生成: {batched:.1f}s，{n_images/batched:.3f} 张/秒")
+
+
+if __name__ == "__main__":
+    # 直接运行时把项目根目录加入搜索路径，以便导入 image_api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="对比逐张生成与批量生成的吞吐")
+    parser.add_argument("--model", default="KOALA-1B")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=0, help="覆盖推理步数，0 表示使用模型默认值")
+    parser.add_argument("--batch-size", type=int, default=None, help="不传时按内存预算估算")
+    args = parser.parse_args()
+    _benchmark(args.model, args.images, args.width, args.height, args.steps, args.batch_size)
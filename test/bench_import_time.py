@@ -0,0 +1,72 @@
+"""
+测量只做文本处理时的启动耗时，并检查没有提前导入 torch 等重型依赖。
+
+每个模块在新的 Python 进程里冷启动导入 --runs 次，取最小值与预算比较；
+超出预算或导入了重型依赖时以非零状态退出，可直接用于 CI：
+    python test/bench_import_time.py --budget 2.0
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 文本流程（摘要、健康检查等）会导入的模块
+TEXT_MODULES = ["modules.llm", "modules.processor", "image_api"]
+# 这些模块只应在生图、TTS 时才导入
+HEAVY_MODULES = ["torch", "diffusers", "transformers", "websocket"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+
+def _measure(module, runs):
+    """返回 (最小导入耗时, 被导入的重型模块)；导入失败时抛 RuntimeError"""
+    best, heavy = None, []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        best = result["elapsed"] if best is None else min(best, result["elapsed"])
+        heavy = result["heavy"]
+    return best, heavy
+
+
+def main(budget, runs):
+    failed = False
+    for module in TEXT_MODULES:
+        try:
+            elapsed, heavy = _measure(module, runs)
+        except RuntimeError as e:
+            print(f"{module:<20} 导入失败: {e}")
+            failed = True
+            continue
+        status = "OK"
+        if elapsed > budget:
+            status = f"超出预算 {budget:.2f}s"
+            failed = True
+        if heavy:
+            status = f"提前导入了 {', '.join(heavy)}"
+            failed = True
+        print(f"{module:<20} {elapsed:.3f}s  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查文本流程的导入耗时")
+    parser.add_argument("--budget", type=float, default=2.0, help="每个模块的导入耗时上限（秒）")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(main(args.budget, args.runs))
@@ -0,0 +1,13 @@
+"""
+测试共用的夹具：项目文件写到 pytest 的临时目录，不碰 ROOT_DIR 指向的真实项目。
+"""
+import pytest
+
+import file_of_film_project.config as storage_config
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """返回一个位于临时 ROOT_DIR 下的空项目名"""
+    monkeypatch.setattr(storage_config, "ROOT_DIR", str(tmp_path))
+    return "测试项目"
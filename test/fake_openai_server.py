@@ -0,0 +1,191 @@
+"""
+本地假 OpenAI 兼容服务器，用于离线测试和压测 LLM 调用链路。
+
+只实现 POST /v1/chat/completions，返回固定内容；请求带 stream=true 时按 SSE 分块返回。
+每个新 TCP 连接额外等待 connect_delay 秒，模拟真实服务的 TCP/TLS 建连开销；
+每个请求等待 latency 秒，模拟推理耗时。
+
+用法：
+    server = FakeOpenAIServer(reply="ok", latency=0.01, connect_delay=0.05)
+    server.start()
+    client = OpenAI(api_key="test", base_url=server.base_url)
+    ...
+    print(server.connections, server.requests)
+    server.stop()
+
+直接运行本文件会对比“每次新建客户端”和“共享连接池客户端”的耗时：
+    python test/fake_openai_server.py --requests 200
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才支持 keep-alive
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，开启 Nagle 时长连接上每个请求会多出约 40ms 的延迟确认等待
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        server = self.server.owner
+        with server._lock:
+            server.connections += 1
+        if server.connect_delay:
+            time.sleep(server.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server.owner
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with server._lock:
+            server.requests += 1
+            request_id = server.requests
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        reply = server.reply(body) if callable(server.reply) else server.reply
+        if body.get("stream"):
+            self._send_stream(request_id, body.get("model", "fake"), reply, server.stream_chunk)
+            return
+        self._send(200, {
+            "id": f"chatcmpl-{request_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _send_stream(self, request_id, model, reply, chunk_size):
+        """按 SSE 格式逐块返回，最后一块带 finish_reason"""
+        events = []
+        pieces = [reply[i:i + chunk_size] for i in range(0, len(reply), chunk_size)] or [""]
+        for i, piece in enumerate(pieces):
+            events.append({
+                "id": f"chatcmpl-{request_id}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece},
+                    "finish_reason": "stop" if i == len(pieces) - 1 else None,
+                }],
+            })
+        data = "".join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events)
+        data = (data + "data: [DONE]\n\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOpenAIServer:
+    """
+    reply: 固定回复字符串，或接收请求体 dict、返回字符串的函数
+    latency: 每个请求的模拟耗时（秒）
+    connect_delay: 每个新连接的模拟建连耗时（秒）
+    stream_chunk: 流式请求（stream=true）时每块返回的字符数
+    """
+
+    def __init__(self, reply="ok", latency=0.0, connect_delay=0.0, host="127.0.0.1", port=0, stream_chunk=16):
+        self.reply = reply
+        self.stream_chunk = stream_chunk
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _benchmark(n_requests, connect_delay, latency):
+    from openai import OpenAI
+    from modules.AI_api import get_llm_client, close_llm_clients
+
+    messages = [{"role": "user", "content": "test"}]
+
+    def run(make_client):
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            client = make_client()
+            client.chat.completions.create(model="fake", messages=messages)
+        return time.perf_counter() - start
+
+    with FakeOpenAIServer(latency=latency, connect_delay=connect_delay) as server:
+        cold = run(lambda: OpenAI(api_key="test", base_url=server.base_url))
+        cold_conns = server.connections
+        server.reset_counters()
+
+        pooled = run(lambda: get_llm_client(server.base_url, "test"))
+        pooled_conns = server.connections
+        close_llm_clients()
+
+    print(f"请求数: {n_requests}，模拟建连 {connect_delay*1000:.0f}ms，模拟推理 {latency*1000:.0f}ms")
+    print(f"每次新建客户端: {cold:.2f}s，{n_requests/cold:.1f} req/s，连接数 {cold_conns}")
+    print(f"共享连接池:     {pooled:.2f}s，{n_requests/pooled:.1f} req/s，连接数 {pooled_conns}")
+
+
+if __name__ == "__main__":
+    # 直接运行时把项目根目录加入搜索路径，以便导入 modules
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="对比 LLM 客户端连接复用的耗时")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--connect-delay", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    _benchmark(args.requests, args.connect_delay, args.latency)
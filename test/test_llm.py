@@ -0,0 +1,268 @@
+"""
+modules.llm 的单元测试：流式输出校验、限流与熔断、上下文裁剪、按阶段路由与后备模型。
+请求通过替换 modules.llm.llm 模拟，不访问网络：
+    python -m pytest test/test_llm.py
+"""
+import time
+
+import pytest
+
+import modules.llm as llm
+
+PROMPT_VARS = {"SYSTEM_PROMPT": "system", "USER_PROMPT_TEMPLATE": "user"}
+
+
+@pytest.fixture(autouse=True)
+def isolated_llm(tmp_path, monkeypatch):
+    """每个测试使用独立的响应缓存和限流/熔断状态，关闭流式调用"""
+    monkeypatch.setattr(llm, "LLM_STREAM", False)
+    monkeypatch.setattr(llm, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm, "_response_cache", None)
+    monkeypatch.setattr(llm, "_model_guards", {})
+    yield
+    if llm._response_cache is not None:
+        llm._response_cache._conn.close()
+
+
+def _feed(output_format, text, chunk_size):
+    validator = llm._StreamValidator(output_format)
+    for i in range(0, len(text), chunk_size):
+        validator.feed(text[i:i + chunk_size])
+    return validator
+
+
+# ==============================================================================
+# 流式输出校验
+# ==============================================================================
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1000])
+@pytest.mark.parametrize("output_format, text", [
+    ("json", '```json\n{"a": [1, {"b": "}]"}], "c": "\\"{"}\n```'),
+    ("json", '  [1, 2, 3]  \n``` \n'),
+    ("json", '{"truncated": [1, 2'),
+    ("yaml", "```yaml\n# 注释\n\nshots:\n  - id: 1\n```"),
+    ("yaml", "- a\n- b\n"),
+    ("yaml", '"quoted key": 1\n'),
+    ("text", "随便什么内容 {]"),
+])
+def test_stream_validator_accepts_valid_output(output_format, text, chunk_size):
+    _feed(output_format, text, chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1000])
+@pytest.mark.parametrize("output_format, text", [
+    ("json", 'Sure! Here it is: {"a": 1}'),
+    ("json", '```json\n{"a": [1}'),
+    ("json", '{"a": 1}\nHope this helps.'),
+    ("yaml", "Here is the result:\nshots: []\n"),
+    ("yaml", "# 注释\n好的，下面是结果\n"),
+])
+def test_stream_validator_rejects_invalid_output(output_format, text, chunk_size):
+    with pytest.raises(llm.LLMOutputError):
+        _feed(output_format, text, chunk_size)
+
+
+def test_stream_validator_waits_for_the_first_yaml_line():
+    validator = llm._StreamValidator("yaml")
+    validator.feed("Here is")
+    validator.feed(" the")
+    with pytest.raises(llm.LLMOutputError):
+        validator.feed(" result:\n")
+
+
+# ==============================================================================
+# 限流与熔断
+# ==============================================================================
+
+def test_token_bucket_wait_time():
+    bucket = llm._TokenBucket(60)  # 1 个/秒，容量 10
+    now = bucket.updated
+    assert bucket.wait_time(1, 1.0, now) == 0
+    bucket.take(10)
+    assert bucket.wait_time(1, 1.0, now) == pytest.approx(1.0)
+    # 降速后恢复得更慢
+    assert bucket.wait_time(1, 0.5, now) == pytest.approx(2.0)
+    assert bucket.wait_time(1, 1.0, now + 2) == 0
+    # 单次开销超过容量时，攒满即放行
+    bucket.take(bucket.level)
+    assert bucket.wait_time(100, 1.0, now + 2) == pytest.approx(10.0)
+
+
+def test_token_bucket_without_limit_never_waits():
+    bucket = llm._TokenBucket(0)
+    bucket.take(10 ** 6)
+    assert bucket.wait_time(10 ** 6, 1.0, time.monotonic()) == 0
+
+
+def test_model_limiter_reserves_and_backs_off():
+    limiter = llm._ModelLimiter(rpm=60, tpm=0)
+    assert all(limiter.reserve(1000) == 0 for _ in range(10))
+    level = limiter.requests.level
+    assert limiter.reserve(1000) > 0
+    # 额度不足时不扣除
+    assert limiter.requests.level == pytest.approx(level, abs=0.01)
+
+    for _ in range(10):
+        limiter.on_throttled()
+    assert limiter.scale == pytest.approx(0.1)
+    limiter.on_success()
+    assert limiter.scale == pytest.approx(0.105)
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = llm._CircuitBreaker("M", threshold=3, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(llm.LLMUnavailableError):
+        breaker.check()
+
+    # 冷却结束后放行一次，再失败立即重新熔断
+    breaker.open_until = time.monotonic() - 1
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(llm.LLMUnavailableError):
+        breaker.check()
+
+    breaker.record_success()
+    breaker.check()
+    breaker.record_failure()
+    breaker.check()
+
+
+# ==============================================================================
+# 上下文裁剪
+# ==============================================================================
+
+@pytest.fixture
+def tiny_model(monkeypatch):
+    """输入预算（扣除提示词后）约 500 token 的模型"""
+    window = llm.LLM_MAX_OUTPUT_TOKENS + llm.LLM_CONTEXT_MARGIN + 500
+    monkeypatch.setitem(llm.LLM_CONTEXT_WINDOWS, "Tiny", window)
+    budget = llm._context_budget("Tiny") - sum(llm.estimate_tokens(v) for v in PROMPT_VARS.values())
+    return "Tiny", budget
+
+
+def test_fit_context_keeps_small_input_unchanged(tiny_model):
+    model, _ = tiny_model
+    template = llm.ContextTemplate("{a}", a="short")
+    assert llm._fit_context(PROMPT_VARS, "short", model) == "short"
+    assert llm._fit_context(PROMPT_VARS, {"a": "short"}, model) == {"a": "short"}
+    assert llm._fit_context(PROMPT_VARS, template, model) is template
+
+
+def test_fit_context_trims_the_middle_of_a_string(tiny_model):
+    model, budget = tiny_model
+    text = "开头" + "中" * 3000 + "结尾"
+
+    fitted = llm._fit_context(PROMPT_VARS, text, model)
+
+    assert llm.estimate_tokens(fitted) <= budget
+    assert fitted.startswith("开头") and fitted.endswith("结尾")
+    assert "中间省略" in fitted
+
+
+def test_fit_context_trims_largest_dict_fields_first(tiny_model):
+    model, budget = tiny_model
+    context = {"参考": "参" * 200, "正文": "文" * 2000, "备注": "注" * 100, "编号": 7}
+
+    fitted = llm._fit_context(PROMPT_VARS, context, model, protected_fields=("参考",))
+
+    assert fitted["参考"] == context["参考"]
+    assert fitted["编号"] == 7
+    assert fitted["备注"] == context["备注"]
+    assert len(fitted["正文"]) < len(context["正文"])
+    size = sum(llm.estimate_tokens(str(v)) + 4 for v in fitted.values())
+    assert size <= budget
+    # 原对象不被修改
+    assert context["正文"] == "文" * 2000
+
+
+def test_fit_context_trims_template_fields_and_keeps_skeleton(tiny_model):
+    model, budget = tiny_model
+    template = llm.ContextTemplate(
+        "### 参考信息\n{ref}\n### 待处理文本\n{body}\n### 结尾说明",
+        ref="参" * 300, body="文" * 3000,
+    )
+
+    fitted = llm._fit_context(PROMPT_VARS, template, model, protected_fields=("ref",))
+
+    assert isinstance(fitted, llm.ContextTemplate)
+    assert fitted.fields["ref"] == "参" * 300
+    rendered = fitted.render()
+    assert rendered.startswith("### 参考信息\n" + "参" * 300)
+    assert rendered.endswith("### 结尾说明")
+    assert llm.estimate_tokens(rendered) <= budget
+    # 原模板不被修改
+    assert template.fields["body"] == "文" * 3000
+
+
+# ==============================================================================
+# 按阶段路由与后备模型
+# ==============================================================================
+
+def _fake_llm(replies, calls):
+    """按模型返回 replies[model] 的同步传输，并记录每次调用的模型"""
+    def fake(messages, llm_name=None, temperature=None):
+        calls.append(llm_name)
+        reply = replies[llm_name]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+    return fake
+
+
+@pytest.fixture
+def stage(monkeypatch):
+    monkeypatch.setitem(llm.LLM_STAGE_POLICY, "test_stage", {
+        "model": "Small", "fallback": "Big", "max_input_tokens": 1000,
+    })
+    return "test_stage"
+
+
+def test_route_models(stage):
+    assert llm._route_models(stage, "Explicit", PROMPT_VARS, "x") == ["Explicit"]
+    assert llm._route_models(stage, None, PROMPT_VARS, "x") == ["Small", "Big"]
+    assert llm._route_models(stage, None, PROMPT_VARS, "x" * 8000) == ["Big"]
+    assert llm._route_models("unknown_stage", None, PROMPT_VARS, "x") == [llm.LLM_DEFAULT_MODEL]
+
+
+def test_invalid_output_falls_back_to_the_next_model(stage, monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "llm", _fake_llm({"Small": "not: [valid", "Big": "ok: true"}, calls))
+
+    assert llm._call_llm_with_retry(PROMPT_VARS, "context", stage=stage) == {"ok": True}
+    assert calls[0] == "Small" and calls[-1] == "Big"
+
+    # 结果已按 Big 缓存，Small 仍会先被尝试
+    calls.clear()
+    assert llm._call_llm_with_retry(PROMPT_VARS, "context", stage=stage) == {"ok": True}
+    assert "Big" not in calls
+
+
+def test_open_breaker_falls_back_without_requesting(stage, monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "llm", _fake_llm({"Small": "ok: small", "Big": "ok: big"}, calls))
+    llm._get_guard("Small")[1].open_until = time.monotonic() + 60
+
+    assert llm._call_llm_with_retry(PROMPT_VARS, "context", stage=stage, use_cache=False) == {"ok": "big"}
+    assert calls == ["Big"]
+
+
+def test_last_model_failure_is_raised(stage, monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "llm", _fake_llm({"Small": "[bad", "Big": "[bad"}, calls))
+
+    with pytest.raises(llm.LLMOutputError):
+        llm._call_llm_with_retry(PROMPT_VARS, "context", stage=stage)
+    assert calls[-1] == "Big"
+
+
+def test_non_retryable_errors_are_not_hidden_by_fallback(stage, monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "llm", _fake_llm({"Small": ValueError("bad request"), "Big": "ok: true"}, calls))
+
+    with pytest.raises(ValueError):
+        llm._call_llm_with_retry(PROMPT_VARS, "context", stage=stage)
+    assert calls == ["Small"]
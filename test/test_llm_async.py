@@ -0,0 +1,126 @@
+"""
+acall_llm_with_retry 与异步客户端生命周期的测试。
+请求通过替换 modules.llm.allm 模拟，不访问网络：
+    python -m pytest test/test_llm_async.py
+"""
+import asyncio
+
+import pytest
+
+import modules.AI_api as AI_api
+import modules.llm as llm
+
+PROMPT_VARS = {"SYSTEM_PROMPT": "system", "USER_PROMPT_TEMPLATE": "user"}
+
+
+@pytest.fixture(autouse=True)
+def isolated_llm(tmp_path, monkeypatch):
+    """每个测试使用独立的响应缓存，关闭流式调用"""
+    monkeypatch.setattr(llm, "LLM_STREAM", False)
+    monkeypatch.setattr(llm, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm, "_response_cache", None)
+    yield
+    if llm._response_cache is not None:
+        llm._response_cache._conn.close()
+
+
+def _fake_allm(replies, calls):
+    """按模型返回 replies[model] 的异步传输，并记录每次调用的模型"""
+    async def allm(messages, llm_name=None, temperature=None):
+        calls.append(llm_name)
+        await asyncio.sleep(0)
+        return replies[llm_name]
+    return allm
+
+
+def test_acall_parses_and_caches(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "allm", _fake_allm({"M": "a: 1\nb: [x, y]"}, calls))
+
+    async def main():
+        first = await asyncio.gather(*[
+            llm.acall_llm_with_retry(PROMPT_VARS, f"context {i % 3}", model_name="M") for i in range(9)
+        ])
+        second = await asyncio.gather(*[
+            llm.acall_llm_with_retry(PROMPT_VARS, f"context {i}", model_name="M") for i in range(3)
+        ])
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert all(r == {"a": 1, "b": ["x", "y"]} for r in first + second)
+    # 第二轮全部命中缓存
+    assert 3 <= len(calls) <= 9
+    calls.clear()
+    asyncio.run(main())
+    assert calls == []
+
+
+def test_acall_falls_back_when_output_is_invalid(monkeypatch):
+    calls = []
+    replies = {"Small": "[unclosed: {", "Big": "ok: true"}
+    monkeypatch.setattr(llm, "allm", _fake_allm(replies, calls))
+    monkeypatch.setitem(llm.LLM_STAGE_POLICY, "test_stage", {"model": "Small", "fallback": "Big"})
+
+    result = asyncio.run(llm.acall_llm_with_retry(PROMPT_VARS, "context", stage="test_stage"))
+
+    assert result == {"ok": True}
+    assert calls[-1] == "Big"
+    assert "Small" in calls
+
+
+def test_acall_does_not_cache_results_failing_validation(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "allm", _fake_allm({"M": "just a sentence"}, calls))
+
+    for _ in range(2):
+        result = asyncio.run(llm.acall_llm_with_retry(
+            PROMPT_VARS, "context", model_name="M", validate=lambda r: isinstance(r, dict)
+        ))
+        assert result == "just a sentence"
+    assert len(calls) == 2
+
+
+class _FakeAsyncOpenAI:
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.closed = False
+        _FakeAsyncOpenAI.instances.append(self)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_async_clients_are_closed_when_the_loop_ends(monkeypatch):
+    _FakeAsyncOpenAI.instances.clear()
+    monkeypatch.setattr(AI_api, "AsyncOpenAI", _FakeAsyncOpenAI)
+    monkeypatch.setattr(AI_api.httpx, "AsyncClient", lambda **kwargs: None)
+
+    async def use():
+        client = AI_api.get_async_llm_client()
+        assert AI_api.get_async_llm_client() is client
+        AI_api.get_async_llm_client(base_url="http://other")
+
+    for _ in range(3):
+        asyncio.run(use())
+
+    assert len(_FakeAsyncOpenAI.instances) == 6
+    assert all(c.closed for c in _FakeAsyncOpenAI.instances)
+    assert AI_api._async_llm_clients == {}
+
+
+def test_clients_of_a_loop_closed_without_shutdown_are_dropped(monkeypatch):
+    monkeypatch.setattr(AI_api, "AsyncOpenAI", _FakeAsyncOpenAI)
+    monkeypatch.setattr(AI_api.httpx, "AsyncClient", lambda **kwargs: None)
+
+    async def use():
+        AI_api.get_async_llm_client()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(use())
+    loop.close()
+    assert loop in AI_api._async_llm_clients
+
+    asyncio.run(use())
+    assert loop not in AI_api._async_llm_clients
+    assert AI_api._async_llm_clients == {}
@@ -0,0 +1,297 @@
+"""
+项目元数据存储的测试：回滚日志、对象索引，以及 SQLite 后端与文件后端的一致性和迁移。
+    python -m pytest test/test_project_storage.py
+"""
+import os
+import types
+
+import pytest
+import yaml
+
+import file_of_film_project as ffp
+import file_of_film_project.music as music_module
+import file_of_film_project.object as object_module
+import file_of_film_project.shot as shot_module
+import file_of_film_project.sqlite_backend as sqlite_backend
+import file_of_film_project.text as text_module
+from file_of_film_project.config import _get_project_dir
+from file_of_film_project.utils import _journal, _save_yaml, _load_yaml, JOURNAL_NAME
+
+
+def _shot(n):
+    return {"prompt": f"prompt {n}", "text": f"镜头原文 {n}", "duration": n}
+
+
+# ==============================================================================
+# 回滚日志
+# ==============================================================================
+
+def test_journal_rolls_back_on_exception(project):
+    root = _get_project_dir(project)
+    existing = os.path.join(root, "a.yaml")
+    created = os.path.join(root, "新文件夹", "b.yaml")
+    _save_yaml(existing, {"v": 1})
+
+    with pytest.raises(RuntimeError):
+        with _journal(root):
+            _save_yaml(existing, {"v": 2})
+            _save_yaml(created, {"v": 2})
+            raise RuntimeError("中途失败")
+
+    assert _load_yaml(existing) == {"v": 1}
+    assert not os.path.exists(os.path.dirname(created))
+    assert not os.path.exists(os.path.join(root, JOURNAL_NAME))
+
+
+def test_failed_save_shots_leaves_no_partial_batch(project, monkeypatch):
+    ffp.save_shots(project, [(1, _shot(1)), (2, _shot(2))])
+    before = [ffp.read_shot_info(project, i) for i in (1, 2)]
+    folders = set(os.listdir(os.path.join(_get_project_dir(project), "镜头")))
+
+    def fail(*args):
+        raise OSError("磁盘已满")
+
+    monkeypatch.setattr(shot_module, "_save_shot_sequence", fail)
+    with pytest.raises(OSError):
+        ffp.save_shots(project, [(1, _shot(10)), (3, _shot(3))])
+
+    assert ffp.get_list_shots(project) == [1, 2]
+    assert [ffp.read_shot_info(project, i) for i in (1, 2)] == before
+    assert set(os.listdir(os.path.join(_get_project_dir(project), "镜头"))) == folders
+
+
+def _crash_inside_journal(root, writes):
+    """模拟在日志块中途崩溃：执行写入后留下日志和新内容，不做回滚"""
+    journal_path = os.path.join(root, JOURNAL_NAME)
+    with pytest.raises(KeyboardInterrupt):
+        with _journal(root):
+            for path, data in writes:
+                _save_yaml(path, data)
+            journal = open(journal_path, "rb").read()
+            contents = {path: open(path, "rb").read() for path, _ in writes}
+            raise KeyboardInterrupt
+    with open(journal_path, "wb") as f:
+        f.write(journal)
+    for path, data in contents.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def test_recover_project_journal_after_crash(project):
+    root = _get_project_dir(project)
+    existing = os.path.join(root, "a.yaml")
+    created = os.path.join(root, "b.yaml")
+    _save_yaml(existing, {"v": 1})
+    _crash_inside_journal(root, [(existing, {"v": 2}), (created, {"v": 2})])
+    assert _load_yaml(existing) == {"v": 2}
+
+    assert ffp.recover_project_journal(project) == 2
+
+    assert _load_yaml(existing) == {"v": 1}
+    assert not os.path.exists(created)
+    assert ffp.recover_project_journal(project) == 0
+
+
+def test_later_batches_keep_a_leftover_journal(project):
+    root = _get_project_dir(project)
+    existing = os.path.join(root, "a.yaml")
+    _save_yaml(existing, {"v": 1})
+    _crash_inside_journal(root, [(existing, {"v": 2})])
+
+    ffp.save_shots(project, [(1, _shot(1))])
+
+    # 新的批量写入只提交自己的记录，崩溃留下的记录仍可恢复
+    assert os.path.exists(os.path.join(root, JOURNAL_NAME))
+    assert ffp.recover_project_journal(project) == 1
+    assert _load_yaml(existing) == {"v": 1}
+    assert ffp.read_shot_info(project, 1)["镜头原文"] == "镜头原文 1"
+
+
+# ==============================================================================
+# 对象索引（文件后端）
+# ==============================================================================
+
+def _obj(name, obj_type, chapters, aliases=()):
+    return {"名称": name, "类型": obj_type, "别名": list(aliases), "所在章节列表": chapters}
+
+
+def _ids(objects):
+    return [o["id"] for o in objects]
+
+
+def test_find_object_by_name_prefers_names_over_aliases(project):
+    ffp.save_objects(project, [
+        ("c1", _obj("张三", "角色", [1], aliases=["老张"])),
+        ("c2", _obj("老张", "角色", [2])),
+        ("i1", _obj("长剑", "物品", [1], aliases=["青锋"])),
+    ])
+
+    assert ffp.find_object_by_name(project, "老张")["id"] == "c2"
+    assert ffp.find_object_by_name(project, "青锋")["id"] == "i1"
+    assert ffp.find_object_by_name(project, "张三")["类型"] == "角色"
+    assert ffp.find_object_by_name(project, "无名氏") is None
+
+    ffp.delete_object(project, "c2")
+    assert ffp.find_object_by_name(project, "老张")["id"] == "c1"
+
+
+def test_read_object_on_chapter_order_after_resaves(project):
+    ffp.save_objects(project, [
+        ("c1", _obj("甲", "角色", [1])),
+        ("c2", _obj("乙", "角色", [1, 2])),
+        ("s1", _obj("山门", "场景", [1])),
+    ])
+    assert _ids(ffp.read_object_on_chapter(project, 1)) == ["s1", "c1", "c2"]
+
+    # 同类型重新保存不改变位置
+    ffp.save_object(project, "c1", _obj("甲", "角色", [1, 3]))
+    assert _ids(ffp.read_object_on_chapter(project, 1)) == ["s1", "c1", "c2"]
+    assert _ids(ffp.read_object_on_chapter(project, "3")) == ["c1"]
+
+    # 修改类型后排到新类型末尾，改回来后排到原类型末尾
+    ffp.save_object(project, "c1", _obj("甲", "物品", [1]))
+    assert _ids(ffp.read_object_on_chapter(project, 1)) == ["s1", "c1", "c2"]
+    ffp.save_object(project, "c1", _obj("甲", "角色", [1]))
+    assert _ids(ffp.read_object_on_chapter(project, 1)) == ["s1", "c2", "c1"]
+    assert _ids(ffp.read_object_on_chapter(project, 3)) == []
+
+    # 与 list_all_objects 的顺序一致，也与重新解析文件后的顺序一致
+    listed = [oid for oid in _ids(ffp.list_all_objects(project)) if oid in ("s1", "c1", "c2")]
+    assert listed == ["s1", "c2", "c1"]
+    object_module._object_index_cache.clear()
+    assert _ids(ffp.read_object_on_chapter(project, 1)) == ["s1", "c2", "c1"]
+
+
+def test_object_index_rebuilds_after_external_edit(project):
+    ffp.save_object(project, "c1", _obj("甲", "角色", [1]))
+    yaml_path = os.path.join(_get_project_dir(project), "对象", "对象列表.yaml")
+    data = _load_yaml(yaml_path)
+    data["分类数据"]["角色"]["c1"]["名称"] = "甲改"
+    data["分类数据"]["角色"]["c1"]["所在章节列表"] = [5]
+    with open(yaml_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+        f.write("\n")
+
+    assert ffp.find_object_by_name(project, "甲") is None
+    assert ffp.find_object_by_name(project, "甲改")["id"] == "c1"
+    assert _ids(ffp.read_object_on_chapter(project, 5)) == ["c1"]
+
+
+def test_object_session_writes_once(project, monkeypatch):
+    writes = []
+    original = object_module._save_yaml
+    monkeypatch.setattr(object_module, "_save_yaml", lambda path, data: (writes.append(path), original(path, data)))
+
+    with ffp.object_session(project):
+        for i in range(5):
+            ffp.save_object(project, f"c{i}", _obj(f"角色{i}", "角色", [i]))
+        assert ffp.find_object_by_name(project, "角色3")["id"] == "c3"
+        assert writes == []
+
+    assert len(writes) == 1
+    assert len(ffp.list_all_objects(project, "角色")) == 5
+
+
+# ==============================================================================
+# SQLite 后端
+# ==============================================================================
+
+# 直接取文件后端各模块的函数，不受 STORAGE_BACKEND 配置影响
+FILE_BACKEND = types.SimpleNamespace(**{
+    name: getattr(module, name)
+    for module in (text_module, shot_module, object_module, music_module)
+    for name in dir(module) if not name.startswith("_")
+})
+
+
+@pytest.fixture
+def sqlite_project(project):
+    yield project
+    sqlite_backend.close_connections(project)
+
+
+def _fill(api, project):
+    """在给定后端上执行同一组写操作"""
+    for i in (1, 2, 3):
+        api.save_chapter_summary(project, f"chapter_{i}", f"第{i}章总结")
+    api.delete_chapter_summary(project, "chapter_2")
+    api.save_summary_on_50_chapters(project, "1-50", "前五十章")
+    api.save_overall_summary(project, "全文总结")
+
+    api.save_shots(project, [(i, _shot(i)) for i in (1, 2, 3, 4)])
+    api.update_shots_info(project, [(2, {"时长": 9, "主要对象": "c1"}), (99, {"时长": 1})])
+    api.edit_shot_sequence(project, [3, 1, 4, 2])
+    api.delete_shot(project, 1)
+    api.save_shots(project, [(1, _shot(7))])
+
+    api.save_objects(project, [
+        ("c1", _obj("张三", "角色", [1, 2], aliases=["老张"])),
+        ("c2", _obj("老张", "角色", [2])),
+        ("s1", _obj("山门", "场景", [1])),
+        ("i1", _obj("长剑", "物品", [2])),
+    ])
+    api.save_object(project, "c1", _obj("张三", "物品", [1, 2]))
+    api.save_object(project, "c1", _obj("张三", "角色", [1, 2]))
+    api.delete_object(project, "i1")
+
+    api.save_music_prompt(project, "m1", "悠扬")
+    api.save_music_content(project, "m1", "乐曲内容")
+    api.save_music_prompt(project, "m2", "激昂")
+    api.delete_music_prompt(project, "m2")
+
+
+def _snapshot(api, project):
+    """读出 _fill 写入的全部元数据"""
+    return {
+        "chapter_summaries": [api.get_chapter_summary(project, f"chapter_{i}") for i in (1, 2, 3)],
+        "summary_50": (api.get_summary_on_50_chapters_list(project), api.get_summary_on_50_chapters(project, "1-50")),
+        "overall": api.get_overall_summary(project),
+        "shots": [api.read_shot_info(project, i) for i in api.get_list_shots(project)],
+        "objects": api.list_all_objects(project),
+        "roles": api.list_all_objects(project, "角色"),
+        "by_name": [api.find_object_by_name(project, n) for n in ("老张", "张三", "长剑", "")],
+        "chapter_objects": [api.read_object_on_chapter(project, c) for c in (1, "2", 3)],
+        "read_object": [api.read_object(project, oid) for oid in ("c1", "i1")],
+        "music": [
+            (m, api.read_music_prompt(project, m), api.read_music_content(project, m))
+            for m in api.get_all_music_ids(project)
+        ],
+    }
+
+
+def test_sqlite_backend_matches_file_backend(sqlite_project):
+    _fill(FILE_BACKEND, "文件项目")
+    _fill(sqlite_backend, sqlite_project)
+
+    expected = _snapshot(FILE_BACKEND, "文件项目")
+    assert [s["镜头原文"] for s in expected["shots"]] == ["镜头原文 7", "镜头原文 4", "镜头原文 2"]
+    assert _snapshot(sqlite_backend, sqlite_project) == expected
+
+
+def test_sqlite_batch_is_atomic(sqlite_project):
+    sqlite_backend.save_shots(sqlite_project, [(1, _shot(1))])
+
+    with pytest.raises(RuntimeError):
+        with sqlite_backend._transaction(sqlite_project):
+            sqlite_backend.save_shots(sqlite_project, [(1, _shot(10)), (2, _shot(2))])
+            raise RuntimeError("中途失败")
+
+    assert sqlite_backend.get_list_shots(sqlite_project) == [1]
+    assert sqlite_backend.read_shot_info(sqlite_project, 1)["镜头原文"] == "镜头原文 1"
+
+
+def test_migrate_project_to_sqlite(sqlite_project):
+    _fill(FILE_BACKEND, sqlite_project)
+    expected = _snapshot(FILE_BACKEND, sqlite_project)
+
+    counts = sqlite_backend.migrate_project_to_sqlite(sqlite_project)
+
+    assert counts == {"总结": 4, "镜头": 3, "对象": 3, "音乐": 2}
+    assert _snapshot(sqlite_backend, sqlite_project) == expected
+    # 镜头沿用原来的文件夹
+    assert sqlite_backend.get_shot_path(sqlite_project, 1) == ffp.get_shot_path(sqlite_project, 1)
+
+    # 重复迁移结果不变
+    sqlite_backend.migrate_project_to_sqlite(sqlite_project)
+    assert _snapshot(sqlite_backend, sqlite_project) == expected
@@ -0,0 +1,122 @@
+"""
+章节存储与流式切分的测试：字节范围读写、跨块的章节标题识别、中断后续跑。
+    python -m pytest test/test_text_storage.py
+"""
+import pytest
+
+import file_of_film_project as ffp
+import modules.processor as processor
+
+CHAPTERS = [
+    ("chapter_1", "第一章 初入江湖\n少年背着剑走出山门。😀\n"),
+    ("chapter_2", "第二章 风起\n“小心！”他喊道。\n"),
+    ("chapter_3", "Chapter 3\nplain ascii text\n"),
+]
+
+
+def _novel(chapter_count=30):
+    """标题与正文混排的原文，多字节字符使标题容易跨越任意大小的块边界"""
+    parts = ["序言：这是一段没有标题的开头。\n"]
+    for i in range(1, chapter_count + 1):
+        header = f"第{i}章 标题{i}" if i % 3 else f"Chapter {i}"
+        parts.append(f"{header}\n" + "正文内容，含中文标点。" * (i % 4 + 1) + "\n\n")
+    return "".join(parts)
+
+
+def test_save_chapters_round_trip_across_batches(project):
+    ffp.save_chapters(project, CHAPTERS[:2])
+    ffp.save_chapters(project, CHAPTERS[2:])
+
+    assert ffp.get_chapter_list(project) == [cid for cid, _ in CHAPTERS]
+    for chapter_id, text in CHAPTERS:
+        assert ffp.read_chapter(project, chapter_id) == text
+    assert ffp.read_chapter(project, "chapter_404") is None
+
+
+def test_save_chapter_spans_reads_raw_text_ranges(project):
+    text = _novel(5)
+    ffp.save_raw_text(project, text)
+    raw = text.encode("utf-8")
+    first = raw.index("第1章".encode("utf-8"))
+    second = raw.index("第2章".encode("utf-8"))
+
+    ffp.save_chapter_spans(project, [
+        ("chapter_1", first, second, ""),
+        ("chapter_2", second, len(raw), "前缀\n"),
+    ])
+
+    assert ffp.read_chapter(project, "chapter_1") == raw[first:second].decode("utf-8")
+    assert ffp.read_chapter(project, "chapter_2") == "前缀\n" + raw[second:].decode("utf-8")
+
+
+def test_new_raw_text_invalidates_spans(project):
+    ffp.save_raw_text(project, _novel(3))
+    ffp.save_chapter_spans(project, [("chapter_1", 0, 10, "")])
+
+    ffp.save_raw_text(project, _novel(4))
+
+    assert ffp.get_chapter_list(project) == []
+
+
+def test_segmentation_completeness_marker(project):
+    assert not ffp.is_chapter_segmentation_complete(project)
+    ffp.save_raw_text(project, _novel(3))
+
+    ffp.save_chapter_spans(project, [("chapter_1", 0, 10, "")], complete=False)
+    assert not ffp.is_chapter_segmentation_complete(project)
+
+    ffp.save_chapter_spans(project, [("chapter_2", 10, 20, "")])
+    assert ffp.is_chapter_segmentation_complete(project)
+    assert ffp.get_chapter_list(project) == ["chapter_1", "chapter_2"]
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 7, 16, 100, 1 << 20])
+def test_header_starts_match_full_text_scan(tmp_path, block_size):
+    raw = _novel().encode("utf-8")
+    path = tmp_path / "原文.txt"
+    path.write_bytes(raw)
+
+    expected = [m.start() for m in processor.CHAPTER_PATTERN.finditer(raw)]
+    assert len(expected) == 30
+    assert list(processor._iter_header_starts(str(path), block_size)) == expected
+
+
+def test_chapter_spans_do_not_depend_on_block_size(tmp_path):
+    path = tmp_path / "原文.txt"
+    path.write_bytes(_novel().encode("utf-8"))
+
+    spans = list(processor._iter_chapter_spans(str(path), 1 << 20))
+    assert [s[0] for s in spans] == [f"chapter_{i}" for i in range(1, 31)]
+    for block_size in (3, 64):
+        assert list(processor._iter_chapter_spans(str(path), block_size)) == spans
+
+
+def test_text_without_headers_is_split_into_prefixed_parts(project):
+    text = "没有任何章节标题的一句话。\n" * 400
+    ffp.save_raw_text(project, text)
+
+    processor._format_text(project)
+
+    chapters = ffp.get_chapter_list(project)
+    assert len(chapters) > 1
+    assert ffp.read_chapter(project, "chapter_1").startswith("第 1 部分\n\n")
+    bodies = [ffp.read_chapter(project, c).split("\n\n", 1)[1] for c in chapters]
+    assert "".join(bodies).replace("\n", "") == text.replace("\n", "")
+
+
+def test_interrupted_segmentation_resumes(project, monkeypatch):
+    monkeypatch.setattr(processor, "FORMAT_FLUSH_EVERY", 4)
+    ffp.save_raw_text(project, _novel())
+
+    stream = processor._iter_format_text(project)
+    for _ in range(5):
+        next(stream)
+    stream.close()
+    assert not ffp.is_chapter_segmentation_complete(project)
+    assert len(ffp.get_chapter_list(project)) == 8
+
+    processor._format_text(project)
+
+    assert ffp.is_chapter_segmentation_complete(project)
+    assert ffp.get_chapter_list(project) == [f"chapter_{i}" for i in range(1, 31)]
+    assert ffp.read_chapter(project, "chapter_30").startswith("Chapter 30")